@@ -1,14 +1,24 @@
+import asyncio
 import logging
 import random
+import zipfile
+from typing import Optional
 
-from fastapi import APIRouter, File, UploadFile, HTTPException
+from fastapi import APIRouter, File, Form, UploadFile, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import UploadFile as FormFile
 
 from app.core.utils import allowed_file, cosine_similarity
 from app.schemas.authentication import AuthenticationWithScore
 from app.core.config import settings
-from app.services.face_analysis import image_to_array, get_embedding
-from app.services.milvus import save_user_embedding
+from app.core.metrics import REQUESTS
+from app.services.admission import AdmissionError
+from app.services.batch_verify import ImagePair, verify_pairs, zip_pairs
+from app.services.face_analysis import InvalidFaceInput
+from app.services.inference import embed_upload
+from app.services.ingest import InputMode, check_raw_content_type, parse_landmarks, read_pair_frame, read_upload
+from app.services.vector_store import get_vector_store, run_blocking
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -16,56 +26,61 @@ logger = logging.getLogger(__name__)
 class NoFaceFound(Exception):
     pass
 
-@router.post("/verify_identity", response_model=AuthenticationWithScore)
-async def verify_identity(
-    passport_image: UploadFile = File(...),
-    selfie_image: UploadFile = File(...),
+async def _verify_pair(
+    contents: list[bytes],
+    input_mode: InputMode,
+    passport_landmarks: Optional[str],
+    selfie_landmarks: Optional[str],
 ) -> AuthenticationWithScore:
-    if not (allowed_file(passport_image.filename) and allowed_file(selfie_image.filename)):
-        raise HTTPException(status_code=415, detail="Unsupported file type")
-
-    # Опционально: ограничение размера
-    max_bytes = 5 * 1024 * 1024  # 5MB
-    for upload in (passport_image, selfie_image):
-        contents = await upload.read()
-        if len(contents) > max_bytes:
-            raise HTTPException(status_code=413, detail="File too large")
-        # нужно вернуть pointer назад, сделаем временно через BytesIO
-        from io import BytesIO
-        upload.file = BytesIO(contents)
+    # лицо уже нашёл SDK: детектор не запускается, работает только распознавание
+    landmarks = [
+        parse_landmarks(raw, field) if input_mode == "landmarks" else None
+        for raw, field in ((passport_landmarks, "passport_landmarks"), (selfie_landmarks, "selfie_landmarks"))
+    ]
 
     try:
-        # CPU-bound / блокирующие преобразования выполняем в threadpool
-        passport_arr = await run_in_threadpool(image_to_array, passport_image.file)
-        selfie_arr = await run_in_threadpool(image_to_array, selfie_image.file)
-
-        try:
-            passport_emb = await run_in_threadpool(get_embedding, passport_arr)
-        except LookupError:
+        # декодирование и эмбеддинги обоих изображений идут одновременно — они попадут в один батч;
+        # повторно загруженный файл берётся из кэша эмбеддингов
+        passport_emb, selfie_emb = await asyncio.gather(
+            *(
+                embed_upload(data, landmarks=points, aligned=input_mode == "aligned")
+                for data, points in zip(contents, landmarks)
+            ),
+            return_exceptions=True,
+        )
+        for name, result in (("passport", passport_emb), ("selfie", selfie_emb)):
+            if isinstance(result, InvalidFaceInput):
+                REQUESTS.inc(endpoint="verify_identity", outcome="invalid_input")
+                raise HTTPException(status_code=422, detail=f"Invalid {name} face input: {result}")
+        if isinstance(passport_emb, LookupError):
+            REQUESTS.inc(endpoint="verify_identity", outcome="no_face")
             return AuthenticationWithScore(
                 is_authenticated=False,
                 similarity=None,
                 threshold=settings.FACE_COMPARE_THRESHOLD,
                 detail="No face detected in passport image",
             )
-        try:
-            selfie_emb = await run_in_threadpool(get_embedding, selfie_arr)
-        except LookupError:
+        if isinstance(selfie_emb, LookupError):
+            REQUESTS.inc(endpoint="verify_identity", outcome="no_face")
             return AuthenticationWithScore(
                 is_authenticated=False,
                 similarity=None,
                 threshold=settings.FACE_COMPARE_THRESHOLD,
                 detail="No face detected in selfie image",
             )
+        for result in (passport_emb, selfie_emb):
+            if isinstance(result, Exception):
+                raise result
 
         similarity = cosine_similarity(passport_emb, selfie_emb)
         is_auth = similarity >= settings.FACE_COMPARE_THRESHOLD
+        REQUESTS.inc(endpoint="verify_identity", outcome="authenticated" if is_auth else "below_threshold")
 
         if is_auth:
             import uuid
             user_id = random.randint(1000, 9999)
             logger.info(f"User {user_id} authenticated")
-            save_user_embedding(user_id, selfie_emb, source="signup")
+            await run_blocking(get_vector_store().save, user_id, selfie_emb, source="signup")
 
         # Пример асинхронной записи в Milvus: можно вынести в background task, если нужно сохранять
         # тут просто возвращаем результат
@@ -75,13 +90,103 @@ async def verify_identity(
             threshold=settings.FACE_COMPARE_THRESHOLD,
             detail=None if is_auth else "Similarity below threshold",
         )
+    except (HTTPException, AdmissionError):
+        raise
     except Exception as e:
+        REQUESTS.inc(endpoint="verify_identity", outcome="error")
         logger.exception("Error in verify_identity")
         raise HTTPException(status_code=500, detail="Internal server error")
+
+
+@router.post("/verify_identity", response_model=AuthenticationWithScore)
+async def verify_identity(
+    passport_image: UploadFile = File(...),
+    selfie_image: UploadFile = File(...),
+    input_mode: InputMode = Form("image"),
+    passport_landmarks: Optional[str] = Form(None),
+    selfie_landmarks: Optional[str] = Form(None),
+) -> AuthenticationWithScore:
+    if not (allowed_file(passport_image.filename) and allowed_file(selfie_image.filename)):
+        raise HTTPException(status_code=415, detail="Unsupported file type")
+
+    try:
+        # ограничение размера: слишком большой файл отклоняется без чтения
+        contents = [
+            await read_upload(upload, settings.INGEST_MAX_FILE_BYTES)
+            for upload in (passport_image, selfie_image)
+        ]
+        return await _verify_pair(contents, input_mode, passport_landmarks, selfie_landmarks)
     finally:
-        # UploadFile .file может быть заменён выше, но попытка закрыть безопасна
         try:
             passport_image.file.close()
             selfie_image.file.close()
         except Exception:
             pass
+
+
+@router.post("/verify_identity_raw", response_model=AuthenticationWithScore)
+async def verify_identity_raw(
+    request: Request,
+    input_mode: InputMode = "image",
+    passport_landmarks: Optional[str] = None,
+    selfie_landmarks: Optional[str] = None,
+) -> AuthenticationWithScore:
+    """
+    То же, что /verify_identity, для вызовов сервис-сервис: без multipart.
+
+    Тело application/octet-stream — кадр "FAP1" | uint32 BE длина паспорта |
+    uint32 BE длина селфи | паспорт | селфи. Точки для input_mode=landmarks — в query (JSON).
+    """
+    check_raw_content_type(request)
+    contents = list(await read_pair_frame(request, settings.INGEST_MAX_FILE_BYTES))
+    return await _verify_pair(contents, input_mode, passport_landmarks, selfie_landmarks)
+
+
+@router.post(
+    "/verify_identity_batch",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"application/x-ndjson": {}}}},
+)
+async def verify_identity_batch(request: Request) -> StreamingResponse:
+    """
+    Пакетная проверка пар паспорт/селфи (без записи в историю).
+
+    multipart/form-data: либо списки passport_images и selfie_images (пары по порядку),
+    либо один zip в поле archive. Ответ — NDJSON, по строке BatchAuthenticationResult на пару.
+    """
+    max_pairs = settings.BATCH_VERIFY_MAX_PAIRS
+    # форму разбираем сами: файлы должны оставаться открытыми, пока идёт стриминг ответа
+    form = await request.form(max_files=2 * max_pairs + 1, max_fields=2 * max_pairs + 1)
+    try:
+        archive_upload = form.get("archive")
+        if isinstance(archive_upload, FormFile):
+            try:
+                archive = await run_in_threadpool(zipfile.ZipFile, archive_upload.file)
+            except zipfile.BadZipFile:
+                raise HTTPException(status_code=400, detail="Archive is not a valid zip file")
+            pairs = zip_pairs(archive)
+        else:
+            passports = [f for f in form.getlist("passport_images") if isinstance(f, FormFile)]
+            selfies = [f for f in form.getlist("selfie_images") if isinstance(f, FormFile)]
+            if len(passports) != len(selfies):
+                raise HTTPException(status_code=400, detail="passport_images and selfie_images must be paired")
+            pairs = [
+                ImagePair(str(i), p.filename, s.filename, p.read, s.read)
+                for i, (p, s) in enumerate(zip(passports, selfies))
+            ]
+        if not pairs:
+            raise HTTPException(status_code=400, detail="No image pairs provided")
+        if len(pairs) > max_pairs:
+            raise HTTPException(status_code=413, detail=f"Too many pairs (max {max_pairs})")
+    except BaseException:
+        await form.close()
+        raise
+
+    async def stream():
+        try:
+            async for result in verify_pairs(pairs, settings.BATCH_VERIFY_CHUNK_PAIRS):
+                yield result.model_dump_json() + "\n"
+        finally:
+            await form.close()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
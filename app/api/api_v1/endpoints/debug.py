@@ -1,10 +1,48 @@
-from collections import Counter
+import logging
+from datetime import datetime
+from typing import Optional
 
 from fastapi import APIRouter
+from fastapi import HTTPException
 from fastapi import Path
+from fastapi import Query
+
+from app.core.config import settings
 
 router = APIRouter()
 
+logger = logging.getLogger(__name__)
+
+
+def _fmt(ts_ms):
+    try:
+        return datetime.utcfromtimestamp(ts_ms / 1000).isoformat() + "Z"
+    except Exception:
+        return None
+
+
+# статические пути /debug/history/... объявляются до /debug/history/{user_id}, иначе их перехватит он
+@router.get("/debug/history/compaction")
+async def debug_history_compaction():
+    """
+    Состояние задания компакции (python -m app.services.history_manager): в процессах API
+    она не запущена, поэтому счётчики читаются из файла статуса, который пишет задание.
+    """
+    from app.services.history_manager import read_compaction_status
+
+    if not settings.HISTORY_COMPACTION_ENABLED:
+        return {"enabled": False}
+    path = settings.HISTORY_COMPACTION_STATUS_PATH
+    status = read_compaction_status(path) if path else None
+    if status is None:
+        return {"enabled": True, "reported": False, "note": "Compaction job has not reported yet"}
+    return {
+        "enabled": True,
+        "reported": True,
+        **status,
+        "updated_at": _fmt(status.get("updated_at_ms")),
+    }
+
 
 @router.get("/debug/history/{user_id}")
 async def debug_user_history(user_id: int = Path(..., description="ID пользователя для истории")):
@@ -12,16 +50,11 @@ async def debug_user_history(user_id: int = Path(..., description="ID польз
     Показывает статистику по сохранённым эмбеддингам в истории пользователя.
     """
     try:
-        # Получаем коллекцию истории (создаст, если ещё нет)
-        from app.services.milvus import init_history_collection  # или поправь путь, если module отличается
-        coll = init_history_collection()
+        from app.services.vector_store import get_vector_store, run_blocking
 
-        # Выбираем все записи для user_id
-        expr = f"user_id == {user_id}"
-        # Запросим scalar поля: user_id, created_at, source
-        results = coll.query(expr=expr, output_fields=["user_id", "created_at", "source"])
+        stats = await run_blocking(get_vector_store().history_stats, user_id)
 
-        if not results:
+        if not stats["total"]:
             return {
                 "user_id": user_id,
                 "total": 0,
@@ -32,49 +65,82 @@ async def debug_user_history(user_id: int = Path(..., description="ID польз
                 "note": "No embeddings found for this user",
             }
 
-        # Преобразуем и сортируем по created_at
-        # each result is dict like {"user_id":..., "created_at":..., "source":...}
-        sorted_by_time = sorted(results, key=lambda r: r.get("created_at", 0))
-        created_times = [r["created_at"] for r in sorted_by_time if "created_at" in r]
-        sources = [r.get("source", "unknown") for r in sorted_by_time]
-
-        # Конвертация timestamp в readable (если нужно)
-        from datetime import datetime
-        def fmt(ts_ms):
-            try:
-                return datetime.utcfromtimestamp(ts_ms / 1000).isoformat() + "Z"
-            except Exception:
-                return None
-
-        first_seen = fmt(created_times[0]) if created_times else None
-        last_seen = fmt(created_times[-1]) if created_times else None
-
-        # Интервалы между сохранениями
-        intervals = []
-        for earlier, later in zip(created_times, created_times[1:]):
-            intervals.append(later - earlier)
-        avg_interval_ms = sum(intervals) / len(intervals) if intervals else None
-
-        # Соберём последние N записей для вывода
-        recent = sorted_by_time[-5:]
-        recent_records = [
-            {
-                "created_at": fmt(r["created_at"]) if "created_at" in r else None,
-                "source": r.get("source"),
-            }
-            for r in reversed(recent)
-        ]
-
         return {
             "user_id": user_id,
-            "total": len(results),
-            "by_source": dict(Counter(sources)),
-            "first_seen": first_seen,
-            "last_seen": last_seen,
-            "average_interval_ms": avg_interval_ms,
-            "recent_records": recent_records,
+            "total": stats["total"],
+            "by_source": stats["by_source"],
+            "first_seen": _fmt(stats["first_seen_ms"]),
+            "last_seen": _fmt(stats["last_seen_ms"]),
+            "average_interval_ms": stats["average_interval_ms"],
+            # true — история больше HISTORY_STATS_MAX_ROWS, посчитаны только первые строки по id
+            "truncated": stats["truncated"],
+            "recent_records": [
+                {"created_at": _fmt(r["created_at_ms"]), "source": r["source"]}
+                for r in stats["recent"]
+            ],
         }
 
     except Exception:
         logger.exception("failed to fetch user history for debug")
-        raise HTTPException(status_code=500, detail="Internal server error")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
+@router.get("/debug/history/{user_id}/records")
+async def debug_user_history_records(
+    user_id: int = Path(..., description="ID пользователя"),
+    cursor: Optional[int] = Query(None, description="id последней записи предыдущей страницы"),
+    limit: int = Query(100, ge=1, le=settings.HISTORY_RECORDS_MAX_LIMIT),
+):
+    """
+    Записи истории пользователя страницами по возрастанию id.
+    """
+    try:
+        from app.services.vector_store import get_vector_store, run_blocking
+
+        records, next_cursor = await run_blocking(get_vector_store().history_records, user_id, cursor, limit)
+    except Exception:
+        logger.exception("failed to fetch user history records for debug")
+        raise HTTPException(status_code=500, detail="Internal server error")
+    return {
+        "user_id": user_id,
+        "records": [
+            {"id": r["id"], "created_at": _fmt(r["created_at_ms"]), "source": r["source"]} for r in records
+        ],
+        "next_cursor": next_cursor,
+    }
+
+
+@router.get("/debug/cache/embeddings")
+async def debug_embedding_cache():
+    """
+    Счётчики попаданий/промахов кэша эмбеддингов.
+    """
+    from app.services.embedding_cache import get_embedding_cache
+
+    cache = get_embedding_cache()
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.stats()}
+
+
+@router.get("/debug/cache/templates")
+async def debug_template_cache():
+    """
+    Кэш шаблонов пользователей: размер и попадания.
+    """
+    from app.services.template_cache import get_template_cache
+
+    cache = get_template_cache()
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.stats()}
+
+
+@router.get("/debug/milvus/pool")
+async def debug_milvus_pool():
+    """
+    Состояние пула соединений Milvus.
+    """
+    from app.services.milvus import get_milvus_pool
+
+    return get_milvus_pool().stats()
@@ -0,0 +1,22 @@
+from fastapi import APIRouter
+from starlette.responses import Response
+
+from app.services.warmup import is_ready, readiness_state
+
+router = APIRouter()
+
+
+@router.get("/live")
+async def liveness():
+    return {"status": "ok"}
+
+
+@router.get("/ready")
+async def readiness(response: Response):
+    """
+    Готов ли инстанс принимать трафик: модель загружена и прогрета, хранилище истории доступно.
+    """
+    ready = is_ready()
+    if not ready:
+        response.status_code = 503
+    return {"ready": ready, "components": readiness_state()}
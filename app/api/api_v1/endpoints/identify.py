@@ -0,0 +1,70 @@
+import logging
+from fastapi import APIRouter, File, UploadFile, HTTPException, Query
+
+from app.core.utils import allowed_file
+from app.schemas.identification import IdentificationCandidate, IdentificationResult
+from app.core.config import settings
+from app.core.metrics import REQUESTS
+from app.services.admission import AdmissionError
+from app.services.inference import embed_upload
+from app.services.ingest import read_upload
+from app.services.vector_store import get_vector_store, run_blocking
+
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+
+@router.post("/search", response_model=IdentificationResult)
+async def identify_user(
+    selfie_image: UploadFile = File(...),
+    top_k: int = Query(settings.IDENTIFY_TOP_K, ge=1, le=settings.IDENTIFY_MAX_TOP_K),
+) -> IdentificationResult:
+    """1:N поиск: кандидаты среди всех пользователей с историей (по лучшему эмбеддингу каждого)."""
+    if not allowed_file(selfie_image.filename):
+        raise HTTPException(status_code=415, detail="Unsupported file type")
+
+    contents = await read_upload(selfie_image, settings.INGEST_MAX_FILE_BYTES)
+
+    try:
+        try:
+            selfie_emb = await embed_upload(contents)
+        except LookupError:
+            REQUESTS.inc(endpoint="identify", outcome="no_face")
+            return IdentificationResult(
+                threshold=settings.FACE_COMPARE_THRESHOLD,
+                detail="No face detected in selfie image",
+            )
+
+        try:
+            hits = await run_blocking(get_vector_store().identify, selfie_emb, top_k=top_k)
+        except Exception:
+            REQUESTS.inc(endpoint="identify", outcome="history_unavailable")
+            logger.exception("identification search failed")
+            raise HTTPException(status_code=503, detail="History unavailable")
+
+        matched = any(hit.score >= settings.FACE_COMPARE_THRESHOLD for hit in hits)
+        REQUESTS.inc(endpoint="identify", outcome="match" if matched else "no_match")
+        return IdentificationResult(
+            candidates=[
+                IdentificationCandidate(
+                    user_id=hit.user_id,
+                    similarity=hit.score,
+                    is_match=hit.score >= settings.FACE_COMPARE_THRESHOLD,
+                )
+                for hit in hits
+            ],
+            threshold=settings.FACE_COMPARE_THRESHOLD,
+            detail=None if hits else "No enrolled users found",
+        )
+    except (HTTPException, AdmissionError):
+        raise
+    except Exception:
+        REQUESTS.inc(endpoint="identify", outcome="error")
+        logger.exception("identify_user failed")
+        raise HTTPException(status_code=500, detail="Internal server error")
+    finally:
+        try:
+            selfie_image.file.close()
+        except Exception:
+            pass
@@ -1,12 +1,18 @@
 import logging
-from fastapi import APIRouter, File, UploadFile, HTTPException, Depends
-from starlette.concurrency import run_in_threadpool
+from typing import Optional
+
+from fastapi import APIRouter, File, Form, UploadFile, HTTPException, Depends, Request
 
 from app.core.utils import allowed_file
 from app.schemas.authentication import AuthenticationWithScore
 from app.core.config import settings
-from app.services.face_analysis import image_to_array, get_embedding
-from app.services.milvus import search_user_history, save_user_embedding
+from app.core.metrics import REQUESTS
+from app.services.admission import AdmissionError
+from app.services.face_analysis import InvalidFaceInput
+from app.services.history_manager import remember_embedding
+from app.services.inference import embed_upload
+from app.services.ingest import InputMode, check_raw_content_type, parse_landmarks, read_body, read_upload
+from app.services.vector_store import get_vector_store, run_blocking
 
 
 router = APIRouter()
@@ -20,26 +26,22 @@ def get_current_user():
     return User()
 
 
-@router.post("/verify", response_model=AuthenticationWithScore)
-async def verify_existing_user(
-    selfie_image: UploadFile = File(...),
-    current_user=Depends(get_current_user),
+async def _verify_selfie(
+    contents: bytes,
+    user_id: int,
+    input_mode: InputMode,
+    selfie_landmarks: Optional[str],
 ) -> AuthenticationWithScore:
-    if not allowed_file(selfie_image.filename):
-        raise HTTPException(status_code=415, detail="Unsupported file type")
-
-    max_bytes = 5 * 1024 * 1024
-    contents = await selfie_image.read()
-    if len(contents) > max_bytes:
-        raise HTTPException(status_code=413, detail="File too large")
-    from io import BytesIO
-    selfie_image.file = BytesIO(contents)
+    landmarks = parse_landmarks(selfie_landmarks, "selfie_landmarks") if input_mode == "landmarks" else None
 
     try:
-        selfie_arr = await run_in_threadpool(image_to_array, selfie_image.file)
         try:
-            selfie_emb = await run_in_threadpool(get_embedding, selfie_arr)
+            selfie_emb = await embed_upload(contents, landmarks=landmarks, aligned=input_mode == "aligned")
+        except InvalidFaceInput as e:
+            REQUESTS.inc(endpoint="verify_user", outcome="invalid_input")
+            raise HTTPException(status_code=422, detail=f"Invalid selfie face input: {e}")
         except LookupError:
+            REQUESTS.inc(endpoint="verify_user", outcome="no_face")
             return AuthenticationWithScore(
                 is_authenticated=False,
                 similarity=None,
@@ -49,10 +51,10 @@ async def verify_existing_user(
 
         # Пытаемся найти историю
         try:
-            results = search_user_history(selfie_emb, user_id=current_user.id, top_k=3)
-            print(results, current_user.id)
+            hits = await run_blocking(get_vector_store().search_user, selfie_emb, user_id, top_k=3)
         except Exception:
             # проблема с history collection — fallback
+            REQUESTS.inc(endpoint="verify_user", outcome="history_unavailable")
             return AuthenticationWithScore(
                 is_authenticated=False,
                 similarity=None,
@@ -60,7 +62,8 @@ async def verify_existing_user(
                 detail="History unavailable; please reverify with full identity flow",
             )
 
-        if not results or not results[0]:
+        if not hits:
+            REQUESTS.inc(endpoint="verify_user", outcome="no_history")
             return AuthenticationWithScore(
                 is_authenticated=False,
                 similarity=None,
@@ -68,13 +71,14 @@ async def verify_existing_user(
                 detail="No prior embeddings found for user; please reverify with full flow",
             )
 
-        best_score = results[0][0].score
+        best_score = hits[0].score
         is_auth = best_score >= settings.FACE_COMPARE_THRESHOLD
 
         if is_auth:
-            # сохраняем новое селфи как обновление истории
-            save_user_embedding(current_user.id, selfie_emb, source="reauth")
+            # сохраняем новое селфи как обновление истории, если оно не почти копия лучшего совпадения
+            await run_blocking(remember_embedding, user_id, selfie_emb, "reauth", best_score)
 
+        REQUESTS.inc(endpoint="verify_user", outcome="authenticated" if is_auth else "below_threshold")
         detail = None if is_auth else "Similarity below threshold"
         return AuthenticationWithScore(
             is_authenticated=is_auth,
@@ -82,11 +86,44 @@ async def verify_existing_user(
             threshold=settings.FACE_COMPARE_THRESHOLD,
             detail=detail,
         )
+    except (HTTPException, AdmissionError):
+        raise
     except Exception:
+        REQUESTS.inc(endpoint="verify_user", outcome="error")
         logger.exception("verify_existing_user failed")
         raise HTTPException(status_code=500, detail="Internal server error")
+
+
+@router.post("/verify", response_model=AuthenticationWithScore)
+async def verify_existing_user(
+    selfie_image: UploadFile = File(...),
+    input_mode: InputMode = Form("image"),
+    selfie_landmarks: Optional[str] = Form(None),
+    current_user=Depends(get_current_user),
+) -> AuthenticationWithScore:
+    if not allowed_file(selfie_image.filename):
+        raise HTTPException(status_code=415, detail="Unsupported file type")
+
+    try:
+        contents = await read_upload(selfie_image, settings.INGEST_MAX_FILE_BYTES)
+        return await _verify_selfie(contents, current_user.id, input_mode, selfie_landmarks)
     finally:
         try:
             selfie_image.file.close()
         except Exception:
             pass
+
+
+@router.post("/verify_raw", response_model=AuthenticationWithScore)
+async def verify_existing_user_raw(
+    request: Request,
+    input_mode: InputMode = "image",
+    selfie_landmarks: Optional[str] = None,
+    current_user=Depends(get_current_user),
+) -> AuthenticationWithScore:
+    """
+    То же, что /verify, без multipart: тело запроса — само селфи (application/octet-stream или image/*).
+    """
+    check_raw_content_type(request)
+    contents = await read_body(request, settings.INGEST_MAX_FILE_BYTES)
+    return await _verify_selfie(contents, current_user.id, input_mode, selfie_landmarks)
@@ -0,0 +1,20 @@
+from anyio import to_thread
+from fastapi import APIRouter
+from starlette.responses import PlainTextResponse
+
+from app.core.metrics import registry
+
+
+router = APIRouter()
+
+# считается при чтении /metrics в event loop, где доступен лимитер threadpool'а
+registry.gauge(
+    "face_auth_threadpool_busy",
+    "Busy threads of the request threadpool (decode, cache, inference batches)",
+    fn=lambda: to_thread.current_default_thread_limiter().borrowed_tokens,
+)
+
+
+@router.get("/metrics", include_in_schema=False, response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
@@ -1,4 +1,4 @@
-from typing import List
+from typing import Any, Dict, List, Literal, Optional
 from urllib.parse import urlparse
 import json
 
@@ -19,10 +19,153 @@ class Settings(BaseSettings):
 
     FACE_COMPARE_THRESHOLD: float = 0.35
 
+    # метрики: /metrics в формате Prometheus включён всегда; заголовок Server-Timing с временем стадий — по флагу
+    SERVER_TIMING_ENABLED: bool = False
+
+    # батчинг инференса: задачи от конкурентных запросов собираются в один прогон модели
+    INFERENCE_BATCHING_ENABLED: bool = True
+    INFERENCE_MAX_BATCH_SIZE: int = 16
+    INFERENCE_MAX_WAIT_MS: float = 5.0
+    # >0: детекция и эмбеддинги считаются в пуле из N процессов (изображения передаются через shared memory)
+    INFERENCE_WORKERS: int = 0
+    # изображений в очереди батчера; при переполнении запрос сразу получает 503
+    INFERENCE_MAX_QUEUE: int = 256
+
+    # admission control: одновременных запросов на эндпоинт и сколько может ждать слота,
+    # остальным 503 + Retry-After; дедлайн запроса — из заголовка (мс) или по умолчанию
+    ADMISSION_ENABLED: bool = True
+    ADMISSION_VERIFY_IDENTITY_CONCURRENCY: int = 8
+    ADMISSION_VERIFY_USER_CONCURRENCY: int = 16
+    ADMISSION_IDENTIFY_CONCURRENCY: int = 8
+    ADMISSION_BATCH_CONCURRENCY: int = 2
+    ADMISSION_MAX_WAITING: int = 32
+    ADMISSION_RETRY_AFTER_S: int = 1
+    REQUEST_TIMEOUT_HEADER: str = "X-Request-Timeout-Ms"
+    REQUEST_DEFAULT_TIMEOUT_MS: Optional[float] = 10000
+
+    # приём изображений: лимит на файл и на тело запроса (проверяется до разбора multipart);
+    # JPEG декодируется в уменьшенном масштабе до ~INGEST_MAX_SIDE по длинной стороне,
+    # остальное — не больше 2x; 0 — без ограничения
+    INGEST_MAX_FILE_BYTES: int = 5 * 1024 * 1024
+    INGEST_MAX_REQUEST_BYTES: int = 12 * 1024 * 1024
+    INGEST_MAX_SIDE: int = 960
+
+    # пакетная проверка пар паспорт/селфи: пары считаются чанками, результаты отдаются NDJSON
+    BATCH_VERIFY_MAX_PAIRS: int = 10000
+    BATCH_VERIFY_CHUNK_PAIRS: int = 32
+    BATCH_VERIFY_MAX_FILE_BYTES: int = 5 * 1024 * 1024
+    BATCH_VERIFY_MAX_REQUEST_BYTES: int = 2 * 1024 * 1024 * 1024
+
+    # массовый импорт (python -m app.services.bulk_import): декодирование в IMPORT_DECODE_WORKERS потоках,
+    # модель батчами по IMPORT_MODEL_BATCH, вставка в историю чанками по IMPORT_CHUNK_SIZE с чекпоинтом после каждого
+    IMPORT_DECODE_WORKERS: int = 4
+    IMPORT_MODEL_BATCH: int = 32
+    IMPORT_CHUNK_SIZE: int = 512
+    IMPORT_PROGRESS_INTERVAL_S: float = 10
+
+    # модели insightface: грузим только нужные модули пакета
+    FACE_MODEL_PACK: str = "buffalo_l"
+    FACE_MODEL_ROOT: str = "~/.insightface"
+    FACE_ALLOWED_MODULES: List[str] = Field(default_factory=lambda: ["detection", "recognition"])
+    FACE_DET_SIZE: int = 640
+    FACE_DET_THRESH: float = 0.5
+    # input_mode=landmarks: проверка клиентских ключевых точек до выравнивания (детектор не запускается);
+    # отклонение формы от шаблона ArcFace — RMS в долях межглазного расстояния
+    FACE_LANDMARKS_MIN_EYE_DISTANCE: float = 16.0
+    FACE_LANDMARKS_MAX_DEVIATION: float = 0.3
+    FACE_LANDMARKS_MAX_ROLL_DEG: float = 45.0
+
+    # onnxruntime: 0 — значение по умолчанию рантайма
+    ONNX_INTRA_OP_THREADS: int = 0
+    ONNX_INTER_OP_THREADS: int = 0
+    ONNX_GRAPH_OPTIMIZATION: Literal["disabled", "basic", "extended", "all"] = "all"
+    # каталог для кэша оптимизированных графов; None — оптимизация при каждом старте
+    ONNX_OPTIMIZED_MODEL_DIR: Optional[str] = None
+
+    # прогрев при старте: загрузка модели и несколько синтетических прогонов до readiness
+    WARMUP_ON_STARTUP: bool = True
+    WARMUP_ITERATIONS: int = 3
+    # неудавшийся шаг прогрева повторяется в фоне с экспоненциальной паузой до WARMUP_RETRY_MAX_S
+    WARMUP_RETRY_INITIAL_S: float = 1
+    WARMUP_RETRY_MAX_S: float = 30
+
+    # кэш эмбеддингов по sha256 загруженного файла
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_MAX_ENTRIES: int = 10000
+    EMBEDDING_CACHE_TTL_S: float = 3600
+    # redis://... — общий кэш для всех воркеров и инстансов (нужен пакет redis)
+    EMBEDDING_CACHE_REDIS_URL: Optional[str] = None
+
+    # хранилище истории: "milvus" или "local" (memory-mapped матрица в одном процессе)
+    VECTOR_STORE_BACKEND: Literal["milvus", "local"] = "milvus"
+    # вызовы из async-эндпоинтов: таймаут на вызов и ограничение одновременных операций
+    VECTOR_STORE_TIMEOUT_S: float = 2.0
+    VECTOR_STORE_MAX_CONCURRENCY: int = 8
+    LOCAL_STORE_PATH: str = "./data/local_store"
+    LOCAL_STORE_BLOCK_ROWS: int = 65536
+    # identify: во сколько раз больше кандидатов брать до группировки по пользователю
+    IDENTIFY_OVERSAMPLE: int = 4
+    IDENTIFY_TOP_K: int = 5
+    IDENTIFY_MAX_TOP_K: int = 50
+
     MILVUS_HOST: str = "localhost"
     MILVUS_PORT: str = "19530"
     MILVUS_COLLECTION: str = "face_embeddings"
     MILVUS_DIM: int = 512
+    # пул соединений: примерно по соединению на одновременный запрос к Milvus
+    MILVUS_POOL_SIZE: int = 8
+    MILVUS_CONNECT_TIMEOUT_S: float = 10
+    MILVUS_RECONNECT_RETRIES: int = 3
+    MILVUS_RECONNECT_BACKOFF_MS: float = 200
+    MILVUS_TIMEOUT_S: float = 2.0
+    # ANN-индекс по embedding (JSON в env), например HNSW: {"M": 16, "efConstruction": 200} / {"ef": 64};
+    # для HNSW ef поднимается до limit поиска (identify и rerank берут кандидатов с запасом).
+    # При смене типа или параметров индекс пересоздаётся на старте
+    MILVUS_INDEX_TYPE: str = "IVF_FLAT"
+    MILVUS_INDEX_PARAMS: Dict[str, Any] = Field(default_factory=lambda: {"nlist": 128})
+    MILVUS_SEARCH_PARAMS: Dict[str, Any] = Field(default_factory=lambda: {"nprobe": 10})
+    # компактное хранение истории: float16 вдвое меньше float32 (Milvus >= 2.4, только для новых коллекций);
+    # int8/PQ-коды — MILVUS_INDEX_TYPE=IVF_SQ8 / IVF_PQ (например {"nlist": 1024, "m": 64, "nbits": 8}).
+    # MILVUS_RERANK_FACTOR > 0: ANN отдаёт top_k * factor кандидатов, они пересчитываются точно по сохранённым векторам
+    MILVUS_VECTOR_TYPE: Literal["float32", "float16"] = "float32"
+    MILVUS_RERANK_FACTOR: int = 0
+
+    # история: user_id — partition key; "exact" — достаём векторы пользователя и считаем точно, "ann" — IVF с фильтром
+    HISTORY_SEARCH_MODE: Literal["exact", "ann"] = "exact"
+    HISTORY_EXACT_MAX_ROWS: int = 1000
+    HISTORY_NUM_PARTITIONS: int = 64
+    # отладочные эндпоинты: статистика истории читается страницами, записи отдаются курсором по id;
+    # у огромной истории статистика считается по первым HISTORY_STATS_MAX_ROWS строкам (truncated=true),
+    # чтобы опрос дашборда не занимал потоки и соединения Milvus, нужные проверке
+    HISTORY_STATS_PAGE_SIZE: int = 1000
+    HISTORY_STATS_MAX_ROWS: int = 20000
+    HISTORY_RECORDS_MAX_LIMIT: int = 500
+    # exact-режим: read-through кэш шаблонов активных пользователей (LRU по байтам, 0 — выключен);
+    # TTL ограничивает, насколько долго не видны записи других инстансов
+    HISTORY_TEMPLATE_CACHE_BYTES: int = 64 * 1024 * 1024
+    HISTORY_TEMPLATE_CACHE_TTL_S: float = 300
+
+    # write-behind для истории: строки вставляются пачками по размеру или по времени,
+    # поэтому новая строка становится видна поиску с задержкой до HISTORY_FLUSH_INTERVAL_MS
+    HISTORY_WRITE_BEHIND: bool = True
+    HISTORY_BATCH_SIZE: int = 256
+    HISTORY_FLUSH_INTERVAL_MS: float = 500
+    HISTORY_MAX_BUFFER: int = 10000
+    HISTORY_SHUTDOWN_TIMEOUT_S: float = 10
+    # локальный журнал невставленных строк (переживает падение процесса); None — без журнала
+    HISTORY_SPOOL_DIR: Optional[str] = None
+
+    # компакция истории: новое селфи не пишется, если сходство с сохранённым >= порога (None — писать всё);
+    # на пользователя остаётся центроид + до HISTORY_MAX_TEMPLATES-1 самых разных образцов не старше RETENTION_DAYS
+    HISTORY_DEDUP_THRESHOLD: Optional[float] = 0.95
+    HISTORY_MAX_TEMPLATES: int = 20
+    HISTORY_RETENTION_DAYS: Optional[float] = 365
+    HISTORY_COMPACTION_ENABLED: bool = True
+    HISTORY_COMPACTION_INTERVAL_S: float = 60
+    HISTORY_RETENTION_SWEEP_INTERVAL_S: float = 86400
+    # файл, куда задание компакции пишет счётчики после каждого прохода; API читает его для
+    # /debug/history/compaction (каталог должен быть общим у задания и API); None — не писать
+    HISTORY_COMPACTION_STATUS_PATH: Optional[str] = "./data/history_compaction.json"
 
     BACKEND_CORS_ORIGINS: List[str] = Field(default_factory=list)
 
@@ -15,3 +15,19 @@ def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
     if norma == 0 or normb == 0:
         return 0.0
     return float(np.dot(a, b) / (norma * normb))
+
+
+def normalize_embedding(emb: np.ndarray) -> np.ndarray:
+    """L2-нормировка вектора или строк матрицы (float32); нулевой вектор остаётся нулевым."""
+    emb = np.asarray(emb, dtype=np.float32)
+    norm = np.linalg.norm(emb, axis=-1, keepdims=True)
+    return np.divide(emb, norm, out=np.zeros_like(emb), where=norm > 0)
+
+
+def pairwise_cosine_similarity(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Косинусное сходство строк a[i] и b[i] для матриц (n, d); нулевые векторы дают 0."""
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    norms = np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1)
+    dots = np.einsum("ij,ij->i", a, b)
+    return np.divide(dots, norms, out=np.zeros_like(dots), where=norms > 0)
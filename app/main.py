@@ -1,15 +1,23 @@
+import asyncio
 import logging
 
 from fastapi import FastAPI
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.cors import CORSMiddleware
 from starlette.requests import Request
 from starlette.responses import HTMLResponse
 from starlette.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 
+from app.api import metrics
 from app.api.api_v1.routers import api_router
 from app.core.config import settings
-from app.services.milvus import get_collection
+from app.core.metrics import ServerTimingMiddleware
+from app.services.admission import AdmissionError, AdmissionMiddleware, AdmissionRoute, error_response
+from app.services.inference import shutdown_inference
+from app.services.ingest import BodySizeLimitMiddleware
+from app.services.vector_store import close_vector_store, get_vector_store, shutdown_store_executor
+from app.services.warmup import run_warmup
 
 logger = logging.getLogger("face_auth_api")
 logging.basicConfig(level=logging.INFO)
@@ -20,13 +28,28 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
 @app.on_event("startup")
-def on_startup():
-    # предварительно инициализируем Milvus (соединение + коллекцию)
-    try:
-        get_collection()
-        logger.info("Milvus collection ready")
-    except Exception:
-        logger.exception("Failed to initialize Milvus collection")
+async def on_startup():
+    get_vector_store().start()
+    # компакция истории здесь не запускается: это отдельное задание в одном экземпляре
+    # (python -m app.services.history_manager), иначе каждый воркер компактил бы тех же пользователей
+    # прогрев (Milvus + модель) идёт в фоне: liveness отвечает сразу,
+    # а readiness станет зелёным, когда всё будет загружено
+    if settings.WARMUP_ON_STARTUP:
+        app.state.warmup_task = asyncio.create_task(run_warmup())
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    warmup_task = getattr(app.state, "warmup_task", None)
+    if warmup_task is not None:
+        warmup_task.cancel()
+    await shutdown_inference()
+    await run_in_threadpool(shutdown_store_executor)
+    await run_in_threadpool(close_vector_store)
+
+@app.exception_handler(AdmissionError)
+async def on_admission_error(request: Request, exc: AdmissionError):
+    # очередь инференса и дедлайн поднимают AdmissionError уже внутри обработчика
+    return error_response(exc)
 
 @app.get("/", response_class=HTMLResponse, include_in_schema=False)
 async def homepage(request: Request):
@@ -40,4 +63,40 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# слот и дедлайн — до чтения тела: отказ при перегрузке не принимает и не разбирает multipart
+_verify_identity = AdmissionRoute(
+    "verify_identity", settings.ADMISSION_VERIFY_IDENTITY_CONCURRENCY, settings.REQUEST_DEFAULT_TIMEOUT_MS
+)
+_verify_user = AdmissionRoute(
+    "verify_user", settings.ADMISSION_VERIFY_USER_CONCURRENCY, settings.REQUEST_DEFAULT_TIMEOUT_MS
+)
+app.add_middleware(
+    AdmissionMiddleware,
+    routes={
+        f"{settings.API_V1_STR}/verify-identity/verify_identity": _verify_identity,
+        f"{settings.API_V1_STR}/verify-identity/verify_identity_raw": _verify_identity,
+        f"{settings.API_V1_STR}/verify-user/verify": _verify_user,
+        f"{settings.API_V1_STR}/verify-user/verify_raw": _verify_user,
+        f"{settings.API_V1_STR}/identify/search": AdmissionRoute(
+            "identify", settings.ADMISSION_IDENTIFY_CONCURRENCY, settings.REQUEST_DEFAULT_TIMEOUT_MS
+        ),
+        # дедлайн — только если клиент прислал заголовок; слот держится, пока идёт стриминг
+        f"{settings.API_V1_STR}/verify-identity/verify_identity_batch": AdmissionRoute(
+            "verify_identity_batch", settings.ADMISSION_BATCH_CONCURRENCY, None
+        ),
+    },
+)
+
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    max_bytes=settings.INGEST_MAX_REQUEST_BYTES,
+    overrides={
+        f"{settings.API_V1_STR}/verify-identity/verify_identity_batch": settings.BATCH_VERIFY_MAX_REQUEST_BYTES,
+    },
+)
+
+if settings.SERVER_TIMING_ENABLED:
+    app.add_middleware(ServerTimingMiddleware)
+
 app.include_router(api_router, prefix=settings.API_V1_STR)
+app.include_router(metrics.router)
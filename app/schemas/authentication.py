@@ -5,4 +5,9 @@ class AuthenticationWithScore(BaseModel):
     is_authenticated: bool = False
     similarity: float | None = None
     threshold: float
-    detail: str | None = None
\ No newline at end of file
+    detail: str | None = None
+
+
+class BatchAuthenticationResult(AuthenticationWithScore):
+    index: int
+    pair_id: str
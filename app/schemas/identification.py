@@ -0,0 +1,13 @@
+from pydantic import BaseModel
+
+
+class IdentificationCandidate(BaseModel):
+    user_id: int
+    similarity: float
+    is_match: bool
+
+
+class IdentificationResult(BaseModel):
+    candidates: list[IdentificationCandidate] = []
+    threshold: float
+    detail: str | None = None
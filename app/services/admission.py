@@ -0,0 +1,175 @@
+import asyncio
+import contextvars
+import time
+from typing import NamedTuple, Optional
+
+from fastapi import Request
+from starlette.responses import JSONResponse
+
+from app.core.config import settings
+from app.core.metrics import registry
+
+
+ADMISSION_REJECTED = registry.counter(
+    "face_auth_admission_rejected_total", "Requests rejected before inference", ["endpoint", "reason"]
+)
+ADMISSION_IN_FLIGHT = registry.gauge(
+    "face_auth_admission_in_flight", "Admitted requests per endpoint", ["endpoint"]
+)
+ADMISSION_WAITING = registry.gauge(
+    "face_auth_admission_waiting", "Requests waiting for an admission slot", ["endpoint"]
+)
+
+
+class AdmissionError(Exception):
+    pass
+
+
+class Overloaded(AdmissionError):
+    """Очередь заполнена — клиенту 503 с Retry-After."""
+
+
+class DeadlineExceeded(AdmissionError):
+    """Дедлайн запроса прошёл до начала работы — считать уже некому."""
+
+
+# абсолютный дедлайн запроса по time.monotonic(); None — без дедлайна
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("request_deadline", default=None)
+
+
+def current_deadline() -> Optional[float]:
+    return _deadline.get()
+
+
+def remaining_s() -> Optional[float]:
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def check_deadline() -> None:
+    remaining = remaining_s()
+    if remaining is not None and remaining <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+
+
+def _request_timeout_ms(request: Request, default_ms: Optional[float]) -> Optional[float]:
+    raw = request.headers.get(settings.REQUEST_TIMEOUT_HEADER)
+    if raw is not None:
+        try:
+            return max(0.0, float(raw))
+        except ValueError:
+            pass
+    return default_ms
+
+
+class AdmissionLimiter:
+    """
+    Ограничение одновременных запросов эндпоинта с короткой очередью.
+
+    В работе не больше max_concurrency запросов, ждут не больше max_waiting;
+    остальные сразу получают Overloaded. Ожидающий запрос снимается, когда
+    истекает его дедлайн.
+    """
+
+    def __init__(self, name: str, max_concurrency: int, max_waiting: int):
+        self.name = name
+        self._max_concurrency = max(1, max_concurrency)
+        self._max_waiting = max(0, max_waiting)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._waiting = 0
+
+    async def acquire(self) -> None:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+        if self._semaphore.locked():
+            if self._waiting >= self._max_waiting:
+                ADMISSION_REJECTED.inc(endpoint=self.name, reason="queue_full")
+                raise Overloaded(f"{self.name} queue is full")
+            self._waiting += 1
+            ADMISSION_WAITING.inc(endpoint=self.name)
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), remaining_s())
+            except asyncio.TimeoutError:
+                ADMISSION_REJECTED.inc(endpoint=self.name, reason="deadline")
+                raise DeadlineExceeded("Request deadline exceeded while queued")
+            finally:
+                self._waiting -= 1
+                ADMISSION_WAITING.dec(endpoint=self.name)
+        else:
+            await self._semaphore.acquire()
+        ADMISSION_IN_FLIGHT.inc(endpoint=self.name)
+
+    def release(self) -> None:
+        ADMISSION_IN_FLIGHT.dec(endpoint=self.name)
+        self._semaphore.release()
+
+
+_limiters: dict[str, AdmissionLimiter] = {}
+
+
+def get_limiter(name: str, max_concurrency: int) -> AdmissionLimiter:
+    limiter = _limiters.get(name)
+    if limiter is None:
+        limiter = _limiters[name] = AdmissionLimiter(name, max_concurrency, settings.ADMISSION_MAX_WAITING)
+    return limiter
+
+
+def set_deadline(request: Request, default_timeout_ms: Optional[float]) -> contextvars.Token:
+    """Дедлайн текущего запроса: из заголовка REQUEST_TIMEOUT_HEADER (мс) или default_timeout_ms."""
+    timeout_ms = _request_timeout_ms(request, default_timeout_ms)
+    return _deadline.set(time.monotonic() + timeout_ms / 1000 if timeout_ms is not None else None)
+
+
+def error_response(exc: AdmissionError) -> JSONResponse:
+    # перегрузка — 503 с Retry-After; дедлайн клиента истёк до инференса — 504
+    if isinstance(exc, Overloaded):
+        return JSONResponse(
+            {"detail": "Server is overloaded, retry later"},
+            status_code=503,
+            headers={"Retry-After": str(settings.ADMISSION_RETRY_AFTER_S)},
+        )
+    return JSONResponse({"detail": str(exc)}, status_code=504)
+
+
+class AdmissionRoute(NamedTuple):
+    name: str
+    max_concurrency: int
+    default_timeout_ms: Optional[float]
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware: выставляет дедлайн запроса и занимает слот эндпоинта до чтения тела.
+
+    Зависимость FastAPI здесь не годится: multipart разбирается до зависимостей, и отказ
+    получал бы запрос, который уже целиком принят и сброшен во временные файлы. Слот
+    держится, пока не отправлен ответ.
+    """
+
+    def __init__(self, app, routes: dict[str, AdmissionRoute]):
+        self.app = app
+        self.routes = routes
+
+    async def __call__(self, scope, receive, send):
+        route = self.routes.get(scope["path"]) if scope["type"] == "http" else None
+        if route is None or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+        token = set_deadline(Request(scope), route.default_timeout_ms)
+        try:
+            if not settings.ADMISSION_ENABLED:
+                await self.app(scope, receive, send)
+                return
+            limiter = get_limiter(route.name, route.max_concurrency)
+            try:
+                check_deadline()
+                await limiter.acquire()
+            except AdmissionError as exc:
+                await error_response(exc)(scope, receive, send)
+                return
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                limiter.release()
+        finally:
+            _deadline.reset(token)
@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import os
+import zipfile
+from itertools import islice
+from typing import AsyncIterator, Awaitable, Callable, Iterable, NamedTuple, Optional
+
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.core.metrics import REQUESTS
+from app.core.utils import allowed_file, cosine_similarity
+from app.schemas.authentication import BatchAuthenticationResult
+from app.services.admission import AdmissionError
+from app.services.inference import embed_upload
+
+
+logger = logging.getLogger(__name__)
+
+Reader = Callable[[], Awaitable[bytes]]
+
+
+class ImagePair(NamedTuple):
+    pair_id: str
+    passport_name: Optional[str]
+    selfie_name: Optional[str]
+    read_passport: Optional[Reader]
+    read_selfie: Optional[Reader]
+
+
+class RejectedImage(Exception):
+    pass
+
+
+def zip_pairs(archive: zipfile.ZipFile) -> list[ImagePair]:
+    """
+    Пары из архива: `<pair_id>/passport.<ext>` + `<pair_id>/selfie.<ext>`
+    или `<pair_id>_passport.<ext>` + `<pair_id>_selfie.<ext>`.
+    Файлы читаются из архива по мере обработки, а не все сразу, и не больше
+    BATCH_VERIFY_MAX_FILE_BYTES: размер проверяется до распаковки (zip-бомба).
+    """
+    sides: dict[str, dict[str, zipfile.ZipInfo]] = {}
+    for info in archive.infolist():
+        if info.is_dir():
+            continue
+        head, base = os.path.split(info.filename)
+        stem = os.path.splitext(base)[0].lower()
+        for side in ("passport", "selfie"):
+            if stem == side:
+                pair_id = head
+            elif stem.endswith("_" + side):
+                pair_id = os.path.join(head, base[: len(stem) - len(side) - 1])
+            else:
+                continue
+            sides.setdefault(pair_id, {})[side] = info
+
+    def read(side: str, info: zipfile.ZipInfo) -> bytes:
+        limit = settings.BATCH_VERIFY_MAX_FILE_BYTES
+        if info.file_size > limit:
+            raise RejectedImage(f"{side.capitalize()} file too large")
+        # заявленный размер в заголовке может врать: распаковываем не больше limit + 1 байт
+        with archive.open(info) as f:
+            data = f.read(limit + 1)
+        if len(data) > limit:
+            raise RejectedImage(f"{side.capitalize()} file too large")
+        return data
+
+    def reader(side: str, info: Optional[zipfile.ZipInfo]) -> Optional[Reader]:
+        if info is None:
+            return None
+        return lambda: run_in_threadpool(read, side, info)
+
+    return [
+        ImagePair(
+            pair_id=pair_id,
+            passport_name=found["passport"].filename if "passport" in found else None,
+            selfie_name=found["selfie"].filename if "selfie" in found else None,
+            read_passport=reader("passport", found.get("passport")),
+            read_selfie=reader("selfie", found.get("selfie")),
+        )
+        for pair_id, found in sorted(sides.items())
+    ]
+
+
+async def _embed(side: str, name: Optional[str], read: Optional[Reader]) -> np.ndarray:
+    if read is None:
+        raise RejectedImage(f"Missing {side} image")
+    if not allowed_file(name or ""):
+        raise RejectedImage(f"Unsupported {side} file type")
+    data = await read()
+    if len(data) > settings.BATCH_VERIFY_MAX_FILE_BYTES:
+        raise RejectedImage(f"{side.capitalize()} file too large")
+    # пакетная задача ждёт места в очереди инференса, а не получает отказ
+    return await embed_upload(data, wait=True)
+
+
+def _failure(side: str, error: Exception) -> str:
+    if isinstance(error, RejectedImage):
+        REQUESTS.inc(endpoint="verify_identity_batch", outcome="rejected")
+        return str(error)
+    if isinstance(error, LookupError):
+        REQUESTS.inc(endpoint="verify_identity_batch", outcome="no_face")
+        return f"No face detected in {side} image"
+    if isinstance(error, AdmissionError):
+        REQUESTS.inc(endpoint="verify_identity_batch", outcome="deadline")
+        return str(error)
+    REQUESTS.inc(endpoint="verify_identity_batch", outcome="error")
+    logger.error("Batch verification of %s image failed", side, exc_info=error)
+    return "Internal server error"
+
+
+async def _verify_pair(index: int, pair: ImagePair) -> BatchAuthenticationResult:
+    # оба изображения пары декодируются одновременно и попадают в общие батчи модели
+    passport, selfie = await asyncio.gather(
+        _embed("passport", pair.passport_name, pair.read_passport),
+        _embed("selfie", pair.selfie_name, pair.read_selfie),
+        return_exceptions=True,
+    )
+    score = None
+    if isinstance(passport, BaseException):
+        detail, is_auth = _failure("passport", passport), False
+    elif isinstance(selfie, BaseException):
+        detail, is_auth = _failure("selfie", selfie), False
+    else:
+        score = cosine_similarity(passport, selfie)
+        is_auth = bool(score >= settings.FACE_COMPARE_THRESHOLD)
+        REQUESTS.inc(endpoint="verify_identity_batch", outcome="authenticated" if is_auth else "below_threshold")
+        detail = None if is_auth else "Similarity below threshold"
+    return BatchAuthenticationResult(
+        index=index,
+        pair_id=pair.pair_id,
+        is_authenticated=is_auth,
+        similarity=score,
+        threshold=settings.FACE_COMPARE_THRESHOLD,
+        detail=detail,
+    )
+
+
+async def verify_pairs(pairs: Iterable[ImagePair], chunk_size: int) -> AsyncIterator[BatchAuthenticationResult]:
+    """
+    Проверяет пары чанками по chunk_size и отдаёт каждую пару, как только она готова
+    (порядок внутри чанка — по готовности, номер пары — в index).
+
+    Пока отдаётся текущий чанк, следующий уже считается; в памяти одновременно
+    не больше двух чанков изображений.
+    """
+    it = iter(pairs)
+    started = 0
+
+    def launch() -> list[asyncio.Task]:
+        nonlocal started
+        chunk = list(islice(it, max(1, chunk_size)))
+        tasks = [asyncio.ensure_future(_verify_pair(started + i, pair)) for i, pair in enumerate(chunk)]
+        started += len(chunk)
+        return tasks
+
+    current: list[asyncio.Task] = []
+    prefetch: list[asyncio.Task] = []
+    try:
+        current = launch()
+        while current:
+            prefetch = launch()
+            for done in asyncio.as_completed(current):
+                yield await done
+            current, prefetch = prefetch, []
+    finally:
+        # клиент отключился — не считаем оставшееся, в том числе уже начатый следующий чанк:
+        # после выхода форма закрывается, и читать её файлы уже нельзя
+        unfinished = [task for task in (*current, *prefetch) if not task.done()]
+        for task in unfinished:
+            task.cancel()
+        await asyncio.gather(*unfinished, return_exceptions=True)
@@ -0,0 +1,328 @@
+"""
+Массовый импорт истории (онбординг партнёра, миграция): изображения из каталога,
+tar или zip плюс CSV-манифест с колонками path,user_id.
+
+    python -m app.services.bulk_import --manifest users.csv --source photos.tar
+
+Изображения декодируются параллельно, эмбеддинги считаются батчами (в пуле процессов,
+если INFERENCE_WORKERS > 0), строки вставляются в историю чанками одним insert.
+После каждого чанка пишется чекпоинт: прерванный запуск с теми же аргументами
+продолжает с места остановки. Строки, для которых не удалось получить эмбеддинг,
+пишутся в CSV рядом с чекпоинтом.
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import posixpath
+import sys
+import tarfile
+import time
+import zipfile
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Iterable, Iterator, NamedTuple, Optional, Sequence, Union
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.ingest import decode_image
+from app.services.vector_store import VectorStore
+
+
+logger = logging.getLogger(__name__)
+
+
+class ManifestEntry(NamedTuple):
+    index: int
+    path: str
+    user_id: int
+
+
+class ImportItem(NamedTuple):
+    entry: ManifestEntry
+    # None — файла нет в источнике
+    data: Optional[bytes]
+
+
+def _normalize_name(name: str) -> str:
+    return posixpath.normpath(name.replace("\\", "/")).lstrip("/")
+
+
+def read_manifest(path: str) -> list[ManifestEntry]:
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        missing = {"path", "user_id"} - set(reader.fieldnames or ())
+        if missing:
+            raise ValueError(f"Manifest has no columns: {sorted(missing)}")
+        return [
+            ManifestEntry(index, _normalize_name(row["path"].strip()), int(row["user_id"]))
+            for index, row in enumerate(reader)
+        ]
+
+
+def _iter_dir(source: str, entries: Sequence[ManifestEntry], start: int) -> Iterator[ImportItem]:
+    for entry in entries[start:]:
+        try:
+            with open(os.path.join(source, entry.path), "rb") as f:
+                yield ImportItem(entry, f.read())
+        except FileNotFoundError:
+            yield ImportItem(entry, None)
+
+
+def _iter_zip(source: str, entries: Sequence[ManifestEntry], start: int) -> Iterator[ImportItem]:
+    with zipfile.ZipFile(source) as archive:
+        names = {_normalize_name(name): name for name in archive.namelist()}
+        for entry in entries[start:]:
+            name = names.get(entry.path)
+            yield ImportItem(entry, archive.read(name) if name is not None else None)
+
+
+def _iter_tar(source: str, entries: Sequence[ManifestEntry], start: int) -> Iterator[ImportItem]:
+    by_name: dict[str, list[ManifestEntry]] = {}
+    for entry in entries:
+        by_name.setdefault(entry.path, []).append(entry)
+    position = 0
+    with tarfile.open(source, "r|*") as archive:
+        for member in archive:
+            matched = by_name.pop(_normalize_name(member.name), None) if member.isfile() else None
+            if not matched:
+                continue
+            data = None
+            if position + len(matched) > start:
+                data = archive.extractfile(member).read()
+            for entry in matched:
+                if position >= start:
+                    yield ImportItem(entry, data)
+                position += 1
+    for entry in sorted((e for group in by_name.values() for e in group), key=lambda e: e.index):
+        if position >= start:
+            yield ImportItem(entry, None)
+        position += 1
+
+
+def iter_source(source: str, entries: Sequence[ManifestEntry], start: int = 0) -> Iterator[ImportItem]:
+    """
+    Файлы манифеста из каталога, zip или tar; первые start элементов пропускаются без чтения.
+
+    Каталог и zip читаются в порядке манифеста. tar (в том числе .tar.gz) читается
+    потоком в порядке архива — без произвольного доступа; записи манифеста, которых
+    в архиве не нашлось, идут в конце с data=None.
+    """
+    if os.path.isdir(source):
+        return _iter_dir(source, entries, start)
+    if zipfile.is_zipfile(source):
+        return _iter_zip(source, entries, start)
+    return _iter_tar(source, entries, start)
+
+
+class Checkpoint(NamedTuple):
+    position: int = 0
+    imported: int = 0
+    failed: int = 0
+
+
+def load_checkpoint(path: str, job: dict) -> Checkpoint:
+    try:
+        with open(path, encoding="utf-8") as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return Checkpoint()
+    if state.get("job") != job:
+        raise ValueError(f"Checkpoint {path} belongs to another import ({state.get('job')}); use --restart")
+    return Checkpoint(state["position"], state["imported"], state["failed"])
+
+
+def save_checkpoint(path: str, job: dict, checkpoint: Checkpoint) -> None:
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"job": job, **checkpoint._asdict()}, f)
+    os.replace(path + ".tmp", path)
+
+
+def _decode(item: ImportItem) -> Union[np.ndarray, Exception]:
+    if item.data is None:
+        return FileNotFoundError(f"{item.entry.path} not found in source")
+    try:
+        return decode_image(item.data)
+    except Exception as e:
+        return e
+
+
+def _failure_reason(error: Exception) -> str:
+    if isinstance(error, FileNotFoundError):
+        return "missing"
+    if isinstance(error, LookupError):
+        return "no_face"
+    return f"{type(error).__name__}: {error}"
+
+
+def _chunks(items: Iterable[ImportItem], size: int) -> Iterator[list[ImportItem]]:
+    iterator = iter(items)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+class BulkImporter:
+    """
+    Конвейер импорта: пока модель и вставка заняты чанком N, чанк N+1 уже
+    читается и декодируется. Чекпоинт сдвигается только после вставки чанка,
+    поэтому после падения строки могут повториться не больше чем для одного чанка.
+    """
+
+    def __init__(
+        self,
+        store: VectorStore,
+        embed: Callable[[Sequence[np.ndarray]], list[Union[np.ndarray, Exception]]],
+        source_label: str,
+        decode_workers: int,
+        model_batch: int,
+        chunk_size: int,
+        embed_parallelism: int = 1,
+        on_chunk: Optional[Callable[[Checkpoint], None]] = None,
+        failures_path: Optional[str] = None,
+    ):
+        self._store = store
+        self._embed = embed
+        self._source_label = source_label
+        self._decode_workers = max(1, decode_workers)
+        self._model_batch = max(1, model_batch)
+        self._chunk_size = max(1, chunk_size)
+        self._embed_parallelism = max(1, embed_parallelism)
+        self._on_chunk = on_chunk
+        self._failures_path = failures_path
+        self._state = Checkpoint()
+        self._started = 0.0
+        self._imported_now = 0
+
+    def _embed_chunk(self, pool: ThreadPoolExecutor, arrays: list[np.ndarray]) -> list[Union[np.ndarray, Exception]]:
+        batches = [arrays[i:i + self._model_batch] for i in range(0, len(arrays), self._model_batch)]
+        return [result for batch in pool.map(self._embed, batches) for result in batch]
+
+    def _write_failures(self, failures: list[tuple[ManifestEntry, str]]) -> None:
+        if not failures or self._failures_path is None:
+            return
+        new_file = not os.path.exists(self._failures_path)
+        with open(self._failures_path, "a", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            if new_file:
+                writer.writerow(["path", "user_id", "reason"])
+            writer.writerows([entry.path, entry.user_id, reason] for entry, reason in failures)
+
+    def _finish_chunk(self, pool: ThreadPoolExecutor, chunk: list[ImportItem], decoded: list[Future]) -> None:
+        results: list[Union[np.ndarray, Exception, None]] = [f.result() for f in decoded]
+        ok = [i for i, r in enumerate(results) if not isinstance(r, Exception)]
+        for i, emb in zip(ok, self._embed_chunk(pool, [results[i] for i in ok])):
+            results[i] = emb
+
+        user_ids, embeddings, failures = [], [], []
+        for item, result in zip(chunk, results):
+            if isinstance(result, Exception):
+                failures.append((item.entry, _failure_reason(result)))
+            else:
+                user_ids.append(item.entry.user_id)
+                embeddings.append(result)
+        if embeddings:
+            self._store.save_many(user_ids, np.stack(embeddings), self._source_label)
+        self._write_failures(failures)
+
+        self._imported_now += len(embeddings)
+        self._state = Checkpoint(
+            self._state.position + len(chunk),
+            self._state.imported + len(embeddings),
+            self._state.failed + len(failures),
+        )
+        if self._on_chunk is not None:
+            self._on_chunk(self._state)
+
+    def rows_per_s(self) -> float:
+        elapsed = time.perf_counter() - self._started
+        return self._imported_now / elapsed if elapsed > 0 else 0.0
+
+    def run(self, items: Iterable[ImportItem], resume: Checkpoint = Checkpoint(), total: Optional[int] = None) -> dict:
+        self._state = resume
+        self._started = time.perf_counter()
+        self._imported_now = 0
+        last_report = self._started
+        with ThreadPoolExecutor(self._decode_workers, thread_name_prefix="import-decode") as decode_pool, \
+                ThreadPoolExecutor(self._embed_parallelism, thread_name_prefix="import-embed") as embed_pool:
+            pending = None
+            for chunk in _chunks(items, self._chunk_size):
+                decoded = [decode_pool.submit(_decode, item) for item in chunk]
+                if pending is not None:
+                    self._finish_chunk(embed_pool, *pending)
+                pending = (chunk, decoded)
+                if time.perf_counter() - last_report >= settings.IMPORT_PROGRESS_INTERVAL_S:
+                    last_report = time.perf_counter()
+                    logger.info(
+                        "Processed %d%s, imported %d, failed %d, %.1f rows/s",
+                        self._state.position,
+                        f"/{total}" if total is not None else "",
+                        self._state.imported,
+                        self._state.failed,
+                        self.rows_per_s(),
+                    )
+            if pending is not None:
+                self._finish_chunk(embed_pool, *pending)
+        return {
+            **self._state._asdict(),
+            "imported_this_run": self._imported_now,
+            "elapsed_s": time.perf_counter() - self._started,
+            "rows_per_s": self.rows_per_s(),
+        }
+
+
+def main(argv=None) -> int:
+    from app.services.inference import run_batch, start_inference
+    from app.services.inference_pool import shutdown_inference_pool
+    from app.services.vector_store import close_vector_store, get_vector_store
+
+    parser = argparse.ArgumentParser(description="Bulk import of history embeddings")
+    parser.add_argument("--manifest", required=True, help="CSV with path,user_id columns")
+    parser.add_argument("--source", required=True, help="directory, .zip or .tar[.gz] with images")
+    parser.add_argument("--checkpoint", help="checkpoint file (default: <manifest>.checkpoint.json)")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    parser.add_argument("--source-label", default="import", help="value of the source field for imported rows")
+    parser.add_argument("--decode-workers", type=int, default=settings.IMPORT_DECODE_WORKERS)
+    parser.add_argument("--model-batch", type=int, default=settings.IMPORT_MODEL_BATCH)
+    parser.add_argument("--chunk-size", type=int, default=settings.IMPORT_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    checkpoint_path = args.checkpoint or args.manifest + ".checkpoint.json"
+    job = {"manifest": os.path.abspath(args.manifest), "source": os.path.abspath(args.source)}
+    entries = read_manifest(args.manifest)
+    if args.restart:
+        for path in (checkpoint_path, checkpoint_path + ".failures.csv"):
+            if os.path.exists(path):
+                os.remove(path)
+    resume = load_checkpoint(checkpoint_path, job)
+    if resume.position:
+        logger.info("Resuming from %d/%d", resume.position, len(entries))
+
+    store = get_vector_store()
+    store.warmup()
+    start_inference()
+    importer = BulkImporter(
+        store,
+        run_batch,
+        source_label=args.source_label,
+        decode_workers=args.decode_workers,
+        model_batch=args.model_batch,
+        chunk_size=args.chunk_size,
+        # по батчу на каждый воркер пула процессов
+        embed_parallelism=max(1, settings.INFERENCE_WORKERS),
+        on_chunk=lambda state: save_checkpoint(checkpoint_path, job, state),
+        failures_path=checkpoint_path + ".failures.csv",
+    )
+    try:
+        stats = importer.run(iter_source(args.source, entries, resume.position), resume, total=len(entries))
+    finally:
+        shutdown_inference_pool()
+        close_vector_store()
+    print(json.dumps(stats, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,298 @@
+"""
+Калибровка порога FACE_COMPARE_THRESHOLD по сохранённой истории.
+
+    # выгрузка истории в memory-mapped матрицу (эмбеддинги + user_id + source)
+    python -m app.services.calibration export --output ./calibration
+    # распределения своих/чужих пар, FAR/FRR/ROC и рекомендуемые пороги
+    python -m app.services.calibration evaluate --input ./calibration --memory-mb 1024 --output report.json
+
+Пары считаются блочным матричным умножением: в памяти одновременно не больше
+блока score размером, заданным --memory-mb, а распределения копятся в гистограммах
+с фиксированными бинами. Свои пары (genuine) — все пары строк одного пользователя;
+чужие (impostor) — все пары строк разных пользователей, при большом числе строк —
+по случайной подвыборке из --impostor-rows строк.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from typing import Iterator, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.utils import normalize_embedding
+
+
+logger = logging.getLogger(__name__)
+
+# разрешение гистограмм score на [-1, 1]
+HISTOGRAM_BINS = 20000
+# окно строк для своих пар: пользователи небольшие, большое окно — лишние умножения чужих
+GENUINE_WINDOW_ROWS = 1024
+# score вне [-1, 1]: пары, которые не надо учитывать, уходят в отбрасываемый бин
+_SKIP = 3.0
+DEFAULT_TARGET_FARS = (1e-3, 1e-4, 1e-5, 1e-6)
+
+
+class Export(NamedTuple):
+    embeddings: np.ndarray
+    user_ids: np.ndarray
+    sources: np.ndarray
+    source_names: list[str]
+
+
+def export_history(batches: Iterator[tuple[np.ndarray, np.ndarray, Sequence[str]]], path: str, dim: int) -> int:
+    """
+    Пишет порции (user_ids, embeddings, sources) в каталог: embeddings.f32 (N x dim),
+    user_ids.i64, sources.i16 (код в meta.json). Файлы дописываются, вся история
+    в памяти не держится.
+    """
+    os.makedirs(path, exist_ok=True)
+    source_names: list[str] = []
+    codes: dict[str, int] = {}
+    count = 0
+    with open(os.path.join(path, "embeddings.f32"), "wb") as emb_file, \
+            open(os.path.join(path, "user_ids.i64"), "wb") as user_file, \
+            open(os.path.join(path, "sources.i16"), "wb") as source_file:
+        for user_ids, embeddings, sources in batches:
+            for source in sources:
+                if source not in codes:
+                    codes[source] = len(source_names)
+                    source_names.append(source)
+            emb_file.write(np.ascontiguousarray(embeddings, dtype=np.float32).reshape(-1, dim).tobytes())
+            user_file.write(np.asarray(user_ids, dtype=np.int64).tobytes())
+            source_file.write(np.array([codes[s] for s in sources], dtype=np.int16).tobytes())
+            count += len(user_ids)
+    with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"dim": dim, "count": count, "sources": source_names}, f)
+    return count
+
+
+def load_export(path: str) -> Export:
+    with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+        meta = json.load(f)
+    count, dim = meta["count"], meta["dim"]
+
+    def column(name: str, dtype, shape) -> np.ndarray:
+        if count == 0:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(os.path.join(path, name), dtype=dtype, mode="r", shape=shape)
+
+    return Export(
+        embeddings=column("embeddings.f32", np.float32, (count, dim)),
+        user_ids=column("user_ids.i64", np.int64, (count,)),
+        sources=column("sources.i16", np.int16, (count,)),
+        source_names=meta["sources"],
+    )
+
+
+def _accumulate(hist: np.ndarray, scores: np.ndarray) -> None:
+    # равномерные бины: индекс считается напрямую, без сортировки как в np.histogram;
+    # score чуть больше 1 (погрешность float32) идёт в последний бин, _SKIP — в отбрасываемый
+    idx = ((scores.ravel() + 1.0) * (HISTOGRAM_BINS / 2)).astype(np.int32)
+    np.clip(idx, 0, HISTOGRAM_BINS + 1, out=idx)
+    counts = np.bincount(idx, minlength=HISTOGRAM_BINS + 2)
+    counts[HISTOGRAM_BINS - 1] += counts[HISTOGRAM_BINS]
+    hist += counts[:HISTOGRAM_BINS]
+
+
+def _pairs(
+    embeddings: np.ndarray,
+    user_ids: np.ndarray,
+    idx: np.ndarray,
+    block: int,
+    genuine: Optional[np.ndarray],
+    impostor: Optional[np.ndarray],
+) -> None:
+    """
+    Все пары строк idx (i < j) блоками block x block; score раскладываются по своим/чужим.
+    Из memmap читается по блоку строк за раз, выборка целиком в память не копируется.
+    """
+    n = len(idx)
+    for start_a in range(0, n, block):
+        rows_a = idx[start_a:start_a + block]
+        a = normalize_embedding(embeddings[rows_a])
+        users_a = user_ids[rows_a]
+        for start_b in range(start_a, n, block):
+            rows_b = idx[start_b:start_b + block]
+            b = a if start_b == start_a else normalize_embedding(embeddings[rows_b])
+            users_b = user_ids[rows_b]
+            scores = a @ b.T
+            if start_b == start_a:
+                # пара (i, i) и повтор (j, i) не считаются
+                scores[np.tril_indices(len(a))] = _SKIP
+            same = users_a[:, None] == users_b[None, :]
+            if genuine is not None:
+                _accumulate(genuine, scores[same])
+            if impostor is not None:
+                scores[same] = _SKIP
+                _accumulate(impostor, scores)
+
+
+def genuine_histogram(export: Export, rows: np.ndarray, block: int) -> np.ndarray:
+    """
+    Пары строк одного пользователя. Строки сортируются по user_id и набираются
+    в окна целыми пользователями, так что одно умножение покрывает сразу много
+    пользователей; пользователь больше окна считается отдельно блоками block.
+    """
+    hist = np.zeros(HISTOGRAM_BINS, dtype=np.int64)
+    rows = rows[np.argsort(export.user_ids[rows], kind="stable")]
+    users = export.user_ids[rows]
+    bounds = np.flatnonzero(np.diff(users)) + 1
+    starts = np.concatenate([[0], bounds])
+    ends = np.concatenate([bounds, [len(rows)]])
+
+    def flush(window_start: int, window_end: int) -> None:
+        if window_end - window_start > 1:
+            chunk = np.sort(rows[window_start:window_end])
+            _pairs(export.embeddings, export.user_ids, chunk, block, hist, None)
+
+    window = min(block, GENUINE_WINDOW_ROWS)
+    window_start = 0
+    for start, end in zip(starts, ends):
+        if end - window_start > window and start > window_start:
+            flush(window_start, start)
+            window_start = start
+        if end - start > window:
+            flush(start, end)
+            window_start = end
+    flush(window_start, len(rows))
+    return hist
+
+
+def impostor_histogram(export: Export, rows: np.ndarray, block: int) -> np.ndarray:
+    hist = np.zeros(HISTOGRAM_BINS, dtype=np.int64)
+    # строки по возрастанию: блоки читаются из memmap почти последовательно
+    _pairs(export.embeddings, export.user_ids, np.sort(rows), block, None, hist)
+    return hist
+
+
+def _bin_edges() -> np.ndarray:
+    return np.linspace(-1.0, 1.0, HISTOGRAM_BINS + 1)
+
+
+def rates(genuine: np.ndarray, impostor: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Для каждого порога-края бина: FAR (чужие >= порога) и FRR (свои < порога)."""
+    thresholds = _bin_edges()[:-1]
+    far = impostor[::-1].cumsum()[::-1] / max(1, impostor.sum())
+    frr = np.concatenate([[0], genuine.cumsum()[:-1]]) / max(1, genuine.sum())
+    return thresholds, far, frr
+
+
+def summarize(
+    genuine: np.ndarray, impostor: np.ndarray, current: float, target_fars: Sequence[float], roc_points: int
+) -> dict:
+    thresholds, far, frr = rates(genuine, impostor)
+    eer = int(np.argmin(np.abs(far - frr)))
+    recommended = []
+    for target in target_fars:
+        ok = np.flatnonzero(far <= target)
+        if ok.size == 0:
+            continue
+        # наименьший порог с FAR не выше цели — при нём FRR минимален
+        i = int(ok[0])
+        recommended.append(
+            {"target_far": target, "threshold": float(thresholds[i]), "far": float(far[i]), "frr": float(frr[i])}
+        )
+    at_current = int(np.clip(np.searchsorted(thresholds, current, side="right") - 1, 0, len(thresholds) - 1))
+    # ROC прореживается до roc_points точек с равным шагом по порогу
+    step = max(1, len(thresholds) // roc_points)
+    return {
+        "genuine_pairs": int(genuine.sum()),
+        "impostor_pairs": int(impostor.sum()),
+        "current": {"threshold": current, "far": float(far[at_current]), "frr": float(frr[at_current])},
+        "eer": {"threshold": float(thresholds[eer]), "far": float(far[eer]), "frr": float(frr[eer])},
+        "recommended": recommended,
+        "roc": [
+            {"threshold": float(t), "far": float(a), "frr": float(r)}
+            for t, a, r in zip(thresholds[::step], far[::step], frr[::step])
+        ],
+    }
+
+
+def evaluate(
+    export: Export,
+    memory_mb: float,
+    impostor_rows: int,
+    exclude_sources: Sequence[str] = (),
+    target_fars: Sequence[float] = DEFAULT_TARGET_FARS,
+    roc_points: int = 200,
+    seed: int = 0,
+) -> dict:
+    started = time.perf_counter()
+    # на пару в блоке: score float32, маска своих, индекс бина int32 и временные копии
+    block = max(64, int(np.sqrt(memory_mb * 2 ** 20 / 16)))
+    excluded = [export.source_names.index(s) for s in exclude_sources if s in export.source_names]
+    rows = np.flatnonzero(~np.isin(export.sources, excluded))
+
+    genuine = genuine_histogram(export, rows, block)
+    genuine_s = time.perf_counter() - started
+    sample = rows
+    if len(rows) > impostor_rows:
+        sample = np.random.default_rng(seed).choice(rows, size=impostor_rows, replace=False)
+    impostor = impostor_histogram(export, sample, block)
+
+    return {
+        "rows": int(len(rows)),
+        "users": int(len(np.unique(export.user_ids[rows]))),
+        "impostor_sample_rows": int(len(sample)),
+        "block_rows": block,
+        "genuine_seconds": genuine_s,
+        "total_seconds": time.perf_counter() - started,
+        **summarize(genuine, impostor, settings.FACE_COMPARE_THRESHOLD, target_fars, roc_points),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Offline threshold calibration over stored history")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_cmd = commands.add_parser("export", help="dump history into memory-mapped files")
+    export_cmd.add_argument("--output", required=True)
+    export_cmd.add_argument("--batch-size", type=int, default=5000)
+
+    evaluate_cmd = commands.add_parser("evaluate", help="genuine/impostor distributions, FAR/FRR/ROC")
+    evaluate_cmd.add_argument("--input", required=True)
+    evaluate_cmd.add_argument("--memory-mb", type=float, default=512, help="budget for one block of scores")
+    evaluate_cmd.add_argument("--impostor-rows", type=int, default=100_000, help="random sample for impostor pairs")
+    evaluate_cmd.add_argument("--exclude-sources", nargs="*", default=["centroid"])
+    evaluate_cmd.add_argument("--target-far", type=float, nargs="*", default=list(DEFAULT_TARGET_FARS))
+    evaluate_cmd.add_argument("--roc-points", type=int, default=200)
+    evaluate_cmd.add_argument("--seed", type=int, default=0)
+    evaluate_cmd.add_argument("--output", help="where to write the JSON report")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "export":
+        from app.services.vector_store import close_vector_store, get_vector_store
+
+        store = get_vector_store()
+        try:
+            count = export_history(store.export_rows(args.batch_size), args.output, settings.MILVUS_DIM)
+        finally:
+            close_vector_store()
+        logger.info("Exported %d rows to %s", count, args.output)
+        return 0
+
+    report = evaluate(
+        load_export(args.input),
+        memory_mb=args.memory_mb,
+        impostor_rows=args.impostor_rows,
+        exclude_sources=args.exclude_sources,
+        target_fars=args.target_far,
+        roc_points=args.roc_points,
+        seed=args.seed,
+    )
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(data: bytes, variant: str = "") -> str:
+    # в ключ входит конфигурация модели: при смене пакета/детектора старые эмбеддинги не подойдут;
+    # variant — режим входа (кроп, точки клиента): тот же файл в другом режиме даёт другой эмбеддинг
+    digest = hashlib.sha256(data).hexdigest()
+    key = f"{settings.FACE_MODEL_PACK}:{settings.FACE_DET_SIZE}:{digest}"
+    return f"{key}:{variant}" if variant else key
+
+
+class EmbeddingCache:
+    """
+    LRU-кэш эмбеддингов по хэшу загруженного файла с ограничением по размеру и TTL.
+
+    Опционально вторым уровнем используется Redis: его видят все процессы и инстансы,
+    а локальный LRU снимает с него горячие ключи.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl_s: float,
+        redis_url: Optional[str] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._max_entries = max_entries
+        self._ttl_s = ttl_s
+        self._clock = clock
+        self._entries: OrderedDict[str, tuple[float, np.ndarray]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._redis = self._connect_redis(redis_url) if redis_url else None
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+
+    @staticmethod
+    def _connect_redis(url: str):
+        try:
+            import redis
+        except ImportError:
+            logger.warning("redis package is not installed; shared embedding cache disabled")
+            return None
+        return redis.Redis.from_url(url)
+
+    def _get_local(self, key: str) -> Optional[np.ndarray]:
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, emb = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return emb
+                del self._entries[key]
+        return None
+
+    def _finish_shared(self, key: str, emb: Optional[np.ndarray]) -> Optional[np.ndarray]:
+        with self._lock:
+            if emb is None:
+                self.misses += 1
+                return None
+            self.shared_hits += 1
+        self._put_local(key, emb)
+        return emb
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        emb = self._get_local(key)
+        if emb is not None:
+            return emb
+        return self._finish_shared(key, self._get_shared(key))
+
+    async def aget(self, key: str) -> Optional[np.ndarray]:
+        """get для event loop: локальный LRU — сразу, поход в Redis — в пуле потоков."""
+        emb = self._get_local(key)
+        if emb is not None:
+            return emb
+        shared = await run_in_threadpool(self._get_shared, key) if self._redis is not None else None
+        return self._finish_shared(key, shared)
+
+    @staticmethod
+    def _frozen(emb: np.ndarray) -> np.ndarray:
+        emb = np.array(emb, dtype=np.float32)
+        emb.setflags(write=False)
+        return emb
+
+    def put(self, key: str, emb: np.ndarray) -> None:
+        emb = self._frozen(emb)
+        self._put_local(key, emb)
+        self._put_shared(key, emb)
+
+    async def aput(self, key: str, emb: np.ndarray) -> None:
+        emb = self._frozen(emb)
+        self._put_local(key, emb)
+        if self._redis is not None:
+            await run_in_threadpool(self._put_shared, key, emb)
+
+    def _put_shared(self, key: str, emb: np.ndarray) -> None:
+        if self._redis is None:
+            return
+        try:
+            self._redis.set(key, emb.tobytes(), ex=max(1, int(self._ttl_s)))
+        except Exception:
+            logger.warning("Failed to write embedding to shared cache", exc_info=True)
+
+    def _put_local(self, key: str, emb: np.ndarray) -> None:
+        with self._lock:
+            self._entries[key] = (self._clock() + self._ttl_s, emb)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def _get_shared(self, key: str) -> Optional[np.ndarray]:
+        if self._redis is None:
+            return None
+        try:
+            raw = self._redis.get(key)
+        except Exception:
+            logger.warning("Failed to read embedding from shared cache", exc_info=True)
+            return None
+        if raw is None:
+            return None
+        return np.frombuffer(raw, dtype=np.float32)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self._max_entries,
+                "ttl_s": self._ttl_s,
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits + self.shared_hits) / lookups if lookups else None,
+                "shared_backend": self._redis is not None,
+            }
+
+
+_cache: Optional[EmbeddingCache] = None
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    global _cache
+    if not settings.EMBEDDING_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        _cache = EmbeddingCache(
+            max_entries=settings.EMBEDDING_CACHE_MAX_ENTRIES,
+            ttl_s=settings.EMBEDDING_CACHE_TTL_S,
+            redis_url=settings.EMBEDDING_CACHE_REDIS_URL,
+        )
+    return _cache
@@ -1,36 +1,339 @@
-from typing import Optional
+import glob
+import logging
+import math
+import os
+from typing import NamedTuple, Optional, Sequence, Union
+
 import numpy as np
-from PIL import Image
-from insightface.app import FaceAnalysis
+
+from app.core.config import settings
+from app.core.metrics import stage
+from app.core.utils import normalize_embedding
+from app.services.ingest import decode_image
+
+
+logger = logging.getLogger(__name__)
+
+# onnxruntime и insightface импортируются лениво: импорт app.main не должен тянуть тяжёлые модули
+_GRAPH_OPTIMIZATION_LEVELS = {
+    "disabled": "ORT_DISABLE_ALL",
+    "basic": "ORT_ENABLE_BASIC",
+    "extended": "ORT_ENABLE_EXTENDED",
+    "all": "ORT_ENABLE_ALL",
+}
+
+
+class FacePipeline:
+    """
+    Только те модули пакета, которые нужны верификации (по умолчанию детекция и распознавание).
+
+    В отличие от insightface.app.FaceAnalysis, сессии onnxruntime создаются
+    с нашими SessionOptions, а лишние модели (landmark_3d_68, genderage) не держатся в памяти.
+    """
+
+    def __init__(self, models: dict):
+        missing = {"detection", "recognition"} - models.keys()
+        if missing:
+            raise RuntimeError(f"Model pack has no required modules: {sorted(missing)}")
+        self.models = models
+        self.det_model = models["detection"]
+
+    def prepare(self, ctx_id: int, det_thresh: float, det_size: tuple[int, int]) -> None:
+        for taskname, model in self.models.items():
+            if taskname == "detection":
+                model.prepare(ctx_id, input_size=det_size, det_thresh=det_thresh)
+            else:
+                model.prepare(ctx_id)
+
+
+class InvalidFaceInput(ValueError):
+    """Присланный клиентом кроп или ключевые точки не годятся для распознавания."""
+
+
+class FaceInput(NamedTuple):
+    """
+    Лицо, уже найденное клиентом: кадр с пятью ключевыми точками
+    (глаза, нос, углы рта) или, при landmarks=None, готовый выровненный кроп.
+    Детектор для него не запускается.
+    """
+
+    image: np.ndarray
+    landmarks: Optional[np.ndarray] = None
+
+
+# вход пайплайна: кадр, на котором лицо ищет детектор, или FaceInput
+FaceImage = Union[np.ndarray, FaceInput]
 
 
 # ленивый singleton
-_face_analyzer: Optional[FaceAnalysis] = None
+_face_analyzer: Optional[FacePipeline] = None
+
+
+def _session_options(optimization: str):
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    if settings.ONNX_INTRA_OP_THREADS > 0:
+        options.intra_op_num_threads = settings.ONNX_INTRA_OP_THREADS
+    if settings.ONNX_INTER_OP_THREADS > 0:
+        options.inter_op_num_threads = settings.ONNX_INTER_OP_THREADS
+    options.graph_optimization_level = getattr(ort.GraphOptimizationLevel, _GRAPH_OPTIMIZATION_LEVELS[optimization])
+    return options
+
+
+def _model_task(onnx_file: str) -> Optional[str]:
+    """
+    Задача модели по входам и выходам графа — те же правила, что у insightface ModelRouter,
+    но без создания сессии: лишние модули пакета не загружаются и не оптимизируются.
+    """
+    import onnx
+
+    graph = onnx.load(onnx_file, load_external_data=False).graph
+    initializers = {init.name for init in graph.initializer}
+    inputs = [i for i in graph.input if i.name not in initializers]
+    shape = [d.dim_value for d in inputs[0].type.tensor_type.shape.dim]
+    if len(graph.output) >= 5:
+        return "detection"
+    if shape[2:] == [192, 192]:
+        points = graph.output[0].type.tensor_type.shape.dim[1].dim_value
+        return "landmark_3d_68" if points == 3309 else f"landmark_2d_{points // 2}"
+    if shape[2:] == [96, 96]:
+        return "genderage"
+    if len(inputs) == 2 and shape[2:] == [128, 128]:
+        return "inswapper"
+    if len(shape) == 4 and shape[2] == shape[3] and shape[2] >= 112 and shape[2] % 16 == 0:
+        return "recognition"
+    return None
+
+
+def _model_files(model_dir: str) -> list[str]:
+    """Файлы .onnx пакета, нужные FACE_ALLOWED_MODULES (по одному на задачу)."""
+    allowed = set(settings.FACE_ALLOWED_MODULES)
+    files: dict[str, str] = {}
+    for onnx_file in sorted(glob.glob(os.path.join(model_dir, "*.onnx"))):
+        task = _model_task(onnx_file)
+        if task in allowed and task not in files:
+            files[task] = onnx_file
+    return sorted(files.values())
+
+
+def _optimized_model_dir(onnx_files: Sequence[str], providers: list[str]) -> str:
+    """
+    Оптимизирует графы моделей один раз и сохраняет их на диск.
+
+    Каталог кэша зависит от версии onnxruntime и уровня оптимизации, так что
+    после обновления рантайма модели будут оптимизированы заново. Графы с уровнем
+    "all" могут содержать оптимизации под конкретный CPU — кэш не стоит переносить между машинами.
+    """
+    import onnxruntime as ort
+
+    optimization = settings.ONNX_GRAPH_OPTIMIZATION
+    cache_dir = os.path.join(
+        os.path.expanduser(settings.ONNX_OPTIMIZED_MODEL_DIR),
+        f"{settings.FACE_MODEL_PACK}-ort{ort.__version__}-{optimization}",
+    )
+    os.makedirs(cache_dir, exist_ok=True)
+    for onnx_file in onnx_files:
+        target = os.path.join(cache_dir, os.path.basename(onnx_file))
+        if os.path.exists(target):
+            continue
+        logger.info("Optimizing %s -> %s", onnx_file, target)
+        options = _session_options(optimization)
+        options.optimized_model_filepath = target + ".tmp"
+        ort.InferenceSession(onnx_file, sess_options=options, providers=providers)
+        os.replace(target + ".tmp", target)
+    return cache_dir
 
 
-def get_face_analyzer() -> FaceAnalysis:
+def _load_models() -> dict:
+    import onnxruntime as ort
+    from insightface.model_zoo.model_zoo import ModelRouter
+    from insightface.utils import ensure_available
+
+    providers = ort.get_available_providers()
+    model_dir = ensure_available("models", settings.FACE_MODEL_PACK, root=settings.FACE_MODEL_ROOT)
+    # задача модели определяется по графу до создания сессии: лишние модули не загружаются
+    onnx_files = _model_files(model_dir)
+    optimization = settings.ONNX_GRAPH_OPTIMIZATION
+    if settings.ONNX_OPTIMIZED_MODEL_DIR:
+        cache_dir = _optimized_model_dir(onnx_files, providers)
+        onnx_files = [os.path.join(cache_dir, os.path.basename(f)) for f in onnx_files]
+        # графы уже оптимизированы, повторно при загрузке их не трогаем
+        optimization = "disabled"
+
+    models = {}
+    for onnx_file in onnx_files:
+        model = ModelRouter(onnx_file).get_model(
+            sess_options=_session_options(optimization), providers=providers
+        )
+        if model is not None:
+            models[model.taskname] = model
+    return models
+
+
+def get_face_analyzer() -> FacePipeline:
     global _face_analyzer
     if _face_analyzer is None:
-        _face_analyzer = FaceAnalysis(name="buffalo_l")  # можно заменить модель
-        _face_analyzer.prepare(ctx_id=0)
+        pipeline = FacePipeline(_load_models())
+        det_size = settings.FACE_DET_SIZE
+        pipeline.prepare(ctx_id=0, det_thresh=settings.FACE_DET_THRESH, det_size=(det_size, det_size))
+        _face_analyzer = pipeline
     return _face_analyzer
 
 
 def image_to_array(uploaded_file) -> np.ndarray:
-    image = Image.open(uploaded_file).convert("RGB")
-    return np.asarray(image)
+    return decode_image(uploaded_file.read())
 
 
-def get_embedding(img_arr: np.ndarray) -> np.ndarray:
+def detect_landmarks(img_arr: np.ndarray) -> np.ndarray:
+    """Возвращает 5 ключевых точек самого уверенного лица на изображении."""
     fa = get_face_analyzer()
-    faces = fa.get(img_arr)
-    if not faces:
+    bboxes, kpss = fa.det_model.detect(img_arr, max_num=0, metric="default")
+    if bboxes.shape[0] == 0 or kpss is None:
         raise LookupError("No face detected")
     # самый уверенный
-    face = max(faces, key=lambda f: getattr(f, "det_score", 0))
-    emb = face.embedding
-    # нормализуем (на всякий случай)
-    norm = np.linalg.norm(emb)
-    if norm == 0:
-        raise ValueError("Zero embedding")
-    return emb / norm
+    best = int(np.argmax(bboxes[:, 4]))
+    return kpss[best]
+
+
+def align_face(img_arr: np.ndarray, landmarks: np.ndarray) -> np.ndarray:
+    from insightface.utils import face_align
+
+    rec_model = get_face_analyzer().models["recognition"]
+    return face_align.norm_crop(img_arr, landmark=landmarks, image_size=rec_model.input_size[0])
+
+
+def _similarity_fit(src: np.ndarray, dst: np.ndarray) -> tuple[np.ndarray, float, np.ndarray]:
+    """Подгонка подобия (поворот, масштаб, сдвиг) src -> dst по Umeyama, без отражения."""
+    src_mean, dst_mean = src.mean(axis=0), dst.mean(axis=0)
+    src_c, dst_c = src - src_mean, dst - dst_mean
+    u, s, vt = np.linalg.svd(dst_c.T @ src_c / len(src))
+    d = np.array([1.0, 1.0 if np.linalg.det(u) * np.linalg.det(vt) >= 0 else -1.0])
+    rotation = u @ np.diag(d) @ vt
+    scale = float((s * d).sum() / ((src_c ** 2).sum() / len(src)))
+    return rotation, scale, scale * src_c @ rotation.T + dst_mean
+
+
+def check_landmarks(landmarks: np.ndarray, shape: Sequence[int]) -> np.ndarray:
+    """
+    Проверка правдоподобия клиентских ключевых точек перед выравниванием.
+
+    Точки должны лежать внутри кадра, глаза — быть не ближе FACE_LANDMARKS_MIN_EYE_DISTANCE
+    пикселей, а после подгонки подобием к шаблону ArcFace форма не должна отличаться
+    от него больше чем на FACE_LANDMARKS_MAX_DEVIATION межглазного расстояния (перепутанный
+    порядок точек или случайные координаты сюда не проходят); наклон головы —
+    не больше FACE_LANDMARKS_MAX_ROLL_DEG.
+    """
+    from insightface.utils.face_align import arcface_dst
+
+    points = np.asarray(landmarks, dtype=np.float32)
+    if points.shape != (5, 2) or not np.isfinite(points).all():
+        raise InvalidFaceInput("Landmarks must be 5 finite [x, y] points")
+    height, width = shape[:2]
+    if (points < 0).any() or (points[:, 0] > width).any() or (points[:, 1] > height).any():
+        raise InvalidFaceInput("Landmarks are outside the image")
+    if np.linalg.norm(points[1] - points[0]) < settings.FACE_LANDMARKS_MIN_EYE_DISTANCE:
+        raise InvalidFaceInput("Face is too small")
+
+    template = arcface_dst.astype(np.float32)
+    rotation, _, mapped = _similarity_fit(points, template)
+    eye_distance = np.linalg.norm(template[1] - template[0])
+    deviation = np.sqrt(((mapped - template) ** 2).sum(axis=1).mean()) / eye_distance
+    if deviation > settings.FACE_LANDMARKS_MAX_DEVIATION:
+        raise InvalidFaceInput("Landmarks do not look like a face")
+    roll = math.degrees(math.atan2(rotation[1, 0], rotation[0, 0]))
+    if abs(roll) > settings.FACE_LANDMARKS_MAX_ROLL_DEG:
+        raise InvalidFaceInput("Face is rotated too much")
+    return points
+
+
+def _client_crop(item: FaceInput) -> np.ndarray:
+    size = get_face_analyzer().models["recognition"].input_size[0]
+    if item.landmarks is not None:
+        return align_face(item.image, check_landmarks(item.landmarks, item.image.shape))
+    if item.image.shape[:2] != (size, size):
+        raise InvalidFaceInput(f"Aligned crop must be {size}x{size}")
+    return item.image
+
+
+def _client_crops(items: Sequence[FaceInput], slots: Sequence[int]) -> tuple[list[int], list[np.ndarray], dict]:
+    """Кропы для FaceInput: (номера входов, кропы, ошибки по номеру входа)."""
+    ok, crops, errors = [], [], {}
+    for i, item in zip(slots, items):
+        try:
+            crops.append(_client_crop(item))
+            ok.append(i)
+        except InvalidFaceInput as e:
+            errors[i] = e
+    return ok, crops, errors
+
+
+def _detected_crops(frames: Sequence[np.ndarray], slots: Sequence[int]) -> tuple[list[int], list[np.ndarray], dict]:
+    """Кропы по найденным детектором лицам: (номера входов, кропы, ошибки по номеру входа)."""
+    ok, crops, errors = [], [], {}
+    for i, img_arr in zip(slots, frames):
+        try:
+            crops.append(align_face(img_arr, detect_landmarks(img_arr)))
+            ok.append(i)
+        except LookupError as e:
+            errors[i] = e
+    return ok, crops, errors
+
+
+def get_embeddings(img_arrs: Sequence[FaceImage]) -> list[Union[np.ndarray, Exception]]:
+    """
+    Детекция выполняется по каждому изображению отдельно, а распознавание (ArcFace)
+    одним батчем для всех найденных лиц. Для изображения без лица на его месте
+    в результате лежит исключение (LookupError), а не эмбеддинг.
+
+    Для FaceInput детектор не запускается: кроп берётся как есть или выравнивается
+    по клиентским точкам; неправдоподобный вход даёт InvalidFaceInput.
+    """
+    results: list[Union[np.ndarray, Exception, None]] = [None] * len(img_arrs)
+    crops: list[np.ndarray] = []
+    slots: list[int] = []
+    client = [i for i, item in enumerate(img_arrs) if isinstance(item, FaceInput)]
+    frames = [i for i, item in enumerate(img_arrs) if not isinstance(item, FaceInput)]
+    for name, build, indices in (("align", _client_crops, client), ("detect", _detected_crops, frames)):
+        if not indices:
+            continue
+        with stage(name):
+            ok, found, errors = build([img_arrs[i] for i in indices], indices)
+        slots += ok
+        crops += found
+        for i, error in errors.items():
+            results[i] = error
+
+    if crops:
+        rec_model = get_face_analyzer().models["recognition"]
+        with stage("embed"):
+            feats = rec_model.get_feat(crops)
+        for i, feat in zip(slots, feats):
+            emb = normalize_embedding(feat.flatten())
+            results[i] = emb if emb.any() else ValueError("Zero embedding")
+    return results
+
+
+def warmup(iterations: int) -> None:
+    """
+    Загружает модели и прогоняет синтетические данные через детектор и распознавание,
+    чтобы первый реальный запрос не платил за создание сессий и первый прогон.
+    """
+    fa = get_face_analyzer()
+    rec_model = fa.models["recognition"]
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 255, (settings.FACE_DET_SIZE, settings.FACE_DET_SIZE, 3), dtype=np.uint8)
+    crop_size = rec_model.input_size[0]
+    crops = [np.zeros((crop_size, crop_size, 3), dtype=np.uint8)] * max(1, settings.INFERENCE_MAX_BATCH_SIZE)
+    for _ in range(iterations):
+        fa.det_model.detect(frame, max_num=0, metric="default")
+        # одиночный прогон и полный батч — типичные формы входа для батчера
+        rec_model.get_feat(crops[:1])
+        rec_model.get_feat(crops)
+
+
+def get_embedding(img_arr: FaceImage) -> np.ndarray:
+    result = get_embeddings([img_arr])[0]
+    if isinstance(result, Exception):
+        raise result
+    return result
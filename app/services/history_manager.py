@@ -0,0 +1,345 @@
+import argparse
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.utils import normalize_embedding
+from app.services.vector_store import UserRecords, get_vector_store
+
+
+logger = logging.getLogger(__name__)
+
+CENTROID_SOURCE = "centroid"
+
+
+class CompactionPlan(NamedTuple):
+    delete_ids: list[int]
+    centroid: Optional[np.ndarray]
+
+
+def select_diverse(embeddings: np.ndarray, created_at: np.ndarray, anchor: np.ndarray, count: int) -> list[int]:
+    """
+    Самый свежий образец плюс самые непохожие (farthest-point sampling).
+
+    Расстояние считается до уже выбранных образцов и до anchor (центроида),
+    поэтому в набор попадают разные ракурсы, а не копии среднего лица.
+    """
+    if count <= 0 or len(embeddings) == 0:
+        return []
+    first = int(np.argmax(created_at))
+    selected = [first]
+    # максимальное сходство каждого образца с уже выбранным набором
+    closest = np.maximum(embeddings @ anchor, embeddings @ embeddings[first])
+    closest[first] = np.inf
+    while len(selected) < min(count, len(embeddings)):
+        nxt = int(np.argmin(closest))
+        selected.append(nxt)
+        closest = np.maximum(closest, embeddings @ embeddings[nxt])
+        closest[nxt] = np.inf
+    return selected
+
+
+def plan_compaction(
+    records: UserRecords,
+    max_templates: int,
+    max_age_ms: Optional[int],
+    now_ms: int,
+) -> CompactionPlan:
+    """
+    Что удалить из истории пользователя и нужен ли новый центроид.
+
+    Образцы старше max_age_ms удаляются. Если живых образцов больше, чем
+    помещается рядом с центроидом в max_templates, остаются самый свежий и
+    самые разнообразные, а центроид пересчитывается по всем живым образцам
+    (до прореживания). Центроид хранится обычной строкой с source="centroid".
+    """
+    if records.ids.size == 0:
+        return CompactionPlan([], None)
+
+    sources = np.asarray(records.sources)
+    is_centroid = sources == CENTROID_SOURCE
+    alive = ~is_centroid
+    if max_age_ms is not None:
+        alive &= records.created_at >= now_ms - max_age_ms
+
+    samples = np.flatnonzero(alive)
+    if samples.size == 0:
+        # вся история устарела — пользователь проходит полную проверку заново
+        return CompactionPlan(records.ids.tolist(), None)
+
+    delete = set(records.ids[~alive & ~is_centroid].tolist())
+    centroids = np.flatnonzero(is_centroid)
+    budget = max(1, max_templates - 1)
+
+    if samples.size == 1:
+        # центроид из одного образца не нужен
+        return CompactionPlan(sorted(delete | set(records.ids[centroids].tolist())), None)
+
+    up_to_date = (
+        centroids.size == 1
+        and not delete
+        and samples.size <= budget
+        and records.created_at[centroids[0]] >= records.created_at[samples].max()
+    )
+    if up_to_date:
+        return CompactionPlan([], None)
+
+    embeddings = records.embeddings[samples]
+    centroid = normalize_embedding(embeddings.mean(axis=0))
+    if samples.size > budget:
+        keep = select_diverse(embeddings, records.created_at[samples], centroid, budget)
+        dropped = np.delete(samples, keep)
+        delete |= set(records.ids[dropped].tolist())
+    delete |= set(records.ids[centroids].tolist())
+    return CompactionPlan(sorted(delete), centroid)
+
+
+def remember_embedding(
+    user_id: int,
+    embedding: np.ndarray,
+    source: str = "reauth",
+    best_score: Optional[float] = None,
+) -> bool:
+    """
+    Добавляет эмбеддинг в историю, если он не почти копия уже сохранённого.
+
+    best_score — сходство с ближайшим эмбеддингом пользователя, если оно уже
+    посчитано (например, при повторной проверке); иначе делается поиск.
+    Возвращает True, если строка записана.
+    """
+    store = get_vector_store()
+    threshold = settings.HISTORY_DEDUP_THRESHOLD
+    if threshold is not None:
+        if best_score is None:
+            hits = store.search_user(embedding, user_id, top_k=1)
+            best_score = hits[0].score if hits else None
+        if best_score is not None and best_score >= threshold:
+            return False
+    store.save(user_id, embedding, source=source)
+    return True
+
+
+class HistoryCompactor:
+    """
+    Компакция истории — отдельное задание в одном экземпляре, не в воркерах API:
+    два компактора одновременно писали бы по центроиду и удаляли строки друг друга.
+
+        python -m app.services.history_manager            # цикл (одна реплика)
+        python -m app.services.history_manager --once --sweep   # один проход (cron)
+
+    Раз в interval_s обрабатывает пользователей, которым с прошлого прохода
+    добавили строки (по created_at, с перекрытием в интервал: write-behind
+    вставляет строки с задержкой); раз в sweep_interval_s и при старте обходит
+    всех пользователей, чтобы удалить устаревшие строки и у тех, кто давно
+    не заходил. Пользователи, у которых компакция упала, повторяются.
+
+    После каждого прохода счётчики пишутся в status_path: по нему процессы API
+    показывают состояние задания (/debug/history/compaction).
+    """
+
+    def __init__(
+        self,
+        interval_s: float,
+        sweep_interval_s: float,
+        max_templates: int,
+        max_age_ms: Optional[int],
+        status_path: Optional[str] = None,
+    ):
+        self._interval = max(0.1, interval_s)
+        self._sweep_interval = sweep_interval_s
+        self._max_templates = max_templates
+        self._max_age_ms = max_age_ms
+        self._status_path = status_path
+        self._last_pass_ms: Optional[int] = None
+        self._last_sweep_ms: Optional[int] = None
+        self._retry: set[int] = set()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.compacted = 0
+        self.deleted = 0
+        self.failures = 0
+
+    def compact_user(self, user_id: int) -> CompactionPlan:
+        store = get_vector_store()
+        plan = plan_compaction(
+            store.fetch_user(user_id), self._max_templates, self._max_age_ms, int(time.time() * 1000)
+        )
+        # сначала новый центроид, потом удаление: у пользователя не бывает пустой истории.
+        # save_many вставляет синхронно, мимо write-behind буфера: удаление начинается,
+        # только когда вставка центроида подтверждена, а при ошибке не начинается вовсе
+        if plan.centroid is not None:
+            store.save_many([user_id], plan.centroid[None, :], CENTROID_SOURCE)
+        if plan.delete_ids:
+            store.delete(plan.delete_ids)
+        if plan.centroid is not None or plan.delete_ids:
+            with self._lock:
+                self.compacted += 1
+                self.deleted += len(plan.delete_ids)
+        return plan
+
+    def run_once(self, since_ms: Optional[int] = None, sweep: bool = False) -> None:
+        started_ms = int(time.time() * 1000)
+        with self._lock:
+            users, self._retry = self._retry, set()
+        store = get_vector_store()
+        if sweep:
+            users |= store.list_users()
+        elif since_ms is not None:
+            users |= store.users_since(since_ms)
+        for user_id in users:
+            if self._stopping.is_set():
+                return
+            try:
+                self.compact_user(user_id)
+            except Exception:
+                with self._lock:
+                    self.failures += 1
+                    self._retry.add(user_id)
+                logger.exception("History compaction for user %s failed", user_id)
+        with self._lock:
+            self._last_pass_ms = started_ms
+            if sweep:
+                self._last_sweep_ms = started_ms
+        self.write_status()
+
+    def write_status(self) -> None:
+        if self._status_path is None:
+            return
+        status = {**self.stats(), "updated_at_ms": int(time.time() * 1000)}
+        try:
+            os.makedirs(os.path.dirname(self._status_path) or ".", exist_ok=True)
+            with open(self._status_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(status, f)
+            os.replace(self._status_path + ".tmp", self._status_path)
+        except OSError:
+            logger.warning("Failed to write history compaction status to %s", self._status_path, exc_info=True)
+
+    def _run(self) -> None:
+        last_sweep: Optional[float] = None
+        last_pass_ms = int(time.time() * 1000)
+        while not self._stopping.is_set():
+            sweep = last_sweep is None or time.monotonic() - last_sweep >= self._sweep_interval
+            started_ms = int(time.time() * 1000)
+            try:
+                self.run_once(since_ms=last_pass_ms - int(self._interval * 1000), sweep=sweep)
+            except Exception:
+                logger.exception("History compaction pass failed")
+            else:
+                last_pass_ms = started_ms
+                if sweep:
+                    last_sweep = time.monotonic()
+            self._stopping.wait(self._interval)
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="history-compactor", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join(timeout)
+            self._thread = None
+            self.write_status()
+
+    def wait(self) -> None:
+        while self._thread is not None and self._thread.is_alive():
+            self._thread.join(1.0)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "running": self._thread is not None,
+                "pending_users": len(self._retry),
+                "compacted": self.compacted,
+                "deleted": self.deleted,
+                "failures": self.failures,
+                "last_pass_ms": self._last_pass_ms,
+                "last_sweep_ms": self._last_sweep_ms,
+            }
+
+
+def read_compaction_status(path: str) -> Optional[dict]:
+    """Последнее состояние задания компакции из его файла статуса; None — задание ещё не отчитывалось."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+_compactor: Optional[HistoryCompactor] = None
+
+
+def get_history_compactor() -> Optional[HistoryCompactor]:
+    global _compactor
+    if not settings.HISTORY_COMPACTION_ENABLED:
+        return None
+    if _compactor is None:
+        days = settings.HISTORY_RETENTION_DAYS
+        _compactor = HistoryCompactor(
+            interval_s=settings.HISTORY_COMPACTION_INTERVAL_S,
+            sweep_interval_s=settings.HISTORY_RETENTION_SWEEP_INTERVAL_S,
+            max_templates=settings.HISTORY_MAX_TEMPLATES,
+            max_age_ms=int(days * 86400 * 1000) if days is not None else None,
+            status_path=settings.HISTORY_COMPACTION_STATUS_PATH,
+        )
+    return _compactor
+
+
+def stop_history_compactor() -> None:
+    global _compactor
+    if _compactor is not None:
+        _compactor.stop(timeout=settings.HISTORY_SHUTDOWN_TIMEOUT_S)
+        _compactor = None
+
+
+def main(argv=None) -> int:
+    from app.services.vector_store import close_vector_store
+
+    parser = argparse.ArgumentParser(description="History compaction job (run a single instance)")
+    parser.add_argument("--once", action="store_true", help="one pass and exit (for cron)")
+    parser.add_argument("--sweep", action="store_true", help="with --once: all users, not only recent ones")
+    parser.add_argument("--since-s", type=float, help="with --once: users with rows added in the last N seconds")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    compactor = get_history_compactor()
+    if compactor is None:
+        logger.info("History compaction is disabled (HISTORY_COMPACTION_ENABLED=false)")
+        return 0
+    get_vector_store().start()
+    try:
+        if args.once:
+            since_ms = int((time.time() - args.since_s) * 1000) if args.since_s is not None else None
+            compactor.run_once(since_ms=since_ms, sweep=args.sweep or since_ms is None)
+        else:
+            signal.signal(signal.SIGTERM, lambda *_: compactor.stop())
+            compactor.start()
+            try:
+                compactor.wait()
+            except KeyboardInterrupt:
+                compactor.stop()
+    finally:
+        close_vector_store()
+    logger.info("History compaction: %s", compactor.stats())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
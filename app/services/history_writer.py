@@ -0,0 +1,317 @@
+import base64
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryRow(NamedTuple):
+    user_id: int
+    embedding: np.ndarray
+    created_at: int
+    source: str
+
+
+def _encode_row(row: HistoryRow) -> str:
+    return json.dumps({
+        "user_id": row.user_id,
+        "created_at": row.created_at,
+        "source": row.source,
+        "embedding": base64.b64encode(np.asarray(row.embedding, dtype=np.float32).tobytes()).decode("ascii"),
+    })
+
+
+def _decode_row(line: str) -> HistoryRow:
+    data = json.loads(line)
+    return HistoryRow(
+        user_id=int(data["user_id"]),
+        embedding=np.frombuffer(base64.b64decode(data["embedding"]), dtype=np.float32),
+        created_at=int(data["created_at"]),
+        source=data["source"],
+    )
+
+
+class HistoryWriter:
+    """
+    Write-behind буфер для строк истории эмбеддингов.
+
+    Запрос только кладёт строку в буфер; фоновый поток вставляет их пачками,
+    когда набралось batch_size строк или прошло flush_interval_ms. flush() не
+    вызывается: Milvus сам запечатывает сегменты, а вставленные строки видны
+    поиску и без него.
+
+    Если задан spool_dir, каждая строка сначала дописывается в локальный журнал
+    (сегменты JSONL). Строки вставляются строго по порядку, поэтому вставленные
+    строки сегмента — его префикс: после каждого батча их число пишется в
+    чекпоинт сегмента (.acked). Сегмент удаляется, когда все его строки вставлены,
+    а при старте из журнала заново ставятся в очередь только строки после
+    чекпоинта — так строки переживают падение процесса, а повториться может
+    не больше одного батча (упавшего между вставкой и записью чекпоинта).
+    """
+
+    def __init__(
+        self,
+        insert_rows: Callable[[Sequence[HistoryRow]], None],
+        batch_size: int,
+        flush_interval_ms: float,
+        max_buffer: int,
+        spool_dir: Optional[str] = None,
+        segment_rows: int = 1000,
+    ):
+        self._insert_rows = insert_rows
+        self._batch_size = max(1, batch_size)
+        self._flush_interval = max(0.0, flush_interval_ms) / 1000
+        self._max_buffer = max(self._batch_size, max_buffer)
+        self._spool_dir = spool_dir
+        self._segment_rows = max(1, segment_rows)
+
+        self._buffer: deque[tuple[int, HistoryRow]] = deque()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+
+        # журнал: номер сегмента -> сколько его строк ещё не вставлено / уже вставлено
+        self._outstanding: dict[int, int] = {}
+        self._acked: dict[int, int] = {}
+        self._segment_id = 0
+        self._segment_file = None
+        self._segment_written = 0
+
+        self.inserted = 0
+        self.batches = 0
+        self.failures = 0
+
+    # --- журнал ---
+
+    def _segment_path(self, segment_id: int) -> str:
+        return os.path.join(self._spool_dir, f"segment-{segment_id:08d}.jsonl")
+
+    def _ack_path(self, segment_id: int) -> str:
+        return os.path.join(self._spool_dir, f"segment-{segment_id:08d}.acked")
+
+    def _read_ack(self, segment_id: int) -> int:
+        try:
+            with open(self._ack_path(segment_id), encoding="utf-8") as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _write_ack(self, segment_id: int) -> None:
+        path = self._ack_path(segment_id)
+        acked = self._acked.get(segment_id, 0)
+        if not acked:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(str(acked))
+        os.replace(path + ".tmp", path)
+
+    def _open_segment(self, segment_id: int) -> None:
+        if self._segment_file is not None:
+            self._segment_file.close()
+        self._segment_id = segment_id
+        self._segment_file = open(self._segment_path(segment_id), "a", encoding="utf-8")
+        self._segment_written = 0
+        self._outstanding.setdefault(segment_id, 0)
+        self._acked.setdefault(segment_id, 0)
+
+    def _replay_spool(self) -> None:
+        os.makedirs(self._spool_dir, exist_ok=True)
+        last_id = -1
+        replayed = 0
+        for path in sorted(glob.glob(os.path.join(self._spool_dir, "segment-*.jsonl"))):
+            segment_id = int(os.path.basename(path)[len("segment-"):-len(".jsonl")])
+            last_id = max(last_id, segment_id)
+            # первые acked строк уже вставлены до падения
+            acked = self._read_ack(segment_id)
+            valid = 0
+            count = 0
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        row = _decode_row(line)
+                    except Exception:
+                        # недописанная при падении строка
+                        logger.warning("Skipping corrupted spool line in %s", path)
+                        continue
+                    valid += 1
+                    if valid <= acked:
+                        continue
+                    self._buffer.append((segment_id, row))
+                    count += 1
+            if count:
+                self._outstanding[segment_id] = count
+                self._acked[segment_id] = acked
+                replayed += count
+            else:
+                os.remove(path)
+                self._acked[segment_id] = 0
+                self._write_ack(segment_id)
+                del self._acked[segment_id]
+        for path in glob.glob(os.path.join(self._spool_dir, "segment-*.acked")):
+            segment_id = int(os.path.basename(path)[len("segment-"):-len(".acked")])
+            if not os.path.exists(self._segment_path(segment_id)):
+                # сегмент удалён, а чекпоинт — нет (падение между ними); номер не переиспользуем
+                last_id = max(last_id, segment_id)
+                os.remove(path)
+        if replayed:
+            logger.info("Replaying %d history rows from spool", replayed)
+        self._open_segment(last_id + 1)
+
+    def _spool(self, row: HistoryRow) -> int:
+        if self._spool_dir is None:
+            return -1
+        if self._segment_written >= self._segment_rows:
+            self._open_segment(self._segment_id + 1)
+        self._segment_file.write(_encode_row(row) + "\n")
+        # flush без fsync: строка переживает падение процесса, но не машины
+        self._segment_file.flush()
+        self._segment_written += 1
+        self._outstanding[self._segment_id] += 1
+        return self._segment_id
+
+    def _release(self, batch: Sequence[tuple[int, HistoryRow]]) -> None:
+        if self._spool_dir is None:
+            return
+        touched = set()
+        for segment_id, _ in batch:
+            self._outstanding[segment_id] -= 1
+            self._acked[segment_id] += 1
+            touched.add(segment_id)
+        for segment_id in touched:
+            if self._outstanding[segment_id] == 0 and segment_id == self._segment_id:
+                # текущий сегмент полностью вставлен — просто обнуляем его
+                self._segment_file.truncate(0)
+                self._segment_file.seek(0)
+                self._segment_written = 0
+                self._acked[segment_id] = 0
+                self._write_ack(segment_id)
+            elif self._outstanding[segment_id] == 0:
+                del self._outstanding[segment_id]
+                os.remove(self._segment_path(segment_id))
+                self._acked[segment_id] = 0
+                self._write_ack(segment_id)
+                del self._acked[segment_id]
+            else:
+                self._write_ack(segment_id)
+
+    # --- публичный интерфейс ---
+
+    def start(self) -> None:
+        with self._cond:
+            if self._thread is not None:
+                return
+            if self._spool_dir is not None:
+                self._replay_spool()
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+            self._thread.start()
+
+    def put(self, row: HistoryRow) -> None:
+        with self._cond:
+            if self._thread is None or self._stopping:
+                raise RuntimeError("History writer is not running")
+            # обратное давление: если Milvus не успевает, ждём место в буфере
+            while len(self._buffer) >= self._max_buffer:
+                self._cond.wait()
+            self._buffer.append((self._spool(row), row))
+            # будим поток на первой строке (старт интервала) и на полном батче
+            if len(self._buffer) == 1 or len(self._buffer) >= self._batch_size:
+                self._cond.notify_all()
+
+    def _take_batch(self) -> list[tuple[int, HistoryRow]]:
+        with self._cond:
+            deadline = time.monotonic() + self._flush_interval
+            while len(self._buffer) < self._batch_size and not self._stopping:
+                if not self._buffer:
+                    # интервал отсчитывается от первой строки в буфере
+                    self._cond.wait()
+                    deadline = time.monotonic() + self._flush_interval
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(timeout=remaining)
+            size = min(self._batch_size, len(self._buffer))
+            batch = [self._buffer.popleft() for _ in range(size)]
+            self._cond.notify_all()
+            return batch
+
+    def _run(self) -> None:
+        try:
+            self._write_loop()
+        finally:
+            # сегмент закрывает сам поток: stop() по таймауту может вернуться раньше,
+            # пока вставка ещё идёт и её _release пишет в журнал
+            with self._cond:
+                if self._segment_file is not None:
+                    self._segment_file.close()
+                    self._segment_file = None
+
+    def _write_loop(self) -> None:
+        backoff = 0.1
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                if self._stopping:
+                    return
+                continue
+            try:
+                self._insert_rows([row for _, row in batch])
+            except Exception:
+                self.failures += 1
+                logger.exception("Failed to insert %d history rows; will retry", len(batch))
+                with self._cond:
+                    self._buffer.extendleft(reversed(batch))
+                    if self._stopping:
+                        # при остановке не ретраим бесконечно: строки остаются в журнале
+                        return
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 10.0)
+                continue
+            backoff = 0.1
+            with self._cond:
+                self.inserted += len(batch)
+                self.batches += 1
+                self._release(batch)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Дописывает буфер в Milvus и останавливает поток."""
+        with self._cond:
+            if self._thread is None:
+                return
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        with self._cond:
+            if self._buffer:
+                logger.warning(
+                    "%d history rows were not inserted on shutdown%s",
+                    len(self._buffer),
+                    "; they are kept in spool" if self._spool_dir else "",
+                )
+            if self._thread.is_alive():
+                # вставка ещё идёт: поток допишет журнал и закроет сегмент сам
+                logger.warning("History writer did not stop within %ss; it finishes in background", timeout)
+                return
+            self._thread = None
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "buffered": len(self._buffer),
+                "inserted": self.inserted,
+                "batches": self.batches,
+                "failures": self.failures,
+                "spool": self._spool_dir is not None,
+            }
@@ -0,0 +1,259 @@
+import asyncio
+import contextvars
+import logging
+import time
+from typing import Callable, Optional, Sequence, Union
+
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.core.metrics import BATCH_SIZE, STAGE_SECONDS, registry, stage
+from app.services.admission import DeadlineExceeded, Overloaded, check_deadline, current_deadline
+from app.services.embedding_cache import cache_key, get_embedding_cache
+from app.services.face_analysis import FaceImage, FaceInput, get_embeddings, warmup
+from app.services.inference_pool import get_inference_pool, shutdown_inference_pool
+from app.services.ingest import decode_image_scaled
+
+
+logger = logging.getLogger(__name__)
+
+BatchRunner = Callable[[Sequence[FaceImage]], list[Union[np.ndarray, Exception]]]
+
+
+class EmbeddingBatcher:
+    """
+    Собирает задачи на эмбеддинг от конкурентных запросов в батчи.
+
+    Батч отправляется в модель, когда набрано max_batch_size задач или
+    с момента прихода первой задачи прошло max_wait_ms. Одновременно в работе
+    не больше concurrency батчей; пока они считаются, новые задачи копятся
+    в очереди и уходят следующим батчем. Очередь ограничена max_queue задачами,
+    а задачи, дедлайн которых прошёл, пока они ждали, в модель не отправляются.
+    """
+
+    def __init__(
+        self,
+        runner: BatchRunner,
+        max_batch_size: int,
+        max_wait_ms: float,
+        concurrency: int = 1,
+        max_queue: int = 0,
+    ):
+        self._runner = runner
+        self._max_batch_size = max(1, max_batch_size)
+        self._max_wait = max(0.0, max_wait_ms) / 1000
+        self._concurrency = max(1, concurrency)
+        self._max_queue = max(0, max_queue)
+        self._queue: Optional[asyncio.Queue] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._in_flight: set[asyncio.Task] = set()
+
+    def _ensure_started(self) -> None:
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue(self._max_queue)
+            self._slots = asyncio.Semaphore(self._concurrency)
+            # свой контекст: иначе воркер унаследует contextvars запроса, который его запустил
+            self._worker = asyncio.get_running_loop().create_task(self._run(), context=contextvars.Context())
+
+    async def submit(self, img_arr: FaceImage, wait: bool = False) -> np.ndarray:
+        """wait=True — при полной очереди ждать места (пакетные задания), иначе Overloaded."""
+        check_deadline()
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        job = (img_arr, future, time.perf_counter(), current_deadline())
+        if wait:
+            await self._queue.put(job)
+        else:
+            try:
+                self._queue.put_nowait(job)
+            except asyncio.QueueFull:
+                raise Overloaded("Inference queue is full")
+        result = await future
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def _collect(self) -> list:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self._max_wait
+        while len(batch) < self._max_batch_size:
+            # сначала забираем всё, что уже лежит в очереди, без ожидания
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def in_flight(self) -> int:
+        return len(self._in_flight)
+
+    async def _process(self, jobs: list) -> None:
+        BATCH_SIZE.observe(len(jobs))
+        dispatched = time.perf_counter()
+        for _, _, enqueued, _ in jobs:
+            STAGE_SECONDS.observe(dispatched - enqueued, stage="batch_queue")
+        try:
+            with stage("model_batch"):
+                results = await run_in_threadpool(self._runner, [img for img, _, _, _ in jobs])
+        except Exception as e:
+            logger.exception("Embedding batch of %d failed", len(jobs))
+            results = [e] * len(jobs)
+        finally:
+            self._slots.release()
+        for (_, fut, _, _), result in zip(jobs, results):
+            if not fut.done():
+                fut.set_result(result)
+
+    async def _run(self) -> None:
+        while True:
+            # слот занимаем до сбора батча: пока все слоты заняты, задачи копятся в очереди
+            await self._slots.acquire()
+            batch = await self._collect()
+            # запросы, которые уже отменены (клиент ушёл) или опоздали, в модель не отправляем
+            now = time.monotonic()
+            jobs = []
+            for job in batch:
+                _, fut, _, deadline = job
+                if fut.done():
+                    continue
+                if deadline is not None and deadline <= now:
+                    fut.set_result(DeadlineExceeded("Request deadline exceeded in inference queue"))
+                    continue
+                jobs.append(job)
+            if not jobs:
+                self._slots.release()
+                continue
+            task = asyncio.get_running_loop().create_task(self._process(jobs))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def shutdown(self) -> None:
+        for task in list(self._in_flight):
+            task.cancel()
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+
+_batcher: Optional[EmbeddingBatcher] = None
+
+
+def run_batch(img_arrs: Sequence[FaceImage]) -> list[Union[np.ndarray, Exception]]:
+    """Считает батч в пуле процессов, если он включён, иначе в текущем процессе."""
+    if settings.INFERENCE_WORKERS > 0:
+        return get_inference_pool(settings.INFERENCE_WORKERS).embed_batch(img_arrs)
+    return get_embeddings(img_arrs)
+
+
+def get_batcher() -> EmbeddingBatcher:
+    global _batcher
+    if _batcher is None:
+        _batcher = EmbeddingBatcher(
+            run_batch,
+            max_batch_size=settings.INFERENCE_MAX_BATCH_SIZE,
+            max_wait_ms=settings.INFERENCE_MAX_WAIT_MS,
+            # по батчу в работе на каждый воркер пула
+            concurrency=max(1, settings.INFERENCE_WORKERS),
+            max_queue=settings.INFERENCE_MAX_QUEUE,
+        )
+    return _batcher
+
+
+registry.gauge(
+    "face_auth_inference_queue_depth",
+    "Images waiting for a model batch",
+    fn=lambda: _batcher.queue_depth() if _batcher is not None else 0,
+)
+registry.gauge(
+    "face_auth_inference_batches_in_flight",
+    "Model batches currently running",
+    fn=lambda: _batcher.in_flight() if _batcher is not None else 0,
+)
+
+
+async def embed_image(img_arr: FaceImage, wait: bool = False) -> np.ndarray:
+    """Эмбеддинг лица; LookupError, если лицо не найдено, InvalidFaceInput — если отклонён вход клиента."""
+    if settings.INFERENCE_BATCHING_ENABLED:
+        return await get_batcher().submit(img_arr, wait=wait)
+    check_deadline()
+    result = (await run_in_threadpool(run_batch, [img_arr]))[0]
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def _input_variant(landmarks: Optional[np.ndarray], aligned: bool) -> str:
+    if aligned:
+        return "aligned"
+    if landmarks is not None:
+        return "landmarks:" + ",".join(f"{v:.1f}" for v in np.asarray(landmarks).ravel())
+    return ""
+
+
+async def embed_upload(
+    contents: bytes,
+    wait: bool = False,
+    landmarks: Optional[np.ndarray] = None,
+    aligned: bool = False,
+) -> np.ndarray:
+    """
+    Эмбеддинг по байтам загруженного файла. Повторные загрузки того же файла
+    (ретраи, многошаговый онбординг) берутся из кэша без декодирования и инференса.
+    wait — ждать места в очереди инференса вместо Overloaded.
+
+    Если лицо уже нашёл клиент, детектор не запускается: aligned — файл сам является
+    выровненным кропом, landmarks — пять точек в координатах исходного файла.
+    """
+    cache = get_embedding_cache()
+    key = None
+    if cache is not None:
+        with stage("cache_lookup"):
+            key = await run_in_threadpool(cache_key, contents, _input_variant(landmarks, aligned))
+            cached = await cache.aget(key)
+        if cached is not None:
+            return cached
+
+    check_deadline()
+    with stage("decode"):
+        # кроп маленький, его не уменьшаем
+        img_arr, scale = await run_in_threadpool(decode_image_scaled, contents, 0 if aligned else None)
+    if aligned:
+        img_arr = FaceInput(img_arr)
+    elif landmarks is not None:
+        img_arr = FaceInput(img_arr, np.asarray(landmarks, dtype=np.float32) * scale)
+    # ожидание в очереди батчера + прогон модели
+    with stage("inference"):
+        emb = await embed_image(img_arr, wait=wait)
+    if cache is not None:
+        await cache.aput(key, emb)
+    return emb
+
+
+def start_inference() -> None:
+    """Загружает и прогревает модели: в воркерах пула или в текущем процессе."""
+    if settings.INFERENCE_WORKERS > 0:
+        get_inference_pool(settings.INFERENCE_WORKERS).warmup()
+    else:
+        warmup(settings.WARMUP_ITERATIONS)
+
+
+async def shutdown_inference() -> None:
+    if _batcher is not None:
+        await _batcher.shutdown()
+    await run_in_threadpool(shutdown_inference_pool)
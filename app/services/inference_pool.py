@@ -0,0 +1,119 @@
+import logging
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Optional, Sequence, Union
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.face_analysis import FaceImage, FaceInput, get_embeddings, warmup
+
+
+logger = logging.getLogger(__name__)
+
+# (имя блока shared memory, shape, dtype.str) — всё, что уходит в воркер через pickle
+ArraySpec = tuple[str, tuple[int, ...], str]
+# кадр передаётся как ArraySpec, FaceInput — с ArraySpec вместо image (точки маленькие, идут pickle)
+ItemSpec = Union[ArraySpec, FaceInput]
+
+
+def _share_array(arr: np.ndarray) -> tuple[shared_memory.SharedMemory, ArraySpec]:
+    arr = np.ascontiguousarray(arr)
+    shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+    return shm, (shm.name, arr.shape, arr.dtype.str)
+
+
+def _init_worker() -> None:
+    # каждый воркер держит свои прогретые модели
+    warmup(settings.WARMUP_ITERATIONS)
+
+
+def _ping() -> bool:
+    return True
+
+
+def _embed_shared(specs: Sequence[ItemSpec]) -> list[Union[np.ndarray, Exception]]:
+    array_specs = [spec.image if isinstance(spec, FaceInput) else spec for spec in specs]
+    blocks = [shared_memory.SharedMemory(name=name) for name, _, _ in array_specs]
+    try:
+        arrays = [
+            np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+            for shm, (_, shape, dtype) in zip(blocks, array_specs)
+        ]
+        items = [
+            spec._replace(image=arr) if isinstance(spec, FaceInput) else arr
+            for spec, arr in zip(specs, arrays)
+        ]
+        results = get_embeddings(items)
+        # view на shm.buf нужно отпустить до close()
+        del arrays, items
+        return results
+    finally:
+        for shm in blocks:
+            shm.close()
+
+
+class InferencePool:
+    """
+    Пул процессов для детекции и эмбеддингов.
+
+    Декодированные изображения передаются воркерам через shared memory:
+    в pickle уходит только имя блока и shape, сам массив не копируется через pipe.
+    Блоки создаёт и освобождает родительский процесс.
+    """
+
+    def __init__(self, workers: int):
+        self._workers = workers
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=mp.get_context("spawn"),
+            initializer=_init_worker,
+        )
+
+    @property
+    def workers(self) -> int:
+        return self._workers
+
+    def warmup(self) -> None:
+        """Поднимает все воркеры (и загружает в них модель) заранее, а не на первом запросе."""
+        futures = [self._executor.submit(_ping) for _ in range(self._workers)]
+        for future in futures:
+            future.result()
+
+    def embed_batch(self, img_arrs: Sequence[FaceImage]) -> list[Union[np.ndarray, Exception]]:
+        # блокирующий вызов: зовётся из threadpool/батчера, сам поток только ждёт воркер
+        blocks: list[shared_memory.SharedMemory] = []
+        try:
+            specs: list[ItemSpec] = []
+            for item in img_arrs:
+                shm, spec = _share_array(item.image if isinstance(item, FaceInput) else item)
+                blocks.append(shm)
+                specs.append(item._replace(image=spec) if isinstance(item, FaceInput) else spec)
+            return self._executor.submit(_embed_shared, specs).result()
+        finally:
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+_pool: Optional[InferencePool] = None
+
+
+def get_inference_pool(workers: int) -> InferencePool:
+    global _pool
+    if _pool is None:
+        logger.info("Starting inference pool with %d workers", workers)
+        _pool = InferencePool(workers)
+    return _pool
+
+
+def shutdown_inference_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
@@ -0,0 +1,200 @@
+import json
+import struct
+from io import BytesIO
+from typing import Literal, Optional
+
+import numpy as np
+from fastapi import HTTPException, Request, UploadFile
+from PIL import Image
+
+from app.core.config import settings
+
+
+_CHUNK_BYTES = 256 * 1024
+
+# image — детектор ищет лицо на кадре; aligned — файл уже выровненный кроп;
+# landmarks — кадр плюс пять точек от клиента (проверяются на правдоподобие)
+InputMode = Literal["image", "aligned", "landmarks"]
+
+# кадр пары для /verify_identity_raw: magic, длины паспорта и селфи (uint32 big-endian), затем сами файлы
+PAIR_FRAME_MAGIC = b"FAP1"
+_PAIR_HEADER = struct.Struct(">4sII")
+RAW_CONTENT_TYPES = ("application/octet-stream", "image/")
+
+
+async def read_upload(upload: UploadFile, max_bytes: int) -> bytes:
+    """
+    Читает загруженный файл с ограничением размера.
+
+    Размер части multipart известен после разбора формы — слишком большой файл
+    отклоняется без чтения; иначе файл читается кусками и чтение обрывается,
+    как только лимит превышен.
+    """
+    if upload.size is not None:
+        if upload.size > max_bytes:
+            raise HTTPException(status_code=413, detail="File too large")
+        return await upload.read()
+    chunks = []
+    total = 0
+    while chunk := await upload.read(_CHUNK_BYTES):
+        total += len(chunk)
+        if total > max_bytes:
+            raise HTTPException(status_code=413, detail="File too large")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def check_raw_content_type(request: Request) -> None:
+    content_type = request.headers.get("content-type", "")
+    if not content_type.startswith(RAW_CONTENT_TYPES):
+        raise HTTPException(status_code=415, detail="Expected application/octet-stream body")
+
+
+async def read_body(request: Request, max_bytes: int) -> bytes:
+    """
+    Тело запроса целиком, без multipart: байты идут в декодер без временных файлов.
+    Content-Length больше лимита отклоняется до чтения.
+    """
+    length = request.headers.get("content-length")
+    if length is not None and length.isdigit() and int(length) > max_bytes:
+        raise HTTPException(status_code=413, detail="File too large")
+    chunks = []
+    total = 0
+    async for chunk in request.stream():
+        total += len(chunk)
+        if total > max_bytes:
+            raise HTTPException(status_code=413, detail="File too large")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+async def read_pair_frame(request: Request, max_file_bytes: int) -> tuple[bytes, bytes]:
+    """
+    Паспорт и селфи из одного бинарного тела:
+
+        "FAP1" | uint32 BE длина паспорта | uint32 BE длина селфи | паспорт | селфи
+
+    Длины известны из заголовка, поэтому слишком большой файл отклоняется до чтения
+    остального тела, а куски тела раскладываются по двум файлам без промежуточного буфера.
+    """
+    header = b""
+    sizes: Optional[tuple[int, int]] = None
+    parts: tuple[list, list] = ([], [])
+    filled = [0, 0]
+    async for chunk in request.stream():
+        data = memoryview(chunk)
+        if sizes is None:
+            header += chunk
+            if len(header) < _PAIR_HEADER.size:
+                continue
+            magic, passport_len, selfie_len = _PAIR_HEADER.unpack_from(header)
+            if magic != PAIR_FRAME_MAGIC:
+                raise HTTPException(status_code=400, detail="Invalid frame magic")
+            if max(passport_len, selfie_len) > max_file_bytes:
+                raise HTTPException(status_code=413, detail="File too large")
+            sizes = (passport_len, selfie_len)
+            data = memoryview(header)[_PAIR_HEADER.size:]
+        while data:
+            part = 0 if filled[0] < sizes[0] else 1
+            room = sizes[part] - filled[part]
+            if room == 0:
+                raise HTTPException(status_code=400, detail="Frame is longer than declared")
+            parts[part].append(data[:room])
+            filled[part] += min(room, len(data))
+            data = data[room:]
+    if sizes is None or tuple(filled) != sizes:
+        raise HTTPException(status_code=400, detail="Truncated frame")
+    return b"".join(parts[0]), b"".join(parts[1])
+
+
+def decode_image(data: bytes, max_side: Optional[int] = None) -> np.ndarray:
+    return decode_image_scaled(data, max_side)[0]
+
+
+def decode_image_scaled(data: bytes, max_side: Optional[int] = None) -> tuple[np.ndarray, float]:
+    """
+    Декодирует изображение в RGB-массив уменьшенного разрешения.
+
+    JPEG декодируется сразу в уменьшенном масштабе (draft: 1/2, 1/4, 1/8 на этапе DCT) —
+    до наименьшего, у которого длинная сторона не меньше max_side; это почти бесплатно,
+    и 12-мегапиксельное селфи не разворачивается в полном разрешении. Явный ресайз
+    дорогой, поэтому он делается, только если изображение всё ещё больше 2 * max_side
+    (PNG, WebP, огромные JPEG). Детектор всё равно работает на FACE_DET_SIZE.
+
+    Вторым значением возвращается масштаб относительно исходного размера —
+    по нему пересчитываются координаты, присланные клиентом.
+    """
+    max_side = settings.INGEST_MAX_SIDE if max_side is None else max_side
+    image = Image.open(BytesIO(data))
+    original_width = image.size[0]
+    if max_side > 0 and max(image.size) > max_side:
+        if image.format == "JPEG":
+            scale = max_side / max(image.size)
+            image.draft("RGB", (int(image.size[0] * scale), int(image.size[1] * scale)))
+        if max(image.size) > 2 * max_side:
+            image.thumbnail((max_side, max_side), Image.Resampling.BILINEAR)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    return np.asarray(image), image.size[0] / original_width
+
+
+def parse_landmarks(raw: Optional[str], field: str) -> np.ndarray:
+    """Ключевые точки из поля формы: JSON [[x, y], ...] — глаза, нос, углы рта в пикселях исходного изображения."""
+    if raw is None:
+        raise HTTPException(status_code=422, detail=f"{field} is required in landmarks mode")
+    try:
+        points = np.asarray(json.loads(raw), dtype=np.float32)
+    except (ValueError, TypeError):
+        points = None
+    if points is None or points.shape != (5, 2) or not np.isfinite(points).all():
+        raise HTTPException(status_code=422, detail=f"{field} must be a JSON array of 5 [x, y] points")
+    return points
+
+
+class BodySizeLimitMiddleware:
+    """
+    ASGI middleware: ограничивает размер тела запроса до разбора multipart.
+
+    Запрос с Content-Length больше лимита отклоняется сразу, тело без длины
+    (chunked) считается по мере получения и обрывается на превышении.
+    """
+
+    def __init__(self, app, max_bytes: int, overrides: Optional[dict[str, int]] = None):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.overrides = overrides or {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        limit = self.overrides.get(scope["path"], self.max_bytes)
+        headers = dict(scope.get("headers") or [])
+        length = headers.get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > limit:
+            await self._reject(send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # HTTPException проходит через разбор формы FastAPI и превращается в 413
+                    raise HTTPException(status_code=413, detail="Request body too large")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+    @staticmethod
+    async def _reject(send) -> None:
+        body = b'{"detail":"Request body too large"}'
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,248 @@
+import json
+import os
+import threading
+import time
+from typing import Iterator, Optional, Sequence
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.utils import normalize_embedding
+from app.services.vector_store import (
+    Hit,
+    UserRecords,
+    VectorStore,
+    group_by_user,
+    records_page,
+    score_records,
+    summarize_history,
+)
+
+
+# user_id удалённой строки; место в файлах не освобождается
+_DELETED = -1
+
+
+class LocalVectorStore(VectorStore):
+    """
+    Хранилище истории в одном процессе, без Milvus.
+
+    Эмбеддинги лежат в memory-mapped матрице float32 (capacity x dim), рядом —
+    столбцы user_id, created_at и код source. Индекс user_id -> номера строк
+    держится в памяти и восстанавливается при открытии. Поиск — матричное
+    умножение по строкам пользователя (или по всей матрице блоками для identify).
+    Подходит для небольших инсталляций, edge-площадок, тестов и бенчмарков.
+    """
+
+    _COLUMNS = {
+        "embeddings": np.float32,
+        "user_ids": np.int64,
+        "created_at": np.int64,
+        "sources": np.int16,
+    }
+
+    def __init__(self, path: str, dim: int, initial_capacity: int = 1024):
+        self._path = path
+        self._dim = dim
+        self._lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+
+        meta = self._read_meta()
+        if meta is not None and meta["dim"] != dim:
+            raise ValueError(f"Local store at {path} has dim {meta['dim']}, expected {dim}")
+        self._count = meta["count"] if meta else 0
+        self._sources: list[str] = meta["sources"] if meta else []
+        self._source_codes = {s: i for i, s in enumerate(self._sources)}
+        self._open(meta["capacity"] if meta else max(1, initial_capacity))
+
+        self._index: dict[int, list[int]] = {}
+        for row, user_id in enumerate(self._user_ids[: self._count].tolist()):
+            if user_id == _DELETED:
+                continue
+            self._index.setdefault(user_id, []).append(row)
+
+    # --- файлы ---
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self._path, f"{name}.bin")
+
+    def _read_meta(self) -> Optional[dict]:
+        try:
+            with open(os.path.join(self._path, "meta.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_meta(self) -> None:
+        meta_path = os.path.join(self._path, "meta.json")
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(
+                {"dim": self._dim, "count": self._count, "capacity": self._capacity, "sources": self._sources}, f
+            )
+        os.replace(meta_path + ".tmp", meta_path)
+
+    def _open(self, capacity: int) -> None:
+        self._capacity = capacity
+        arrays = {}
+        for name, dtype in self._COLUMNS.items():
+            shape = (capacity, self._dim) if name == "embeddings" else (capacity,)
+            size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            with open(self._file(name), "ab") as f:
+                if f.tell() < size:
+                    f.truncate(size)
+            arrays[name] = np.memmap(self._file(name), dtype=dtype, mode="r+", shape=shape)
+        self._embeddings = arrays["embeddings"]
+        self._user_ids = arrays["user_ids"]
+        self._created_at = arrays["created_at"]
+        self._source_col = arrays["sources"]
+
+    def _grow(self) -> None:
+        self.flush()
+        self._open(self._capacity * 2)
+
+    def flush(self) -> None:
+        with self._lock:
+            for arr in (self._embeddings, self._user_ids, self._created_at, self._source_col):
+                arr.flush()
+            self._write_meta()
+
+    def close(self) -> None:
+        self.flush()
+
+    # --- операции ---
+
+    def _source_code(self, source: str) -> int:
+        code = self._source_codes.get(source)
+        if code is None:
+            code = len(self._sources)
+            self._sources.append(source)
+            self._source_codes[source] = code
+        return code
+
+    def _append(self, user_id: int, embedding: np.ndarray, source: str, created_at: int) -> None:
+        emb = normalize_embedding(np.ravel(embedding))
+        if self._count == self._capacity:
+            self._grow()
+        row = self._count
+        self._embeddings[row] = emb
+        self._user_ids[row] = user_id
+        self._created_at[row] = created_at
+        self._source_col[row] = self._source_code(source)
+        self._count += 1
+        self._index.setdefault(user_id, []).append(row)
+
+    def save(self, user_id: int, embedding: np.ndarray, source: str = "reauth") -> None:
+        with self._lock:
+            self._append(user_id, embedding, source, int(time.time() * 1000))
+            self._write_meta()
+
+    def save_many(self, user_ids: Sequence[int], embeddings: np.ndarray, source: str) -> None:
+        created_at = int(time.time() * 1000)
+        with self._lock:
+            for user_id, embedding in zip(user_ids, embeddings):
+                self._append(int(user_id), embedding, source, created_at)
+            # meta.json один раз на пачку, а не на строку
+            self._write_meta()
+
+    def _hit(self, row: int, score: float) -> Hit:
+        return Hit(
+            id=row,
+            user_id=int(self._user_ids[row]),
+            score=float(score),
+            created_at=int(self._created_at[row]),
+            source=self._sources[self._source_col[row]],
+        )
+
+    def fetch_user(self, user_id: int) -> UserRecords:
+        with self._lock:
+            rows = np.asarray(self._index.get(user_id, ()), dtype=np.int64)
+            return UserRecords(
+                ids=rows,
+                embeddings=np.array(self._embeddings[rows]),
+                created_at=np.array(self._created_at[rows]),
+                sources=[self._sources[c] for c in self._source_col[rows].tolist()],
+            )
+
+    def search_user(self, embedding: np.ndarray, user_id: int, top_k: int = 3) -> list[Hit]:
+        return score_records(self.fetch_user(user_id), user_id, embedding, top_k)
+
+    def delete(self, ids: Sequence[int]) -> None:
+        with self._lock:
+            for row in ids:
+                if not 0 <= row < self._count or self._user_ids[row] == _DELETED:
+                    continue
+                user_id = int(self._user_ids[row])
+                self._index[user_id].remove(row)
+                if not self._index[user_id]:
+                    del self._index[user_id]
+                self._user_ids[row] = _DELETED
+                self._embeddings[row] = 0
+
+    def list_users(self) -> set[int]:
+        with self._lock:
+            return set(self._index)
+
+    def users_since(self, since_ms: int) -> set[int]:
+        with self._lock:
+            user_ids = self._user_ids[: self._count]
+            recent = (self._created_at[: self._count] >= since_ms) & (user_ids != _DELETED)
+            return set(np.unique(user_ids[recent]).tolist())
+
+    def identify(self, embedding: np.ndarray, top_k: int = 5) -> list[Hit]:
+        query = np.asarray(embedding, dtype=np.float32).ravel()
+        block = settings.LOCAL_STORE_BLOCK_ROWS
+        with self._lock:
+            if self._count == 0:
+                return []
+            scores = np.empty(self._count, dtype=np.float32)
+            # блоками, чтобы не материализовать всю матрицу в памяти при большом count
+            for start in range(0, self._count, block):
+                end = min(start + block, self._count)
+                scores[start:end] = self._embeddings[start:end] @ query
+            scores[self._user_ids[: self._count] == _DELETED] = -np.inf
+            live = self._count - int(np.isneginf(scores).sum())
+            if live == 0:
+                return []
+            # кандидатов расширяем, пока после группировки по пользователю не наберётся top_k
+            limit = min(live, top_k * settings.IDENTIFY_OVERSAMPLE)
+            while True:
+                rows = np.argpartition(-scores, limit - 1)[:limit]
+                hits = group_by_user([self._hit(int(r), scores[r]) for r in rows], top_k)
+                if len(hits) >= top_k or limit == live:
+                    return hits
+                limit = min(live, limit * 2)
+
+    def history_stats(self, user_id: int) -> dict:
+        with self._lock:
+            rows = np.asarray(self._index.get(user_id, ()), dtype=np.int64)
+            stats = summarize_history(
+                self._created_at[rows].tolist(),
+                [self._sources[c] for c in self._source_col[rows].tolist()],
+            )
+        # история в памяти: считается целиком
+        return {**stats, "truncated": False}
+
+    def history_records(self, user_id: int, cursor: Optional[int], limit: int) -> tuple[list[dict], Optional[int]]:
+        with self._lock:
+            # строки пользователя в индексе идут по возрастанию: новые дописываются в конец
+            rows = np.asarray(self._index.get(user_id, ()), dtype=np.int64)
+            if cursor is not None:
+                rows = rows[np.searchsorted(rows, cursor, side="right"):]
+            rows = rows[:limit + 1]
+            return records_page(
+                [
+                    {"id": int(row), "created_at_ms": int(self._created_at[row]), "source": self._sources[code]}
+                    for row, code in zip(rows.tolist(), self._source_col[rows].tolist())
+                ],
+                limit,
+            )
+
+    def export_rows(self, batch_size: int = 5000) -> Iterator[tuple[np.ndarray, np.ndarray, list[str]]]:
+        for start in range(0, self._count, batch_size):
+            with self._lock:
+                end = min(start + batch_size, self._count)
+                user_ids = np.array(self._user_ids[start:end])
+                live = user_ids != _DELETED
+                embeddings = np.array(self._embeddings[start:end][live])
+                sources = [self._sources[c] for c in self._source_col[start:end][live].tolist()]
+            yield user_ids[live], embeddings, sources
@@ -1,9 +1,16 @@
+import json
+import threading
 import time
+from typing import Iterator, Optional, Sequence
 
 import numpy as np
 import logging
-from pymilvus import connections, utility, Collection, FieldSchema, CollectionSchema, DataType
 from app.core.config import settings
+from app.core.metrics import registry, stage
+from app.core.utils import normalize_embedding
+from app.services.history_writer import HistoryRow, HistoryWriter
+from app.services.milvus_pool import MilvusPool
+from app.services.template_cache import get_template_cache
 
 
 logger = logging.getLogger(__name__)
@@ -11,46 +18,94 @@ logger = logging.getLogger(__name__)
 
 HISTORY_COLLECTION = "face_embeddings_history"
 
-_COLLECTION_CACHE: dict[str, Collection] = {}
+# тип поля embedding у существующей коллекции истории (может отличаться от MILVUS_VECTOR_TYPE)
+_history_vector_type = settings.MILVUS_VECTOR_TYPE
 
 
-def get_connection():
-    # idempotent: повторный connect ничего страшного не сделает
+def _connect(alias: str):
+    from pymilvus import connections
+
     connections.connect(
-        alias="default",
+        alias=alias,
         host=settings.MILVUS_HOST,
         port=settings.MILVUS_PORT,
+        timeout=settings.MILVUS_CONNECT_TIMEOUT_S,
     )
 
 
-def _ensure_collection_internal():
-    name = settings.MILVUS_COLLECTION
-    dim = settings.MILVUS_DIM
-
-    index_params = {
-        "index_type": "IVF_FLAT",
+def _index_params() -> dict:
+    return {
+        "index_type": settings.MILVUS_INDEX_TYPE,
         "metric_type": "IP",
-        "params": {"nlist": 128},
+        "params": settings.MILVUS_INDEX_PARAMS,
     }
 
-    if utility.has_collection(name):
-        collection = Collection(name)
-        need_reindex = True
-        try:
-            for idx in collection.indexes:
-                if idx.field_name == "embedding":
-                    existing_metric = idx.params.get("metric_type", "").upper()
-                    existing_index_type = idx.params.get("index_type", "").upper()
-                    if existing_metric == "IP" and existing_index_type == "IVF_FLAT":
-                        need_reindex = False
-                    else:
-                        collection.drop_index("embedding")
-                    break
-        except Exception:
-            need_reindex = True
-
-        if need_reindex:
-            collection.create_index("embedding", index_params)
+
+def _search_params(limit: int) -> dict:
+    params = dict(settings.MILVUS_SEARCH_PARAMS)
+    # HNSW отклоняет поиск с ef < limit, а identify и rerank расширяют limit далеко за типичный ef
+    if settings.MILVUS_INDEX_TYPE.upper().startswith("HNSW"):
+        params["ef"] = max(int(params.get("ef", limit)), limit)
+    return {"metric_type": "IP", "params": params}
+
+
+def _vector_dtype(vector_type: str):
+    from pymilvus import DataType
+
+    return DataType.FLOAT16_VECTOR if vector_type == "float16" else DataType.FLOAT_VECTOR
+
+
+def _vector_payload(vectors) -> list:
+    """Векторы в формате поля embedding истории: float16 — numpy-массивы, float32 — списки."""
+    if _history_vector_type == "float16":
+        return [np.asarray(v, dtype=np.float16) for v in vectors]
+    return [np.asarray(v, dtype=np.float32).tolist() for v in vectors]
+
+
+def as_float32(vector) -> np.ndarray:
+    """Вектор из ответа query: float16-поле pymilvus отдаёт байтами."""
+    if isinstance(vector, list) and len(vector) == 1 and isinstance(vector[0], (bytes, bytearray)):
+        vector = vector[0]
+    if isinstance(vector, (bytes, bytearray)):
+        return np.frombuffer(vector, dtype=np.float16).astype(np.float32)
+    return np.asarray(vector, dtype=np.float32)
+
+
+def _same_index(existing: dict, wanted: dict) -> bool:
+    params = existing.get("params", {})
+    if isinstance(params, str):
+        params = json.loads(params)
+    return (
+        existing.get("metric_type", "").upper() == wanted["metric_type"]
+        and existing.get("index_type", "").upper() == wanted["index_type"].upper()
+        # сервер может вернуть параметры строками
+        and {k: str(v) for k, v in params.items()} == {k: str(v) for k, v in wanted["params"].items()}
+    )
+
+
+def _ensure_vector_index(collection) -> None:
+    """Приводит индекс по embedding к MILVUS_INDEX_TYPE/MILVUS_INDEX_PARAMS; при расхождении перестраивает."""
+    wanted = _index_params()
+    for idx in collection.indexes:
+        if idx.field_name == "embedding":
+            if _same_index(idx.params, wanted):
+                return
+            logger.info("Rebuilding %s embedding index as %s", collection.name, wanted)
+            # индекс загруженной коллекции удалить нельзя
+            collection.release()
+            collection.drop_index(index_name=idx.index_name)
+            break
+    collection.create_index("embedding", wanted)
+
+
+def _ensure_collection_internal(alias: str):
+    from pymilvus import utility, Collection, FieldSchema, CollectionSchema, DataType
+
+    name = settings.MILVUS_COLLECTION
+    dim = settings.MILVUS_DIM
+
+    if utility.has_collection(name, using=alias):
+        collection = Collection(name, using=alias)
     else:
         id_field = FieldSchema(
             name="id", dtype=DataType.INT64, is_primary=True, auto_id=True
@@ -61,48 +116,40 @@ def _ensure_collection_internal():
             dim=dim,
         )
         schema = CollectionSchema([id_field, vector_field], description="Face embeddings")
-        collection = Collection(name, schema=schema)
-        collection.create_index("embedding", index_params)
+        collection = Collection(name, schema=schema, using=alias)
 
+    _ensure_vector_index(collection)
     collection.load()
-    return collection
-
 
-def get_collection():
-    if settings.MILVUS_COLLECTION in _COLLECTION_CACHE:
-        return _COLLECTION_CACHE[settings.MILVUS_COLLECTION]
-    get_connection()
-    collection = _ensure_collection_internal()
-    _COLLECTION_CACHE[settings.MILVUS_COLLECTION] = collection
-    return collection
 
+def _ensure_history_collection(alias: str):
+    """
+    Инициализирует (если нужно) коллекцию с user_id, created_at и source.
 
-def normalize_embedding(emb: np.ndarray) -> np.ndarray:
-    norm = np.linalg.norm(emb)
-    return emb / norm if norm > 0 else emb
-
-
-def init_history_collection():
-    """Инициализирует (если нужно) коллекцию с user_id, created_at и source."""
-    connections.connect(
-        alias="default",
-        host=settings.MILVUS_HOST,
-        port=settings.MILVUS_PORT,
-    )
+    user_id — partition key: строки одного пользователя лежат в одной партиции,
+    и фильтр по user_id читает только её. Дополнительно на user_id строится
+    скалярный индекс (в том числе для уже существующих коллекций без partition key).
+    """
+    global _history_vector_type
+    from pymilvus import utility, Collection, FieldSchema, CollectionSchema, DataType
 
     dim = settings.MILVUS_DIM
-    index_params = {
-        "index_type": "IVF_FLAT",
-        "metric_type": "IP",
-        "params": {"nlist": 128},
-    }
 
-    if utility.has_collection(HISTORY_COLLECTION):
-        collection = Collection(HISTORY_COLLECTION)
+    if utility.has_collection(HISTORY_COLLECTION, using=alias):
+        collection = Collection(HISTORY_COLLECTION, using=alias)
+        field = next(f for f in collection.schema.fields if f.name == "embedding")
+        _history_vector_type = "float16" if field.dtype == DataType.FLOAT16_VECTOR else "float32"
+        if _history_vector_type != settings.MILVUS_VECTOR_TYPE:
+            logger.warning(
+                "%s stores %s embeddings; MILVUS_VECTOR_TYPE=%s applies to new collections only "
+                "(re-import history to convert)",
+                HISTORY_COLLECTION, _history_vector_type, settings.MILVUS_VECTOR_TYPE,
+            )
     else:
+        _history_vector_type = settings.MILVUS_VECTOR_TYPE
         id_field = FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=True)
-        embedding_field = FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=dim)
-        user_field = FieldSchema(name="user_id", dtype=DataType.INT64)
+        embedding_field = FieldSchema(name="embedding", dtype=_vector_dtype(_history_vector_type), dim=dim)
+        user_field = FieldSchema(name="user_id", dtype=DataType.INT64, is_partition_key=True)
         created_at_field = FieldSchema(name="created_at", dtype=DataType.INT64)
         source_field = FieldSchema(name="source", dtype=DataType.VARCHAR, max_length=64)
 
@@ -110,34 +157,272 @@ def init_history_collection():
             [id_field, embedding_field, user_field, created_at_field, source_field],
             description="Face embeddings history per user",
         )
-        collection = Collection(HISTORY_COLLECTION, schema=schema)
-        collection.create_index("embedding", index_params)
+        collection = Collection(
+            HISTORY_COLLECTION, schema=schema, using=alias, num_partitions=settings.HISTORY_NUM_PARTITIONS
+        )
+
+    _ensure_vector_index(collection)
+    if not any(idx.field_name == "user_id" for idx in collection.indexes):
+        collection.create_index("user_id", {"index_type": "INVERTED"}, index_name="user_id_idx")
     collection.load()
-    return collection
 
-def save_user_embedding(user_id: int, embedding: np.ndarray, source: str = "reauth"):
-    coll = init_history_collection()
-    emb_norm = normalize_embedding(np.array(embedding))
-    ts_ms = int(time.time() * 1000)
+
+_pool: Optional[MilvusPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_milvus_pool() -> MilvusPool:
+    """Единая точка доступа к Milvus: пул соединений и закэшированные коллекции."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                pool = MilvusPool(
+                    size=settings.MILVUS_POOL_SIZE,
+                    connect=_connect,
+                    max_retries=settings.MILVUS_RECONNECT_RETRIES,
+                    backoff_ms=settings.MILVUS_RECONNECT_BACKOFF_MS,
+                )
+                pool.register(settings.MILVUS_COLLECTION, _ensure_collection_internal)
+                pool.register(HISTORY_COLLECTION, _ensure_history_collection)
+                _pool = pool
+    return _pool
+
+
+def use_history_collection(name: str) -> None:
+    """
+    Другая коллекция истории (бенчмарки против живого Milvus не пишут в рабочую).
+    Вызывается до первого обращения к Milvus: пул регистрирует коллекцию при создании.
+    """
+    global HISTORY_COLLECTION
+    if _pool is not None:
+        raise RuntimeError("Milvus pool is already created; switch the history collection before first use")
+    HISTORY_COLLECTION = name
+
+
+def drop_history_collection() -> None:
+    from pymilvus import utility
+
+    with get_milvus_pool().connection() as alias:
+        utility.drop_collection(HISTORY_COLLECTION, using=alias)
+
+
+def get_collection():
+    return get_milvus_pool().run(settings.MILVUS_COLLECTION, lambda coll: coll)
+
+
+def init_history_collection():
+    return get_milvus_pool().run(HISTORY_COLLECTION, lambda coll: coll)
+
+
+def insert_history_rows(rows: Sequence[HistoryRow]):
     # Для auto_id PRIMARY field не передаём список пустой.
     # Порядок: embedding, user_id, created_at, source — 4 списка.
-    coll.insert([[emb_norm.tolist()], [user_id], [ts_ms], [source]])
-    coll.flush()
+    # flush() не вызываем: он запечатывает сегменты и очень дорог, а вставленные строки видны поиску и без него
+    data = [
+        _vector_payload([r.embedding for r in rows]),
+        [r.user_id for r in rows],
+        [r.created_at for r in rows],
+        [r.source for r in rows],
+    ]
+    with stage("milvus_insert"):
+        get_milvus_pool().run(
+            HISTORY_COLLECTION, lambda coll: coll.insert(data, timeout=settings.MILVUS_TIMEOUT_S), idempotent=False
+        )
+
+
+_history_writer: Optional[HistoryWriter] = None
+registry.gauge(
+    "face_auth_history_buffered_rows",
+    "History rows waiting for a batched insert",
+    fn=lambda: _history_writer.stats()["buffered"] if _history_writer is not None else 0,
+)
+
+
+def get_history_writer() -> Optional[HistoryWriter]:
+    global _history_writer
+    if not settings.HISTORY_WRITE_BEHIND:
+        return None
+    if _history_writer is None:
+        _history_writer = HistoryWriter(
+            insert_history_rows,
+            batch_size=settings.HISTORY_BATCH_SIZE,
+            flush_interval_ms=settings.HISTORY_FLUSH_INTERVAL_MS,
+            max_buffer=settings.HISTORY_MAX_BUFFER,
+            spool_dir=settings.HISTORY_SPOOL_DIR,
+        )
+        _history_writer.start()
+    return _history_writer
+
+
+def stop_history_writer():
+    global _history_writer
+    if _history_writer is not None:
+        _history_writer.stop(timeout=settings.HISTORY_SHUTDOWN_TIMEOUT_S)
+        _history_writer = None
 
 
-def search_user_history(embedding: np.ndarray, user_id: int, top_k: int = 3):
-    coll = init_history_collection()
+def save_user_embedding(user_id: int, embedding: np.ndarray, source: str = "reauth"):
+    emb_norm = normalize_embedding(np.array(embedding, dtype=np.float32))
+    ts_ms = int(time.time() * 1000)
+    row = HistoryRow(user_id=user_id, embedding=emb_norm, created_at=ts_ms, source=source)
+    writer = get_history_writer()
+    if writer is not None:
+        writer.put(row)
+    else:
+        insert_history_rows([row])
+    # строка может ещё лежать в буфере write-behind: кэш шаблонов дополняем сразу, не дожидаясь вставки
+    cache = get_template_cache()
+    if cache is not None:
+        cache.append(user_id, emb_norm, source, ts_ms)
+
+
+def insert_user_embeddings(user_ids: Sequence[int], embeddings: np.ndarray, source: str):
+    """Массовая вставка одним insert (импорт): без write-behind и журнала, ошибка видна вызывающему."""
+    ts_ms = int(time.time() * 1000)
+    rows = [
+        HistoryRow(user_id=int(user_id), embedding=normalize_embedding(np.asarray(emb, dtype=np.float32)),
+                   created_at=ts_ms, source=source)
+        for user_id, emb in zip(user_ids, embeddings)
+    ]
+    if not rows:
+        return
+    insert_history_rows(rows)
+    cache = get_template_cache()
+    if cache is not None:
+        for user_id in {row.user_id for row in rows}:
+            cache.invalidate(user_id)
+
+
+def search_history(embedding: np.ndarray, top_k: int, expr: Optional[str] = None, output_fields=None):
     emb_norm = normalize_embedding(np.array(embedding))
-    expr = f"user_id == {user_id}"
-    try:
-        results = coll.search(
-            data=[emb_norm.tolist()],
-            anns_field="embedding",
-            param={"metric_type": "IP", "params": {"nprobe": 10}},
-            limit=top_k,
-            expr=expr,
+    # если что-то с фильтрацией не так, исключение уходит наверх — caller сам решит fallback
+    with stage("milvus_search"):
+        return get_milvus_pool().run(
+            HISTORY_COLLECTION,
+            lambda coll: coll.search(
+                data=_vector_payload([emb_norm]),
+                anns_field="embedding",
+                param=_search_params(top_k),
+                limit=top_k,
+                expr=expr,
+                output_fields=output_fields,
+                timeout=settings.MILVUS_TIMEOUT_S,
+            ),
+        )
+
+
+def search_user_history(embedding: np.ndarray, user_id: int, top_k: int = 3, output_fields=None):
+    return search_history(embedding, top_k, expr=f"user_id == {user_id}", output_fields=output_fields)
+
+
+def query_history(expr: str, output_fields: list[str], limit: Optional[int] = None):
+    kwargs = {"limit": limit} if limit is not None else {}
+    with stage("milvus_query"):
+        return get_milvus_pool().run(
+            HISTORY_COLLECTION,
+            lambda coll: coll.query(
+                expr=expr, output_fields=output_fields, timeout=settings.MILVUS_TIMEOUT_S, **kwargs
+            ),
+        )
+
+
+def fetch_user_history(user_id: int, page_size: int):
+    """
+    Все строки пользователя вместе с эмбеддингами — для точного скоринга и компакции.
+    Читаются страницами query_iterator: один query с limit вернул бы произвольные строки.
+    """
+    return [
+        {**r, "embedding": as_float32(r["embedding"])}
+        for page in iter_user_history(user_id, ["id", "embedding", "created_at", "source"], page_size)
+        for r in page
+    ]
+
+
+def fetch_embeddings(ids: Sequence[int]) -> dict[int, np.ndarray]:
+    """
+    Сохранённые векторы по id — для точного пересчёта кандидатов ANN. При IVF_SQ8/IVF_PQ
+    в памяти индекса лежат только коды, а query возвращает исходные векторы.
+    """
+    ids = [int(i) for i in ids]
+    if not ids:
+        return {}
+    records = query_history(f"id in {ids}", output_fields=["id", "embedding"])
+    return {int(r["id"]): as_float32(r["embedding"]) for r in records}
+
+
+def delete_history(ids: Sequence[int]):
+    ids = [int(i) for i in ids]
+    if not ids:
+        return
+    get_milvus_pool().run(
+        HISTORY_COLLECTION,
+        lambda coll: coll.delete(expr=f"id in {ids}", timeout=settings.MILVUS_TIMEOUT_S),
+        idempotent=False,
+    )
+    cache = get_template_cache()
+    if cache is not None:
+        cache.remove_ids(ids)
+
+
+def list_history_users(batch_size: int = 1000) -> set[int]:
+    """Все user_id в истории; читается итератором порциями, без limit на весь запрос."""
+    def collect(coll) -> set[int]:
+        users: set[int] = set()
+        iterator = coll.query_iterator(
+            batch_size=batch_size, expr="user_id >= 0", output_fields=["user_id"], timeout=settings.MILVUS_TIMEOUT_S
+        )
+        try:
+            while True:
+                page = iterator.next()
+                if not page:
+                    return users
+                users.update(int(r["user_id"]) for r in page)
+        finally:
+            iterator.close()
+
+    return get_milvus_pool().run(HISTORY_COLLECTION, collect)
+
+
+def _iter_query(expr: str, output_fields: list[str], batch_size: int) -> Iterator[list[dict]]:
+    """
+    Страницы query_iterator по expr. Соединение из пула занято, пока страницы читаются;
+    повтора при обрыве нет — итератор нельзя продолжить на другом соединении.
+    """
+    pool = get_milvus_pool()
+    with pool.connection() as alias:
+        iterator = pool.collection(alias, HISTORY_COLLECTION).query_iterator(
+            batch_size=batch_size, expr=expr, output_fields=output_fields, timeout=settings.MILVUS_TIMEOUT_S
+        )
+        try:
+            while True:
+                with stage("milvus_query"):
+                    page = iterator.next()
+                if not page:
+                    return
+                yield page
+        finally:
+            iterator.close()
+
+
+def history_users_since(since_ms: int, batch_size: int = 1000) -> set[int]:
+    """user_id строк, добавленных начиная с since_ms; читается страницами, как list_history_users."""
+    return {
+        int(r["user_id"])
+        for page in _iter_query(f"created_at >= {int(since_ms)}", ["user_id"], batch_size)
+        for r in page
+    }
+
+
+def iter_user_history(user_id: int, output_fields: list[str], batch_size: int) -> Iterator[list[dict]]:
+    return _iter_query(f"user_id == {user_id}", output_fields, batch_size)
+
+
+def iter_history(batch_size: int = 5000) -> Iterator[tuple[np.ndarray, np.ndarray, list[str]]]:
+    """Вся история порциями (user_ids, embeddings float32, sources) — для офлайн-выгрузки."""
+    for page in _iter_query("user_id >= 0", ["user_id", "embedding", "source"], batch_size):
+        yield (
+            np.array([r["user_id"] for r in page], dtype=np.int64),
+            np.stack([as_float32(r["embedding"]) for r in page]),
+            [r.get("source", "unknown") for r in page],
         )
-        return results
-    except Exception as e:
-        # если что-то с фильтрацией не так, откатываемся — caller сам решит fallback
-        raise
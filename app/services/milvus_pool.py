@@ -0,0 +1,161 @@
+import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Callable, Iterator, TypeVar
+
+if TYPE_CHECKING:
+    from pymilvus import Collection
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def _retryable_errors() -> tuple[type[BaseException], ...]:
+    import grpc
+    from pymilvus.exceptions import ConnectionNotExistException, MilvusUnavailableException
+
+    return MilvusUnavailableException, ConnectionNotExistException, grpc.RpcError
+
+
+class MilvusPool:
+    """
+    Пул соединений pymilvus (по alias'у на соединение) с кэшем коллекций.
+
+    Каждая коллекция бутстрапится (схема, индекс, load) один раз на процесс,
+    дальше для каждого соединения кэшируется свой хэндл Collection. Соединение
+    выдаётся одному потоку за раз; при сетевой ошибке оно переподключается с
+    экспоненциальной задержкой, а вызов повторяется.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        connect: Callable[[str], None],
+        max_retries: int,
+        backoff_ms: float,
+        alias_prefix: str = "face_auth",
+    ):
+        self._connect = connect
+        self._max_retries = max(0, max_retries)
+        self._backoff = max(0.0, backoff_ms) / 1000
+        self._aliases = [f"{alias_prefix}_{i}" for i in range(max(1, size))]
+        self._idle: queue.Queue[str] = queue.Queue()
+        for alias in self._aliases:
+            self._idle.put(alias)
+
+        self._lock = threading.Lock()
+        self._bootstrap_lock = threading.Lock()
+        self._connected: set[str] = set()
+        self._bootstraps: dict[str, Callable[[str], None]] = {}
+        self._bootstrapped: set[str] = set()
+        self._collections: dict[tuple[str, str], "Collection"] = {}
+
+        self._stats = {"acquired": 0, "waited": 0, "in_use": 0, "reconnects": 0, "errors": 0}
+
+    def register(self, name: str, bootstrap: Callable[[str], None]) -> None:
+        """bootstrap(alias) создаёт коллекцию/индекс и загружает её; вызывается один раз."""
+        self._bootstraps[name] = bootstrap
+
+    @contextmanager
+    def connection(self) -> Iterator[str]:
+        try:
+            alias = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                self._stats["waited"] += 1
+            alias = self._idle.get()
+        with self._lock:
+            self._stats["acquired"] += 1
+            self._stats["in_use"] += 1
+        try:
+            self._ensure_connected(alias)
+            yield alias
+        finally:
+            with self._lock:
+                self._stats["in_use"] -= 1
+            self._idle.put(alias)
+
+    def _ensure_connected(self, alias: str) -> None:
+        from pymilvus.exceptions import MilvusUnavailableException
+
+        if alias in self._connected:
+            return
+        try:
+            self._connect(alias)
+        except Exception as e:
+            # ошибку подключения считаем временной, как и обрыв уже открытого соединения
+            raise MilvusUnavailableException(message=f"cannot connect {alias}: {e}") from e
+        with self._lock:
+            self._connected.add(alias)
+
+    def _reset(self, alias: str) -> None:
+        from pymilvus import connections
+
+        with self._lock:
+            self._connected.discard(alias)
+            for key in [k for k in self._collections if k[0] == alias]:
+                del self._collections[key]
+            self._stats["reconnects"] += 1
+        try:
+            connections.disconnect(alias)
+        except Exception:
+            logger.debug("disconnect of %s failed", alias, exc_info=True)
+
+    def collection(self, alias: str, name: str) -> "Collection":
+        from pymilvus import Collection
+
+        key = (alias, name)
+        cached = self._collections.get(key)
+        if cached is not None:
+            return cached
+        if name not in self._bootstrapped:
+            with self._bootstrap_lock:
+                if name not in self._bootstrapped:
+                    self._bootstraps[name](alias)
+                    self._bootstrapped.add(name)
+        collection = Collection(name, using=alias)
+        self._collections[key] = collection
+        return collection
+
+    def run(self, name: str, fn: Callable[["Collection"], T], idempotent: bool = True) -> T:
+        """
+        Выполняет fn над коллекцией на свободном соединении с повтором при сетевых ошибках.
+
+        idempotent=False — для insert/delete: после таймаута или обрыва запрос мог
+        уже примениться на сервере (auto_id-ключ новый при каждой вставке), поэтому
+        повторяются только ошибки подключения, случившиеся до отправки запроса.
+        """
+        retryable = _retryable_errors()
+        for attempt in range(self._max_retries + 1):
+            sent = False
+            try:
+                with self.connection() as alias:
+                    collection = self.collection(alias, name)
+                    try:
+                        sent = True
+                        return fn(collection)
+                    except retryable:
+                        self._reset(alias)
+                        raise
+            except retryable:
+                with self._lock:
+                    self._stats["errors"] += 1
+                if attempt == self._max_retries or (sent and not idempotent):
+                    raise
+                logger.warning("Milvus call failed, reconnecting (attempt %d)", attempt + 1, exc_info=True)
+            time.sleep(self._backoff * (2 ** attempt))
+        raise AssertionError("unreachable")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._aliases),
+                "connected": len(self._connected),
+                "idle": self._idle.qsize(),
+                "collections": sorted(self._bootstrapped),
+                **self._stats,
+            }
@@ -0,0 +1,191 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional, Sequence
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.metrics import registry
+from app.services.vector_store import UserRecords
+
+
+# id строки, которая записана через кэш, но ещё не вернулась из хранилища (write-behind, auto_id)
+PENDING_ID = -1
+
+_LOOKUPS = registry.counter(
+    "face_auth_template_cache_lookups_total", "Per-user template cache lookups", ["result"]
+)
+
+
+def _records_bytes(records: UserRecords) -> int:
+    # строки source — приблизительно: ссылка плюс короткая строка
+    return records.ids.nbytes + records.embeddings.nbytes + records.created_at.nbytes + 64 * len(records.sources)
+
+
+class TemplateCache:
+    """
+    Read-through кэш шаблонов активных пользователей для повторной проверки.
+
+    На пользователя хранится его история целиком (UserRecords: матрица эмбеддингов
+    и столбцы), так что проверка по кэшу — одно матричное умножение без похода в Milvus.
+    Размер ограничен max_bytes (LRU), запись живёт ttl_s — так в кэш попадают
+    изменения, сделанные другими инстансами. Запись через этот инстанс обновляет
+    кэш сразу (append / remove_ids) и получает номер из общего счётчика; результат
+    чтения, начатого до записи в этого пользователя, в кэш не кладётся.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        ttl_s: float,
+        clock: Callable[[], float] = time.monotonic,
+        max_tracked_writes: int = 10_000,
+    ):
+        self._max_bytes = max_bytes
+        self._ttl_s = ttl_s
+        self._clock = clock
+        self._entries: OrderedDict[int, tuple[float, UserRecords, int]] = OrderedDict()
+        # номер последней записи по пользователю; при переполнении сбрасывается целиком,
+        # а чтения, начатые до сброса (версия меньше _floor), считаются устаревшими
+        self._generation = 0
+        self._floor = 0
+        self._written: dict[int, int] = {}
+        self._max_tracked_writes = max_tracked_writes
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def version(self) -> int:
+        """Номер последней записи; берётся до чтения из хранилища и передаётся в put."""
+        with self._lock:
+            return self._generation
+
+    def get(self, user_id: int) -> Optional[UserRecords]:
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                records = entry[1]
+            else:
+                if entry is not None:
+                    self._drop(user_id)
+                self.misses += 1
+                records = None
+        _LOOKUPS.inc(result="hit" if records is not None else "miss")
+        return records
+
+    def put(self, user_id: int, records: UserRecords, version: Optional[int] = None) -> None:
+        """version — значение version() до чтения records; устаревший результат не кладётся."""
+        size = _records_bytes(records)
+        with self._lock:
+            if version is not None and self._written.get(user_id, self._floor) > version:
+                return
+            self._drop(user_id)
+            if size > self._max_bytes:
+                return
+            self._entries[user_id] = (self._clock() + self._ttl_s, records, size)
+            self._bytes += size
+            while self._bytes > self._max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    def append(self, user_id: int, embedding: np.ndarray, source: str, created_at: int) -> None:
+        """Новая строка пользователя: закэшированная матрица дополняется, а не сбрасывается."""
+        emb = np.asarray(embedding, dtype=np.float32).reshape(1, -1)
+        with self._lock:
+            self._mark_written(user_id)
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return
+            expires_at, records, _ = entry
+            # у пользователя единицы-десятки строк: копия матрицы под локом дешёвая
+            updated = UserRecords(
+                ids=np.append(records.ids, PENDING_ID),
+                embeddings=np.vstack([records.embeddings, emb]) if records.ids.size else emb,
+                created_at=np.append(records.created_at, created_at),
+                sources=[*records.sources, source],
+            )
+            self._replace(user_id, (expires_at, updated, _records_bytes(updated)))
+
+    def remove_ids(self, ids: Sequence[int]) -> None:
+        """
+        Удалённые строки убираются из закэшированных матриц. Пользователь, у которого
+        есть ещё не вернувшиеся из хранилища строки, сбрасывается целиком: удалённая
+        строка могла быть одной из них.
+        """
+        removed = set(ids)
+        with self._lock:
+            for user_id, entry in list(self._entries.items()):
+                expires_at, records, _ = entry
+                mask = np.isin(records.ids, list(removed))
+                if not mask.any():
+                    continue
+                self._mark_written(user_id)
+                if (records.ids == PENDING_ID).any():
+                    self._drop(user_id)
+                    continue
+                keep = ~mask
+                updated = UserRecords(
+                    ids=records.ids[keep],
+                    embeddings=records.embeddings[keep],
+                    created_at=records.created_at[keep],
+                    sources=[s for s, k in zip(records.sources, keep) if k],
+                )
+                self._replace(user_id, (expires_at, updated, _records_bytes(updated)))
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._mark_written(user_id)
+            self._drop(user_id)
+
+    def _mark_written(self, user_id: int) -> None:
+        if len(self._written) >= self._max_tracked_writes:
+            self._written.clear()
+            self._floor = self._generation
+        self._generation += 1
+        self._written[user_id] = self._generation
+
+    def _drop(self, user_id: int) -> None:
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def _replace(self, user_id: int, entry: tuple[float, UserRecords, int]) -> None:
+        self._bytes += entry[2] - self._entries[user_id][2]
+        self._entries[user_id] = entry
+        while self._bytes > self._max_bytes:
+            self._drop(next(iter(self._entries)))
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "users": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self._max_bytes,
+                "ttl_s": self._ttl_s,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else None,
+            }
+
+
+registry.gauge(
+    "face_auth_template_cache_bytes",
+    "Bytes held by the per-user template cache",
+    fn=lambda: _cache.stats()["bytes"] if _cache is not None else 0,
+)
+
+_cache: Optional[TemplateCache] = None
+
+
+def get_template_cache() -> Optional[TemplateCache]:
+    global _cache
+    if settings.HISTORY_TEMPLATE_CACHE_BYTES <= 0:
+        return None
+    if _cache is None:
+        _cache = TemplateCache(settings.HISTORY_TEMPLATE_CACHE_BYTES, settings.HISTORY_TEMPLATE_CACHE_TTL_S)
+    return _cache
@@ -0,0 +1,436 @@
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from typing import Callable, Iterator, NamedTuple, Optional, Sequence, TypeVar
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.metrics import registry, stage
+from app.core.utils import normalize_embedding
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_EXACT_TRUNCATED = registry.counter(
+    "face_auth_history_exact_truncated_total",
+    "Exact-mode lookups that scored only the newest HISTORY_EXACT_MAX_ROWS rows of a user",
+)
+
+
+class Hit(NamedTuple):
+    id: int
+    user_id: int
+    score: float
+    created_at: Optional[int] = None
+    source: Optional[str] = None
+
+
+class UserRecords(NamedTuple):
+    ids: np.ndarray
+    embeddings: np.ndarray
+    created_at: np.ndarray
+    sources: list[str]
+
+
+def score_records(records: UserRecords, user_id: int, embedding: np.ndarray, top_k: int) -> list[Hit]:
+    """Точный скоринг: скалярные произведения со всеми эмбеддингами пользователя."""
+    if records.ids.size == 0:
+        return []
+    query = normalize_embedding(np.ravel(embedding))
+    scores = records.embeddings @ query
+    best = np.argsort(-scores)[:top_k]
+    return [
+        Hit(
+            id=int(records.ids[i]),
+            user_id=user_id,
+            score=float(scores[i]),
+            created_at=int(records.created_at[i]),
+            source=records.sources[i],
+        )
+        for i in best
+    ]
+
+
+class HistorySummary:
+    """
+    Агрегаты по истории пользователя, накапливаемые по страницам: количество по source,
+    первый/последний раз, средний интервал и последние recent записей. Память не
+    зависит от размера истории: средний интервал между отсортированными отметками
+    равен (last - first) / (total - 1), сортировать всю историю не нужно.
+    """
+
+    def __init__(self, recent: int = 5):
+        self._recent_limit = recent
+        self._total = 0
+        self._by_source: dict[str, int] = {}
+        self._first: Optional[int] = None
+        self._last: Optional[int] = None
+        # (created_at, порядковый номер, source); при равных отметках новее считается записанная позже
+        self._recent: list[tuple[int, int, str]] = []
+
+    def add(self, created_at: Sequence[int], sources: Sequence[str]) -> None:
+        created = np.asarray(created_at, dtype=np.int64)
+        if created.size == 0:
+            return
+        for source in sources:
+            self._by_source[source] = self._by_source.get(source, 0) + 1
+        first, last = int(created.min()), int(created.max())
+        self._first = first if self._first is None else min(self._first, first)
+        self._last = last if self._last is None else max(self._last, last)
+        newest = np.argsort(created, kind="stable")[-self._recent_limit:] if self._recent_limit else []
+        candidates = self._recent + [(int(created[i]), self._total + int(i), sources[i]) for i in newest]
+        self._recent = sorted(candidates, reverse=True)[:self._recent_limit]
+        self._total += int(created.size)
+
+    def result(self) -> dict:
+        return {
+            "total": self._total,
+            "by_source": self._by_source,
+            "first_seen_ms": self._first,
+            "last_seen_ms": self._last,
+            "average_interval_ms": (self._last - self._first) / (self._total - 1) if self._total > 1 else None,
+            "recent": [{"created_at_ms": ts, "source": source} for ts, _, source in self._recent],
+        }
+
+
+def newest_records(records: UserRecords, limit: int) -> UserRecords:
+    """Не больше limit самых новых строк (по created_at)."""
+    if records.ids.size <= limit:
+        return records
+    keep = np.sort(np.argsort(-records.created_at, kind="stable")[:limit])
+    return UserRecords(
+        ids=records.ids[keep],
+        embeddings=records.embeddings[keep],
+        created_at=records.created_at[keep],
+        sources=[records.sources[i] for i in keep],
+    )
+
+
+def summarize_history(created_at: Sequence[int], sources: Sequence[str], recent: int = 5) -> dict:
+    """Агрегаты по истории пользователя: количество по source, первый/последний раз, средний интервал."""
+    summary = HistorySummary(recent)
+    summary.add(created_at, sources)
+    return summary.result()
+
+
+def records_page(records: list[dict], limit: int) -> tuple[list[dict], Optional[int]]:
+    page = records[:limit]
+    return page, page[-1]["id"] if len(records) > limit else None
+
+
+def rerank(hits: Sequence[Hit], embedding: np.ndarray, vectors: dict[int, np.ndarray]) -> list[Hit]:
+    """Точный score кандидатов по сохранённым векторам: квантованный индекс даёт приближённый."""
+    query = normalize_embedding(np.ravel(embedding))
+    rescored = [hit._replace(score=float(vectors[hit.id] @ query)) for hit in hits if hit.id in vectors]
+    return sorted(rescored, key=lambda h: h.score, reverse=True)
+
+
+def group_by_user(hits: Sequence[Hit], top_k: int) -> list[Hit]:
+    """Лучший хит на пользователя: у одного пользователя много эмбеддингов, и они не должны занять весь top-k."""
+    best: dict[int, Hit] = {}
+    for hit in hits:
+        current = best.get(hit.user_id)
+        if current is None or hit.score > current.score:
+            best[hit.user_id] = hit
+    return sorted(best.values(), key=lambda h: h.score, reverse=True)[:top_k]
+
+
+class VectorStore:
+    """
+    Хранилище эмбеддингов истории пользователей.
+
+    Методы блокирующие; из async-кода их вызывают через run_blocking.
+    """
+
+    def start(self) -> None:
+        pass
+
+    def warmup(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def save(self, user_id: int, embedding: np.ndarray, source: str = "reauth") -> None:
+        raise NotImplementedError
+
+    def save_many(self, user_ids: Sequence[int], embeddings: np.ndarray, source: str) -> None:
+        """Пачка строк одним вызовом (массовый импорт), мимо write-behind буфера."""
+        raise NotImplementedError
+
+    def fetch_user(self, user_id: int) -> UserRecords:
+        raise NotImplementedError
+
+    def search_user(self, embedding: np.ndarray, user_id: int, top_k: int = 3) -> list[Hit]:
+        raise NotImplementedError
+
+    def delete(self, ids: Sequence[int]) -> None:
+        raise NotImplementedError
+
+    def list_users(self) -> set[int]:
+        raise NotImplementedError
+
+    def users_since(self, since_ms: int) -> set[int]:
+        """Пользователи, у которых есть строки с created_at >= since_ms."""
+        raise NotImplementedError
+
+    def identify(self, embedding: np.ndarray, top_k: int = 5) -> list[Hit]:
+        raise NotImplementedError
+
+    def history_stats(self, user_id: int) -> dict:
+        raise NotImplementedError
+
+    def history_records(self, user_id: int, cursor: Optional[int], limit: int) -> tuple[list[dict], Optional[int]]:
+        """
+        Страница записей пользователя по возрастанию id, начиная после cursor.
+        Возвращает записи {id, created_at_ms, source} и курсор следующей страницы (None — конец).
+        """
+        raise NotImplementedError
+
+    def export_rows(self, batch_size: int = 5000) -> Iterator[tuple[np.ndarray, np.ndarray, list[str]]]:
+        """Вся история порциями (user_ids, embeddings, sources) — для офлайн-калибровки."""
+        raise NotImplementedError
+
+
+# верхняя граница topk (и limit) одного поиска в Milvus
+_MILVUS_MAX_TOPK = 16384
+
+
+class MilvusVectorStore(VectorStore):
+    def start(self) -> None:
+        from app.services.milvus import get_history_writer
+
+        # поднимаем write-behind сразу: строки из журнала после падения дописываются без ожидания запросов
+        get_history_writer()
+
+    def warmup(self) -> None:
+        # предварительно инициализируем Milvus (соединение + коллекции)
+        from app.services.milvus import get_collection, init_history_collection
+
+        get_collection()
+        init_history_collection()
+
+    def close(self) -> None:
+        from app.services.milvus import stop_history_writer
+
+        stop_history_writer()
+
+    def save(self, user_id: int, embedding: np.ndarray, source: str = "reauth") -> None:
+        from app.services.milvus import save_user_embedding
+
+        save_user_embedding(user_id, embedding, source=source)
+
+    def save_many(self, user_ids: Sequence[int], embeddings: np.ndarray, source: str) -> None:
+        from app.services.milvus import insert_user_embeddings
+
+        insert_user_embeddings(user_ids, embeddings, source)
+
+    @staticmethod
+    def _hits(results) -> list[Hit]:
+        if not results:
+            return []
+        return [
+            Hit(
+                id=hit.id,
+                user_id=hit.entity.get("user_id"),
+                score=float(hit.score),
+                created_at=hit.entity.get("created_at"),
+                source=hit.entity.get("source"),
+            )
+            for hit in results[0]
+        ]
+
+    def _search(self, embedding: np.ndarray, top_k: int, user_id: Optional[int] = None) -> list[Hit]:
+        from app.services.milvus import fetch_embeddings, search_history
+
+        # с квантованным индексом берём кандидатов с запасом и пересчитываем точно
+        factor = settings.MILVUS_RERANK_FACTOR
+        hits = self._hits(search_history(
+            embedding,
+            min(top_k * max(1, factor), _MILVUS_MAX_TOPK),
+            expr=f"user_id == {user_id}" if user_id is not None else None,
+            output_fields=["user_id", "created_at", "source"],
+        ))
+        if factor > 0 and hits:
+            hits = rerank(hits, embedding, fetch_embeddings([hit.id for hit in hits]))
+        return hits[:top_k]
+
+    def fetch_user(self, user_id: int) -> UserRecords:
+        from app.services.milvus import fetch_user_history
+
+        records = fetch_user_history(user_id, page_size=settings.HISTORY_EXACT_MAX_ROWS)
+        dim = settings.MILVUS_DIM
+        return UserRecords(
+            ids=np.array([r["id"] for r in records], dtype=np.int64),
+            embeddings=np.array([r["embedding"] for r in records], dtype=np.float32).reshape(-1, dim),
+            created_at=np.array([r.get("created_at", 0) for r in records], dtype=np.int64),
+            sources=[r.get("source", "unknown") for r in records],
+        )
+
+    def _exact_records(self, user_id: int) -> UserRecords:
+        records = self.fetch_user(user_id)
+        limit = settings.HISTORY_EXACT_MAX_ROWS
+        if records.ids.size > limit:
+            # обычно историю ограничивает компакция; если она отстала, скорим самые новые шаблоны
+            _EXACT_TRUNCATED.inc()
+            logger.warning("User %d has %d history rows, scoring the newest %d", user_id, records.ids.size, limit)
+            records = newest_records(records, limit)
+        return records
+
+    def _cached_records(self, user_id: int) -> UserRecords:
+        from app.services.template_cache import get_template_cache
+
+        cache = get_template_cache()
+        if cache is None:
+            return self._exact_records(user_id)
+        records = cache.get(user_id)
+        if records is None:
+            version = cache.version()
+            records = self._exact_records(user_id)
+            cache.put(user_id, records, version)
+        return records
+
+    def search_user(self, embedding: np.ndarray, user_id: int, top_k: int = 3) -> list[Hit]:
+        if settings.HISTORY_SEARCH_MODE == "exact":
+            # у пользователя единицы векторов: достаём их по partition key и считаем точно,
+            # вместо ANN с фильтром, который может не найти их в непросмотренных кластерах;
+            # шаблоны активных пользователей берутся из кэша без похода в Milvus
+            return score_records(self._cached_records(user_id), user_id, embedding, top_k)
+        return self._search(embedding, top_k, user_id)
+
+    def delete(self, ids: Sequence[int]) -> None:
+        from app.services.milvus import delete_history
+
+        delete_history(ids)
+
+    def list_users(self) -> set[int]:
+        from app.services.milvus import list_history_users
+
+        return list_history_users()
+
+    def users_since(self, since_ms: int) -> set[int]:
+        from app.services.milvus import history_users_since
+
+        return history_users_since(since_ms)
+
+    def identify(self, embedding: np.ndarray, top_k: int = 5) -> list[Hit]:
+        # кандидатов расширяем, пока после группировки по пользователю не наберётся top_k,
+        # как в LocalVectorStore; предел — максимальный topk поиска в Milvus
+        limit = min(top_k * settings.IDENTIFY_OVERSAMPLE, _MILVUS_MAX_TOPK)
+        while True:
+            candidates = self._search(embedding, limit)
+            hits = group_by_user(candidates, top_k)
+            if len(hits) >= top_k or len(candidates) < limit or limit == _MILVUS_MAX_TOPK:
+                return hits
+            limit = min(limit * 2, _MILVUS_MAX_TOPK)
+
+    def history_stats(self, user_id: int) -> dict:
+        from app.services.milvus import iter_user_history
+
+        # страницами через query_iterator: ни один запрос не упирается в лимит выдачи Milvus;
+        # скан ограничен HISTORY_STATS_MAX_ROWS, иначе таймаут run_blocking оставил бы поток сканировать дальше
+        summary = HistorySummary()
+        room, truncated = settings.HISTORY_STATS_MAX_ROWS, False
+        with closing(iter_user_history(user_id, ["created_at", "source"], settings.HISTORY_STATS_PAGE_SIZE)) as pages:
+            for page in pages:
+                page = page[:room]
+                summary.add([r.get("created_at", 0) for r in page], [r.get("source", "unknown") for r in page])
+                room -= len(page)
+                if room <= 0:
+                    truncated = True
+                    break
+        return {**summary.result(), "truncated": truncated}
+
+    def history_records(self, user_id: int, cursor: Optional[int], limit: int) -> tuple[list[dict], Optional[int]]:
+        from app.services.milvus import query_history
+
+        expr = f"user_id == {user_id}" + (f" and id > {int(cursor)}" if cursor is not None else "")
+        # limit + 1: по лишней строке видно, есть ли следующая страница
+        rows = query_history(expr, output_fields=["id", "created_at", "source"], limit=limit + 1)
+        rows = sorted(rows, key=lambda r: r["id"])
+        return records_page(
+            [
+                {"id": int(r["id"]), "created_at_ms": int(r.get("created_at", 0)), "source": r.get("source", "unknown")}
+                for r in rows
+            ],
+            limit,
+        )
+
+    def export_rows(self, batch_size: int = 5000) -> Iterator[tuple[np.ndarray, np.ndarray, list[str]]]:
+        from app.services.milvus import iter_history
+
+        return iter_history(batch_size)
+
+
+_store: Optional[VectorStore] = None
+_store_lock = threading.Lock()
+
+
+def get_vector_store() -> VectorStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if settings.VECTOR_STORE_BACKEND == "local":
+                    from app.services.local_store import LocalVectorStore
+
+                    _store = LocalVectorStore(settings.LOCAL_STORE_PATH, dim=settings.MILVUS_DIM)
+                else:
+                    _store = MilvusVectorStore()
+    return _store
+
+
+def close_vector_store() -> None:
+    global _store
+    if _store is not None:
+        _store.close()
+        _store = None
+
+
+# отдельный ограниченный executor: вызовы хранилища не занимают общий threadpool Starlette
+# и не блокируют event loop; одновременно идёт не больше VECTOR_STORE_MAX_CONCURRENCY вызовов
+_executor: Optional[ThreadPoolExecutor] = None
+_STORE_IN_FLIGHT = registry.gauge(
+    "face_auth_store_calls_in_flight", "Vector store calls running or waiting for an executor thread"
+)
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.VECTOR_STORE_MAX_CONCURRENCY,
+            thread_name_prefix="vector-store",
+        )
+    return _executor
+
+
+async def run_blocking(fn: Callable[..., T], *args, timeout: Optional[float] = None, **kwargs) -> T:
+    """
+    Выполняет блокирующий вызов хранилища в выделенном executor'е.
+
+    timeout считается вместе с ожиданием свободного слота; по его истечении
+    запрос получает asyncio.TimeoutError, а сам вызов Milvus ограничен тем же
+    таймаутом на стороне pymilvus.
+    """
+    loop = asyncio.get_running_loop()
+    _STORE_IN_FLIGHT.inc()
+    try:
+        with stage(f"store_{getattr(fn, '__name__', 'call')}"):
+            future = loop.run_in_executor(_get_executor(), functools.partial(fn, *args, **kwargs))
+            return await asyncio.wait_for(future, timeout if timeout is not None else settings.VECTOR_STORE_TIMEOUT_S)
+    finally:
+        _STORE_IN_FLIGHT.dec()
+
+
+def shutdown_store_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,56 @@
+import asyncio
+import logging
+import time
+
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.services.inference import start_inference
+from app.services.vector_store import get_vector_store
+
+
+logger = logging.getLogger(__name__)
+
+# готовность компонентов для /health/ready
+_components: dict[str, bool] = {"vector_store": False, "model": False}
+
+
+def _warmup_vector_store() -> None:
+    get_vector_store().warmup()
+
+
+def readiness_state() -> dict[str, bool]:
+    return dict(_components)
+
+
+def is_ready() -> bool:
+    # без прогрева всё грузится лениво на первом запросе, как раньше
+    if not settings.WARMUP_ON_STARTUP:
+        return True
+    return all(_components.values())
+
+
+async def _warmup_step(name: str, step) -> None:
+    # на старте зависимость (например, Milvus) может быть ещё не поднята: повторяем
+    # с растущей паузой, пока не получится, иначе readiness навсегда останется красным
+    delay = settings.WARMUP_RETRY_INITIAL_S
+    while True:
+        started = time.perf_counter()
+        try:
+            await run_in_threadpool(step)
+        except Exception:
+            logger.exception("Warm-up of %s failed, retrying in %.1fs", name, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, settings.WARMUP_RETRY_MAX_S)
+            continue
+        _components[name] = True
+        logger.info("Warm-up of %s done in %.2fs", name, time.perf_counter() - started)
+        return
+
+
+async def run_warmup() -> None:
+    # шаги независимы: модель грузится, пока ждём хранилище
+    await asyncio.gather(
+        _warmup_step("vector_store", _warmup_vector_store),
+        _warmup_step("model", start_inference),
+    )
@@ -0,0 +1,111 @@
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from typing import Callable, Optional, Sequence
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+
+def percentiles(samples_s: Sequence[float]) -> dict:
+    """Сводка по задержкам в миллисекундах."""
+    if not samples_s:
+        return {"count": 0}
+    ms = np.asarray(samples_s, dtype=np.float64) * 1000
+    return {
+        "count": int(ms.size),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+    }
+
+
+def peak_rss_mb(pid: Optional[int] = None) -> Optional[float]:
+    """Пиковый RSS: текущего процесса или чужого (по /proc, только Linux)."""
+    if pid is None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux отдаёт КБ, macOS — байты
+        return peak / 1024 / (1024 if sys.platform == "darwin" else 1)
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+def bench(fn: Callable[[], object], iterations: int, warmup: int = 3) -> dict:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - started
+    return {**percentiles(samples), "ops_per_s": iterations / elapsed if elapsed else None}
+
+
+def synthetic_face(rng: np.random.Generator, width: int = 640, height: int = 480, fmt: str = "JPEG") -> bytes:
+    """Шумный фон и «лицо» из эллипсов; у каждого изображения свои пиксели (промах кэша эмбеддингов)."""
+    background = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    image = Image.fromarray(background)
+    draw = ImageDraw.Draw(image)
+    cx, cy = width // 2 + int(rng.integers(-20, 20)), height // 2 + int(rng.integers(-20, 20))
+    fw, fh = width // 5, height // 3
+    skin = tuple(int(c) for c in rng.integers(150, 230, 3))
+    draw.ellipse((cx - fw, cy - fh, cx + fw, cy + fh), fill=skin)
+    for dx in (-fw // 2, fw // 2):
+        draw.ellipse((cx + dx - 12, cy - fh // 3 - 8, cx + dx + 12, cy - fh // 3 + 8), fill=(40, 40, 40))
+    draw.line((cx, cy - 10, cx, cy + fh // 4), fill=(120, 80, 60), width=4)
+    draw.arc((cx - fw // 2, cy + fh // 4, cx + fw // 2, cy + fh // 2), 0, 180, fill=(150, 40, 40), width=5)
+    buf = io.BytesIO()
+    image.save(buf, format=fmt, quality=90)
+    return buf.getvalue()
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def write_results(path: Optional[str], results: dict) -> None:
+    text = json.dumps(results, indent=2, ensure_ascii=False)
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+def compare(baseline_path: str, results: dict, metric: str, tolerance: float) -> list[str]:
+    """Имена бенчмарков, у которых metric вырос больше чем на tolerance относительно baseline."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)["benchmarks"]
+    regressions = []
+    for name, current in results["benchmarks"].items():
+        old = baseline.get(name, {}).get(metric)
+        new = current.get(metric)
+        if old and new and new > old * (1 + tolerance):
+            regressions.append(f"{name}: {metric} {old:.3f} -> {new:.3f} (+{(new / old - 1) * 100:.0f}%)")
+    return regressions
@@ -0,0 +1,182 @@
+"""
+Нагрузочный тест API на синтетических изображениях лиц.
+
+    # приложение в этом же процессе: модели-заглушки, LocalVectorStore во временном каталоге
+    python -m benchmarks.load --endpoint verify_identity --concurrency 32 --requests 2000 --output load.json
+
+    # запущенный сервер (настоящие модели); --server-pid для пикового RSS сервера
+    python -m benchmarks.load --url http://localhost:8000 --duration 60 --server-pid 12345
+
+Результат: пропускная способность, p50/p95/p99, коды ответов, пиковый RSS; --baseline
+сравнивает p95 с прошлым прогоном.
+"""
+import argparse
+import asyncio
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import numpy as np
+
+from benchmarks.common import compare, environment, peak_rss_mb, percentiles, synthetic_face, write_results
+
+ENDPOINTS = {
+    "verify_identity": ("/api/v1/verify-identity/verify_identity", ("passport_image", "selfie_image")),
+    "verify_user": ("/api/v1/verify-user/verify", ("selfie_image",)),
+    "identify": ("/api/v1/identify/search", ("selfie_image",)),
+    # без multipart: тело — селфи или кадр FAP1 с паспортом и селфи
+    "verify_identity_raw": ("/api/v1/verify-identity/verify_identity_raw", None),
+    "verify_user_raw": ("/api/v1/verify-user/verify_raw", None),
+}
+
+
+def _raw_body(path: str, images: list[bytes]) -> bytes:
+    if path.endswith("verify_identity_raw"):
+        passport, selfie = random.choice(images), random.choice(images)
+        return struct.pack(">4sII", b"FAP1", len(passport), len(selfie)) + passport + selfie
+    return random.choice(images)
+
+
+async def _worker(
+    client,
+    path: str,
+    fields,
+    images: list[bytes],
+    deadline: float,
+    remaining: list,
+    latencies,
+    statuses,
+):
+    while time.perf_counter() < deadline:
+        if remaining[0] <= 0:
+            return
+        remaining[0] -= 1
+        if fields is None:
+            request = {"content": _raw_body(path, images), "headers": {"content-type": "application/octet-stream"}}
+        else:
+            request = {"files": {field: (f"{field}.jpg", random.choice(images), "image/jpeg") for field in fields}}
+        started = time.perf_counter()
+        try:
+            response = await client.post(path, **request)
+            statuses[response.status_code] += 1
+        except Exception as e:
+            statuses[type(e).__name__] += 1
+            continue
+        latencies.append(time.perf_counter() - started)
+
+
+async def _seed_in_process(images: list[bytes]) -> None:
+    """История для заглушки текущего пользователя verify_user (id 7857)."""
+    import io
+
+    from app.services.face_analysis import get_embedding, image_to_array
+    from app.services.vector_store import get_vector_store
+
+    for data in images[:5]:
+        get_vector_store().save(7857, get_embedding(image_to_array(io.BytesIO(data))), source="signup")
+
+
+async def run(args) -> dict:
+    import httpx
+
+    rng = np.random.default_rng(args.seed)
+    random.seed(args.seed)
+    images = [synthetic_face(rng, args.width, args.height) for _ in range(args.unique_images)]
+    path, fields = ENDPOINTS[args.endpoint]
+
+    app = None
+    if args.url:
+        client = httpx.AsyncClient(
+            base_url=args.url,
+            timeout=args.timeout,
+            limits=httpx.Limits(max_connections=args.concurrency),
+        )
+    else:
+        from benchmarks.stubs import install_stub_models
+
+        install_stub_models()
+        from app.main import app
+
+        await app.router.startup()
+        await _seed_in_process(images)
+        client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=args.timeout
+        )
+
+    latencies: list[float] = []
+    statuses: Counter = Counter()
+    remaining = [args.requests if args.requests else float("inf")]
+    try:
+        # прогрев: первые запросы не попадают в статистику
+        await asyncio.gather(*(
+            _worker(client, path, fields, images, time.perf_counter() + 60, [1], [], Counter())
+            for _ in range(min(args.concurrency, 8))
+        ))
+        started = time.perf_counter()
+        deadline = started + args.duration if args.duration else float("inf")
+        await asyncio.gather(*(
+            _worker(client, path, fields, images, deadline, remaining, latencies, statuses)
+            for _ in range(args.concurrency)
+        ))
+        elapsed = time.perf_counter() - started
+    finally:
+        await client.aclose()
+        if app is not None:
+            await app.router.shutdown()
+
+    summary = {
+        **percentiles(latencies),
+        "throughput_rps": len(latencies) / elapsed if elapsed else None,
+        "elapsed_s": elapsed,
+        "statuses": {str(k): v for k, v in statuses.items()},
+    }
+    return {
+        "environment": environment(),
+        "params": vars(args),
+        "peak_rss_mb": peak_rss_mb(args.server_pid) if args.url else peak_rss_mb(),
+        "benchmarks": {f"load_{args.endpoint}": summary},
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="адрес запущенного сервера; без него приложение поднимается в процессе")
+    parser.add_argument("--endpoint", choices=sorted(ENDPOINTS), default="verify_identity")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=1000, help="0 — без ограничения, до --duration")
+    parser.add_argument("--duration", type=float, default=0, help="секунды; 0 — до --requests")
+    parser.add_argument("--unique-images", type=int, default=256, help="меньше — больше попаданий в кэш эмбеддингов")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--server-pid", type=int, help="PID сервера для пикового RSS (Linux)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="куда сохранить JSON с результатами")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимый рост p95 относительно baseline")
+    args = parser.parse_args(argv)
+    if not args.requests and not args.duration:
+        parser.error("нужен --requests или --duration")
+
+    if not args.url:
+        # настройки читаются при импорте app — окружение задаём до него
+        os.environ.setdefault("VECTOR_STORE_BACKEND", "local")
+        os.environ.setdefault("LOCAL_STORE_PATH", tempfile.mkdtemp(prefix="face-auth-bench-"))
+
+    results = asyncio.run(run(args))
+    write_results(args.output, results)
+
+    if args.baseline:
+        regressions = compare(args.baseline, results, "p95_ms", args.tolerance)
+        for line in regressions:
+            print("REGRESSION", line, file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
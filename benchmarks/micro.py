@@ -0,0 +1,131 @@
+"""
+Микробенчмарки горячих функций сервиса на локальных заглушках.
+
+    python -m benchmarks.micro --output micro.json
+    python -m benchmarks.micro --baseline micro.json   # код возврата 1 при регрессии p50
+
+Модели заменяются заглушками (benchmarks/stubs.py), история — LocalVectorStore
+во временном каталоге. С --milvus те же операции хранилища идут в Milvus
+из настроек (MILVUS_HOST/MILVUS_PORT), во временную коллекцию истории, которая
+удаляется после прогона; рабочая коллекция не затрагивается.
+"""
+import argparse
+import io
+import sys
+import tempfile
+import uuid
+
+import numpy as np
+
+from benchmarks.common import bench, compare, environment, peak_rss_mb, synthetic_face, write_results
+from benchmarks.stubs import install_stub_models
+
+
+def image_benchmarks(rng, iterations: int) -> dict:
+    from app.services.face_analysis import get_embedding, get_embeddings, image_to_array
+    from app.services.ingest import decode_image
+
+    results = {}
+    for width, height in ((640, 480), (1920, 1080), (4032, 3024)):
+        data = synthetic_face(rng, width, height)
+        results[f"image_to_array_{width}x{height}"] = bench(lambda: image_to_array(io.BytesIO(data)), iterations)
+        # полное разрешение — для сравнения с уменьшенным декодированием
+        results[f"decode_full_{width}x{height}"] = bench(lambda: decode_image(data, max_side=0), iterations)
+
+    install_stub_models()
+    img = image_to_array(io.BytesIO(synthetic_face(rng)))
+    results["get_embedding_stub"] = bench(lambda: get_embedding(img), iterations)
+    batch = [img] * 16
+    results["get_embeddings_stub_batch16"] = bench(lambda: get_embeddings(batch), max(1, iterations // 4))
+    return results
+
+
+def similarity_benchmarks(rng, iterations: int) -> dict:
+    from app.core.utils import cosine_similarity, pairwise_cosine_similarity
+
+    a = rng.standard_normal(512).astype(np.float32)
+    b = rng.standard_normal(512).astype(np.float32)
+    pa = rng.standard_normal((1024, 512)).astype(np.float32)
+    pb = rng.standard_normal((1024, 512)).astype(np.float32)
+    return {
+        "cosine_similarity": bench(lambda: cosine_similarity(a, b), iterations * 10),
+        "cosine_similarity_loop_1024": bench(
+            lambda: [cosine_similarity(x, y) for x, y in zip(pa, pb)], max(1, iterations // 10)
+        ),
+        "pairwise_cosine_similarity_1024": bench(lambda: pairwise_cosine_similarity(pa, pb), iterations),
+    }
+
+
+def store_benchmarks(store, rng, iterations: int, users: int, per_user: int, dim: int) -> dict:
+    vectors = rng.standard_normal((users * per_user, dim)).astype(np.float32)
+    for i, vec in enumerate(vectors):
+        store.save(i // per_user, vec, source="signup")
+    query = vectors[0]
+    counter = iter(range(10**9))
+    return {
+        "store_save": bench(lambda: store.save(users + next(counter), query, source="bench"), iterations),
+        "store_search_user": bench(lambda: store.search_user(query, 0, top_k=3), iterations),
+        "store_identify_top5": bench(lambda: store.identify(query, top_k=5), iterations),
+        "store_history_stats": bench(lambda: store.history_stats(0), iterations),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--per-user", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--milvus", action="store_true", help="операции хранилища через Milvus вместо LocalVectorStore")
+    parser.add_argument("--output", help="куда сохранить JSON с результатами")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимый рост p50 относительно baseline")
+    args = parser.parse_args(argv)
+
+    from app.core.config import settings
+
+    rng = np.random.default_rng(args.seed)
+    benchmarks = {}
+    benchmarks.update(image_benchmarks(rng, args.iterations))
+    benchmarks.update(similarity_benchmarks(rng, args.iterations))
+
+    dim = settings.MILVUS_DIM
+    if args.milvus:
+        from app.services.milvus import drop_history_collection, use_history_collection
+        from app.services.vector_store import MilvusVectorStore
+
+        use_history_collection(f"bench_history_{uuid.uuid4().hex[:12]}")
+        store = MilvusVectorStore()
+        try:
+            store.warmup()
+            benchmarks.update(store_benchmarks(store, rng, args.iterations, args.users, args.per_user, dim))
+        finally:
+            # дописываем буфер write-behind и только потом удаляем коллекцию
+            store.close()
+            drop_history_collection()
+    else:
+        from app.services.local_store import LocalVectorStore
+
+        with tempfile.TemporaryDirectory() as path:
+            store = LocalVectorStore(path, dim=dim)
+            benchmarks.update(store_benchmarks(store, rng, args.iterations, args.users, args.per_user, dim))
+            store.close()
+
+    results = {
+        "environment": environment(),
+        "params": vars(args),
+        "peak_rss_mb": peak_rss_mb(),
+        "benchmarks": benchmarks,
+    }
+    write_results(args.output, results)
+
+    if args.baseline:
+        regressions = compare(args.baseline, results, "p50_ms", args.tolerance)
+        for line in regressions:
+            print("REGRESSION", line, file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
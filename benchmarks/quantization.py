@@ -0,0 +1,175 @@
+"""
+Сжатое хранение векторов истории: память и качество поиска относительно float32.
+
+    python -m benchmarks.quantization --output quant.json
+    python -m benchmarks.quantization --embeddings emb.npy --labels labels.npy   # реальные эмбеддинги
+
+Кодирование моделируется в numpy так же, как его делает Milvus (faiss): float16,
+SQ8 (8 бит на измерение, min/max по измерению), PQ (m подвекторов по 8 бит).
+Для каждого режима: байт на вектор и МБ на миллион строк, recall@k кандидатов
+относительно точного поиска — без пересчёта и после точного пересчёта
+top_k * rerank кандидатов (MILVUS_RERANK_FACTOR), TAR и FAR на пороге
+FACE_COMPARE_THRESHOLD по приближённым score (решение без пересчёта; после
+пересчёта score точные и TAR/FAR совпадают с float32, меняется только recall).
+
+Без --embeddings эмбеддинги синтетические (кластер на пользователя), цифры
+качества для продакшна — только на реальных (например, выгрузка истории).
+"""
+import argparse
+import sys
+from typing import Callable
+
+import numpy as np
+
+from benchmarks.common import environment, write_results
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    return x / np.maximum(np.linalg.norm(x, axis=-1, keepdims=True), 1e-12)
+
+
+def synthetic_embeddings(rng, users: int, per_user: int, dim: int) -> tuple[np.ndarray, np.ndarray]:
+    # сходство своих 0.3-0.8 (ракурс, свет, возраст), чужих ~0.05 ± 0.05 — порядок величин ArcFace
+    shared = _normalize(rng.standard_normal(dim)) * 0.25
+    centers = _normalize(rng.standard_normal((users, dim)) + shared * np.sqrt(dim))
+    spread = rng.uniform(0.3, 2.5, (users, per_user, 1))
+    noise = rng.standard_normal((users, per_user, dim)) * np.sqrt(spread / dim)
+    embeddings = _normalize(centers[:, None, :] + noise).reshape(-1, dim).astype(np.float32)
+    return embeddings, np.repeat(np.arange(users), per_user)
+
+
+def _kmeans(rng, x: np.ndarray, k: int, iterations: int) -> np.ndarray:
+    centroids = x[rng.choice(len(x), size=min(k, len(x)), replace=False)].copy()
+    for _ in range(iterations):
+        d = (x ** 2).sum(1)[:, None] - 2 * x @ centroids.T + (centroids ** 2).sum(1)[None, :]
+        assign = d.argmin(1)
+        for j in range(len(centroids)):
+            members = x[assign == j]
+            if len(members):
+                centroids[j] = members.mean(0)
+    return centroids
+
+
+def codec_float16(rng, gallery: np.ndarray) -> tuple[np.ndarray, float]:
+    return gallery.astype(np.float16).astype(np.float32), 2 * gallery.shape[1]
+
+
+def codec_sq8(rng, gallery: np.ndarray) -> tuple[np.ndarray, float]:
+    lo, hi = gallery.min(0), gallery.max(0)
+    scale = np.maximum(hi - lo, 1e-12) / 255
+    codes = np.round((gallery - lo) / scale).astype(np.uint8)
+    return codes * scale + lo, gallery.shape[1]
+
+
+def make_codec_pq(m: int, train_rows: int, iterations: int) -> Callable:
+    def codec_pq(rng, gallery: np.ndarray) -> tuple[np.ndarray, float]:
+        n, dim = gallery.shape
+        sub = dim // m
+        train = gallery[rng.choice(n, size=min(train_rows, n), replace=False)]
+        decoded = np.empty_like(gallery)
+        for i in range(m):
+            part = slice(i * sub, (i + 1) * sub)
+            centroids = _kmeans(rng, train[:, part], 256, iterations)
+            d = (gallery[:, part] ** 2).sum(1)[:, None] - 2 * gallery[:, part] @ centroids.T
+            decoded[:, part] = centroids[(d + (centroids ** 2).sum(1)[None, :]).argmin(1)]
+        return decoded, m
+
+    return codec_pq
+
+
+def evaluate(
+    exact: np.ndarray, approx: np.ndarray, same_user: np.ndarray, k: int, rerank: int, threshold: float
+) -> dict:
+    """exact/approx — score probe x gallery; same_user — маска своих пар."""
+    exact_top = np.argsort(-exact, axis=1)[:, :k]
+    approx_order = np.argsort(-approx, axis=1)
+
+    def recall(candidates: np.ndarray) -> float:
+        return float(np.mean([len(set(a) & set(e)) / k for a, e in zip(candidates, exact_top)]))
+
+    candidates = approx_order[:, :k * rerank]
+    rescored = np.take_along_axis(exact, candidates, axis=1)
+    reranked = np.take_along_axis(candidates, np.argsort(-rescored, axis=1)[:, :k], axis=1)
+
+    def tar(scores: np.ndarray) -> float:
+        return float((np.where(same_user, scores, -np.inf).max(1) >= threshold).mean())
+
+    def far(scores: np.ndarray) -> float:
+        return float((scores[~same_user] >= threshold).mean())
+
+    return {
+        f"recall_at_{k}": recall(approx_order[:, :k]),
+        f"recall_at_{k}_reranked": recall(reranked),
+        "tar": tar(approx),
+        "tar_delta": tar(approx) - tar(exact),
+        "far": far(approx),
+        "far_delta": far(approx) - far(exact),
+        "max_abs_score_error": float(np.abs(approx - exact).max()),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument(
+        "--per-user", type=int, default=4, help="последний образец пользователя — запрос, остальные — история"
+    )
+    parser.add_argument("--embeddings", help=".npy (N x dim) с реальными эмбеддингами")
+    parser.add_argument("--labels", help=".npy (N) с user_id к --embeddings")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rerank", type=int, default=4, help="кандидатов на точный пересчёт: k * rerank")
+    parser.add_argument("--pq-m", type=int, default=64)
+    parser.add_argument("--pq-iterations", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="куда сохранить JSON с результатами")
+    args = parser.parse_args(argv)
+
+    from app.core.config import settings
+
+    rng = np.random.default_rng(args.seed)
+    if args.embeddings:
+        embeddings = _normalize(np.load(args.embeddings, mmap_mode="r").astype(np.float32))
+        labels = np.load(args.labels)
+    else:
+        embeddings, labels = synthetic_embeddings(rng, args.users, args.per_user, settings.MILVUS_DIM)
+
+    # запрос — последний образец каждого пользователя, у которого есть история
+    last = {user: i for i, user in enumerate(labels.tolist())}
+    counts = dict(zip(*np.unique(labels, return_counts=True)))
+    probe_idx = np.array(sorted(i for user, i in last.items() if counts[user] > 1))
+    gallery_mask = np.ones(len(labels), dtype=bool)
+    gallery_mask[probe_idx] = False
+    gallery, gallery_labels = embeddings[gallery_mask], labels[gallery_mask]
+    probes, probe_labels = embeddings[probe_idx], labels[probe_idx]
+
+    exact = probes @ gallery.T
+    same_user = probe_labels[:, None] == gallery_labels[None, :]
+    dim = gallery.shape[1]
+    codecs = {
+        "float32": lambda rng, g: (g, 4 * dim),
+        "float16": codec_float16,
+        "sq8": codec_sq8,
+        f"pq{args.pq_m}x8": make_codec_pq(args.pq_m, 20000, args.pq_iterations),
+    }
+    threshold = settings.FACE_COMPARE_THRESHOLD
+    benchmarks = {}
+    for name, codec in codecs.items():
+        decoded, bytes_per_vector = codec(rng, gallery)
+        benchmarks[f"quantization_{name}"] = {
+            "bytes_per_vector": bytes_per_vector,
+            "memory_mb_per_million": bytes_per_vector * 1e6 / 2 ** 20,
+            "memory_saved": 1 - bytes_per_vector / (4 * dim),
+            **evaluate(exact, probes @ decoded.T, same_user, args.k, args.rerank, threshold),
+        }
+
+    results = {
+        "environment": environment(),
+        "params": {**vars(args), "gallery": int(len(gallery)), "probes": int(len(probes)), "threshold": threshold},
+        "benchmarks": benchmarks,
+    }
+    write_results(args.output, results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
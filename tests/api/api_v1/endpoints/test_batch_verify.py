@@ -0,0 +1,130 @@
+import asyncio
+import io
+import json
+import zipfile
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.services import batch_verify
+
+client = TestClient(app)
+
+EMBEDDINGS = {
+    b"alice": np.array([1, 0, 0], dtype=np.float32),
+    b"alice-selfie": np.array([0.9, 0.1, 0], dtype=np.float32),
+    b"bob": np.array([0, 1, 0], dtype=np.float32),
+}
+
+
+async def fake_embed(contents, wait=False):
+    if contents not in EMBEDDINGS:
+        raise LookupError("no face")
+    return EMBEDDINGS[contents]
+
+
+def _lines(response):
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_multipart_pairs_stream_ndjson(monkeypatch):
+    monkeypatch.setattr(batch_verify, "embed_upload", fake_embed)
+    response = client.post(
+        "/api/v1/verify-identity/verify_identity_batch",
+        files=[
+            ("passport_images", ("p0.jpg", b"alice", "image/jpeg")),
+            ("selfie_images", ("s0.jpg", b"alice-selfie", "image/jpeg")),
+            ("passport_images", ("p1.jpg", b"alice", "image/jpeg")),
+            ("selfie_images", ("s1.jpg", b"bob", "image/jpeg")),
+            ("passport_images", ("p2.jpg", b"alice", "image/jpeg")),
+            ("selfie_images", ("s2.jpg", b"blank", "image/jpeg")),
+        ],
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    # внутри чанка пары отдаются по готовности
+    results = sorted(_lines(response), key=lambda r: r["index"])
+    assert [r["index"] for r in results] == [0, 1, 2]
+    assert [r["is_authenticated"] for r in results] == [True, False, False]
+    assert results[1]["detail"] == "Similarity below threshold"
+    assert results[2]["detail"] == "No face detected in selfie image"
+
+
+def test_zip_archive_pairs(monkeypatch):
+    monkeypatch.setattr(batch_verify, "embed_upload", fake_embed)
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        zf.writestr("a/passport.jpg", b"alice")
+        zf.writestr("a/selfie.jpg", b"alice-selfie")
+        zf.writestr("b_passport.png", b"bob")
+    response = client.post(
+        "/api/v1/verify-identity/verify_identity_batch",
+        files={"archive": ("pairs.zip", buf.getvalue(), "application/zip")},
+    )
+    assert response.status_code == 200
+    results = {r["pair_id"]: r for r in _lines(response)}
+    assert results["a"]["is_authenticated"] is True
+    assert results["b"]["detail"] == "Missing selfie image"
+
+
+def test_unpaired_lists_rejected():
+    response = client.post(
+        "/api/v1/verify-identity/verify_identity_batch",
+        files=[("passport_images", ("p0.jpg", b"alice", "image/jpeg"))],
+    )
+    assert response.status_code == 400
+
+
+def test_zip_bomb_entry_is_not_decompressed(monkeypatch):
+    monkeypatch.setattr(batch_verify, "embed_upload", fake_embed)
+    monkeypatch.setattr(batch_verify.settings, "BATCH_VERIFY_MAX_FILE_BYTES", 1024)
+    opened = []
+    original_open = zipfile.ZipFile.open
+
+    def tracking_open(self, name, *args, **kwargs):
+        opened.append(getattr(name, "filename", name))
+        return original_open(self, name, *args, **kwargs)
+
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("a/passport.jpg", b"\0" * (1024 * 1024))
+        zf.writestr("a/selfie.jpg", b"alice-selfie")
+    monkeypatch.setattr(zipfile.ZipFile, "open", tracking_open)
+    response = client.post(
+        "/api/v1/verify-identity/verify_identity_batch",
+        files={"archive": ("pairs.zip", buf.getvalue(), "application/zip")},
+    )
+    assert response.status_code == 200
+    assert _lines(response)[0]["detail"] == "Passport file too large"
+    assert "a/passport.jpg" not in opened
+
+
+@pytest.mark.asyncio
+async def test_disconnect_cancels_prefetched_chunk(monkeypatch):
+    monkeypatch.setattr(batch_verify, "embed_upload", fake_embed)
+    started, cancelled = [], []
+
+    def reader(name):
+        async def read():
+            started.append(name)
+            try:
+                await asyncio.sleep(0 if name.startswith("0") else 10)
+            except asyncio.CancelledError:
+                cancelled.append(name)
+                raise
+            return b"alice"
+        return read
+
+    pairs = [
+        batch_verify.ImagePair(str(i), "p.jpg", "s.jpg", reader(f"{i}p"), reader(f"{i}s"))
+        for i in range(2)
+    ]
+    results = batch_verify.verify_pairs(pairs, chunk_size=1)
+    first = await results.__anext__()
+    # следующий чанк уже начат заранее
+    assert first.index == 0 and "1p" in started
+    # после отключения клиента он отменён и дождан, а не досчитывается в фоне
+    await results.aclose()
+    assert sorted(cancelled) == ["1p", "1s"]
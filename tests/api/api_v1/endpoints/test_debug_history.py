@@ -0,0 +1,47 @@
+import json
+
+import numpy as np
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+from app.main import app
+from app.services import vector_store
+from app.services.local_store import LocalVectorStore
+
+client = TestClient(app)
+
+
+def test_history_stats_and_records(tmp_path, monkeypatch):
+    store = LocalVectorStore(str(tmp_path), dim=3)
+    for _ in range(3):
+        store.save(5, np.array([1, 0, 0], dtype=np.float32), source="reauth")
+    monkeypatch.setattr(vector_store, "get_vector_store", lambda: store)
+
+    stats = client.get("/api/v1/debug/debug/history/5").json()
+    assert stats["total"] == 3 and stats["by_source"] == {"reauth": 3}
+
+    first = client.get("/api/v1/debug/debug/history/5/records?limit=2").json()
+    assert [r["id"] for r in first["records"]] == [0, 1]
+    second = client.get(f"/api/v1/debug/debug/history/5/records?limit=2&cursor={first['next_cursor']}").json()
+    assert [r["id"] for r in second["records"]] == [2] and second["next_cursor"] is None
+
+    too_big = client.get("/api/v1/debug/debug/history/5/records?limit=100000")
+    assert too_big.status_code == 422
+
+
+def test_static_history_routes_are_not_shadowed():
+    response = client.get("/api/v1/debug/debug/history/compaction")
+    assert response.status_code == 200
+    assert "enabled" in response.json()
+
+
+def test_compaction_status_comes_from_job(tmp_path, monkeypatch):
+    path = tmp_path / "compaction.json"
+    monkeypatch.setattr(settings, "HISTORY_COMPACTION_STATUS_PATH", str(path))
+    assert client.get("/api/v1/debug/debug/history/compaction").json()["reported"] is False
+
+    # счётчики пишет отдельное задание, процесс API только читает файл
+    path.write_text(json.dumps({"running": True, "compacted": 3, "updated_at_ms": 0}))
+    status = client.get("/api/v1/debug/debug/history/compaction").json()
+    assert status["reported"] is True and status["compacted"] == 3
+    assert status["updated_at"] == "1970-01-01T00:00:00Z"
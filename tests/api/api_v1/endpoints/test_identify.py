@@ -0,0 +1,36 @@
+import numpy as np
+from fastapi.testclient import TestClient
+
+from app.api.api_v1.endpoints import identify
+from app.main import app
+from app.services.local_store import LocalVectorStore
+
+client = TestClient(app)
+
+
+def _unit(vec):
+    vec = np.asarray(vec, dtype=np.float32)
+    return vec / np.linalg.norm(vec)
+
+
+def test_identify_returns_candidates_per_user(tmp_path, monkeypatch):
+    store = LocalVectorStore(str(tmp_path), dim=3)
+    for _ in range(3):
+        store.save(1, _unit([1, 0.05, 0]))
+    store.save(2, _unit([1, 1, 0]))
+    store.save(3, _unit([0, 0, 1]))
+
+    async def fake_embed(contents):
+        return _unit([1, 0, 0])
+
+    monkeypatch.setattr(identify, "embed_upload", fake_embed)
+    monkeypatch.setattr(identify, "get_vector_store", lambda: store)
+
+    response = client.post(
+        "/api/v1/identify/search?top_k=2",
+        files={"selfie_image": ("selfie.jpg", b"jpeg", "image/jpeg")},
+    )
+    assert response.status_code == 200
+    candidates = response.json()["candidates"]
+    assert [c["user_id"] for c in candidates] == [1, 2]
+    assert candidates[0]["is_match"] is True
@@ -0,0 +1,63 @@
+import struct
+
+import numpy as np
+from fastapi.testclient import TestClient
+
+from app.api.api_v1.endpoints import compare_faces, verify_user
+from app.main import app
+from app.services.local_store import LocalVectorStore
+
+client = TestClient(app)
+
+
+def _frame(passport: bytes, selfie: bytes, magic: bytes = b"FAP1") -> bytes:
+    return struct.pack(">4sII", magic, len(passport), len(selfie)) + passport + selfie
+
+
+def test_verify_identity_raw_splits_frame(tmp_path, monkeypatch):
+    seen = []
+
+    async def fake_embed(contents, landmarks=None, aligned=False):
+        seen.append((contents, aligned))
+        return np.array([1, 0, 0], dtype=np.float32)
+
+    monkeypatch.setattr(compare_faces, "embed_upload", fake_embed)
+    monkeypatch.setattr(compare_faces, "get_vector_store", lambda: LocalVectorStore(str(tmp_path), dim=3))
+
+    response = client.post(
+        "/api/v1/verify-identity/verify_identity_raw?input_mode=aligned",
+        content=_frame(b"passport-bytes", b"selfie"),
+        headers={"content-type": "application/octet-stream"},
+    )
+    assert response.status_code == 200
+    assert response.json()["is_authenticated"] is True
+    assert seen == [(b"passport-bytes", True), (b"selfie", True)]
+
+
+def test_verify_identity_raw_rejects_bad_frames():
+    url = "/api/v1/verify-identity/verify_identity_raw"
+    headers = {"content-type": "application/octet-stream"}
+    assert client.post(url, content=_frame(b"a", b"b", magic=b"XXXX"), headers=headers).status_code == 400
+    assert client.post(url, content=_frame(b"a", b"b")[:-1], headers=headers).status_code == 400
+    assert client.post(url, content=_frame(b"a", b"b") + b"!", headers=headers).status_code == 400
+    oversized = struct.pack(">4sII", b"FAP1", 64 * 1024 * 1024, 1)
+    assert client.post(url, content=oversized, headers=headers).status_code == 413
+    assert client.post(url, content=_frame(b"a", b"b"), headers={"content-type": "text/plain"}).status_code == 415
+
+
+def test_verify_user_raw(tmp_path, monkeypatch):
+    store = LocalVectorStore(str(tmp_path), dim=3)
+    store.save(verify_user.get_current_user().id, np.array([1, 0, 0], dtype=np.float32))
+
+    async def fake_embed(contents, landmarks=None, aligned=False):
+        assert contents == b"selfie-bytes"
+        return np.array([1, 0, 0], dtype=np.float32)
+
+    monkeypatch.setattr(verify_user, "embed_upload", fake_embed)
+    monkeypatch.setattr(verify_user, "get_vector_store", lambda: store)
+
+    response = client.post(
+        "/api/v1/verify-user/verify_raw", content=b"selfie-bytes", headers={"content-type": "image/jpeg"}
+    )
+    assert response.status_code == 200
+    assert response.json()["similarity"] == 1.0
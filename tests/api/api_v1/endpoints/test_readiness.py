@@ -0,0 +1,29 @@
+import subprocess
+import sys
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+
+client = TestClient(app)
+
+
+def test_liveness():
+    response = client.get("/api/v1/health/live")
+    assert response.status_code == 200
+
+
+def test_not_ready_before_warmup():
+    # без контекст-менеджера startup не вызывается, прогрева не было
+    response = client.get("/api/v1/health/ready")
+    assert response.status_code == 503
+    assert response.json()["ready"] is False
+
+
+def test_app_import_skips_heavy_modules():
+    code = (
+        "import sys, app.main; "
+        "heavy = [m for m in ('insightface', 'pymilvus', 'onnxruntime') if m in sys.modules]; "
+        "assert not heavy, heavy"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
@@ -0,0 +1,41 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.core.metrics import Registry, ServerTimingMiddleware, stage
+from app.main import app
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    hist = registry.histogram("test_seconds", "Test", ["stage"], buckets=(0.1, 1.0))
+    hist.observe(0.05, stage="decode")
+    hist.observe(0.5, stage="decode")
+    hist.observe(5, stage="decode")
+
+    text = registry.render()
+    assert 'test_seconds_bucket{stage="decode",le="0.1"} 1' in text
+    assert 'test_seconds_bucket{stage="decode",le="1"} 2' in text
+    assert 'test_seconds_bucket{stage="decode",le="+Inf"} 3' in text
+    assert 'test_seconds_count{stage="decode"} 3' in text
+
+
+def test_metrics_endpoint_serves_prometheus_text():
+    response = TestClient(app).get("/metrics")
+    assert response.status_code == 200
+    assert "# TYPE face_auth_stage_seconds histogram" in response.text
+    assert "face_auth_inference_queue_depth 0" in response.text
+
+
+def test_server_timing_header_lists_stages():
+    timed = FastAPI()
+    timed.add_middleware(ServerTimingMiddleware)
+
+    @timed.get("/")
+    async def index():
+        with stage("decode"):
+            pass
+        return {}
+
+    header = TestClient(timed).get("/").headers["server-timing"]
+    assert header.startswith("decode;dur=")
+    assert "total;dur=" in header
@@ -0,0 +1,90 @@
+import asyncio
+import time
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.services import admission
+from app.services.admission import AdmissionLimiter, AdmissionMiddleware, AdmissionRoute, DeadlineExceeded, Overloaded
+from app.services.inference import EmbeddingBatcher
+
+
+@pytest.mark.asyncio
+async def test_limiter_rejects_when_queue_full():
+    limiter = AdmissionLimiter("test", max_concurrency=1, max_waiting=1)
+    await limiter.acquire()
+    waiter = asyncio.ensure_future(limiter.acquire())
+    await asyncio.sleep(0)
+    with pytest.raises(Overloaded):
+        await limiter.acquire()
+    limiter.release()
+    await waiter
+    limiter.release()
+
+
+@pytest.mark.asyncio
+async def test_batcher_bounds_queue_and_drops_expired_jobs():
+    batches = []
+
+    def runner(imgs):
+        batches.append(len(imgs))
+        return [np.ones(2) for _ in imgs]
+
+    batcher = EmbeddingBatcher(runner, max_batch_size=4, max_wait_ms=50, max_queue=1)
+    token = admission._deadline.set(time.monotonic() + 0.01)
+    try:
+        first = asyncio.ensure_future(batcher.submit(np.ones((2, 2))))
+        await asyncio.sleep(0)
+        # очередь на одну задачу уже занята
+        with pytest.raises(Overloaded):
+            await batcher.submit(np.ones((2, 2)))
+        # задача ждёт батча дольше своего дедлайна и в модель не попадает
+        with pytest.raises(DeadlineExceeded):
+            await first
+    finally:
+        admission._deadline.reset(token)
+        await batcher.shutdown()
+    assert batches == []
+
+
+@pytest.mark.asyncio
+async def test_overloaded_request_is_rejected_before_body_is_read():
+    calls = []
+
+    async def endpoint(scope, receive, send):
+        calls.append(scope["path"])
+
+    async def receive():
+        calls.append("receive")
+        return {"type": "http.request", "body": b"multipart", "more_body": False}
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    limiter = admission._limiters["test_busy"] = AdmissionLimiter("test_busy", max_concurrency=1, max_waiting=0)
+    middleware = AdmissionMiddleware(endpoint, {"/busy": AdmissionRoute("test_busy", 1, None)})
+    scope = {"type": "http", "method": "POST", "path": "/busy", "headers": []}
+    await limiter.acquire()
+    try:
+        await middleware(scope, receive, send)
+    finally:
+        limiter.release()
+    # ни обработчик, ни чтение тела не запускались
+    assert calls == []
+    assert sent[0]["status"] == 503
+
+    await middleware(scope, receive, send)
+    assert calls == ["/busy"]
+
+
+def test_expired_request_deadline_returns_504():
+    response = TestClient(app).post(
+        "/api/v1/identify/search",
+        files={"selfie_image": ("selfie.jpg", b"jpeg", "image/jpeg")},
+        headers={"X-Request-Timeout-Ms": "0"},
+    )
+    assert response.status_code == 504
@@ -0,0 +1,77 @@
+import io
+import tarfile
+import zipfile
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.services.bulk_import import BulkImporter, Checkpoint, iter_source, read_manifest
+from app.services.local_store import LocalVectorStore
+
+
+def _png(value: int) -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", (8, 8), (value, value, value)).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def _fake_embed(arrays):
+    # «лицо» — всё, кроме чёрного изображения
+    return [
+        np.array([arr.mean(), 1, 0], dtype=np.float32) if arr.mean() > 0 else LookupError("No face detected")
+        for arr in arrays
+    ]
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    files = {f"u{i}/passport.png": _png(i * 10) for i in range(6)}
+    manifest = tmp_path / "manifest.csv"
+    manifest.write_text(
+        "path,user_id\n" + "".join(f"{name},{100 + i}\n" for i, name in enumerate(files)) + "missing.png,999\n"
+    )
+    photos = tmp_path / "photos"
+    for name, data in files.items():
+        (photos / name).parent.mkdir(parents=True, exist_ok=True)
+        (photos / name).write_bytes(data)
+    with zipfile.ZipFile(tmp_path / "photos.zip", "w") as archive:
+        for name, data in files.items():
+            archive.writestr(name, data)
+    with tarfile.open(tmp_path / "photos.tar.gz", "w:gz") as archive:
+        for name, data in reversed(list(files.items())):
+            info = tarfile.TarInfo(f"./{name}")
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return tmp_path, read_manifest(str(manifest))
+
+
+@pytest.mark.parametrize("source", ["photos", "photos.zip", "photos.tar.gz"])
+def test_sources_yield_all_manifest_entries(dataset, source):
+    root, entries = dataset
+    items = list(iter_source(str(root / source), entries))
+    assert sorted(item.entry.index for item in items) == list(range(7))
+    assert [item.entry.user_id for item in items if item.data is None] == [999]
+    # продолжение после чекпоинта: та же последовательность без первых элементов
+    assert list(iter_source(str(root / source), entries, start=3)) == items[3:]
+
+
+def test_import_in_chunks_with_resume(dataset):
+    root, entries = dataset
+    store = LocalVectorStore(str(root / "store"), dim=3)
+    checkpoints = []
+    importer = BulkImporter(
+        store, _fake_embed, "import", decode_workers=2, model_batch=2, chunk_size=3,
+        on_chunk=checkpoints.append, failures_path=str(root / "failures.csv"),
+    )
+    stats = importer.run(iter_source(str(root / "photos.tar.gz"), entries))
+    assert checkpoints[-1] == Checkpoint(position=7, imported=5, failed=2)
+    assert stats["imported_this_run"] == 5
+    assert store.list_users() == {101, 102, 103, 104, 105}
+    assert store.fetch_user(101).sources == ["import"]
+    reasons = sorted(line.split(",")[2] for line in (root / "failures.csv").read_text().splitlines()[1:])
+    assert reasons == ["missing", "no_face"]
+
+    resumed = BulkImporter(store, _fake_embed, "import", decode_workers=1, model_batch=4, chunk_size=3)
+    stats = resumed.run(iter_source(str(root / "photos"), entries, start=6), Checkpoint(6, 5, 1))
+    assert (stats["position"], stats["imported"], stats["failed"]) == (7, 5, 2)
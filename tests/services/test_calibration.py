@@ -0,0 +1,85 @@
+import numpy as np
+
+from app.services.calibration import (
+    HISTOGRAM_BINS,
+    _accumulate,
+    evaluate,
+    export_history,
+    genuine_histogram,
+    impostor_histogram,
+    load_export,
+)
+from app.services.local_store import LocalVectorStore
+
+
+def _export(tmp_path, users: int = 40, per_user: int = 5, dim: int = 8):
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((users, dim))
+    store = LocalVectorStore(str(tmp_path / "store"), dim=dim)
+    for u in range(users):
+        emb = centers[u] + 0.5 * rng.standard_normal((per_user, dim))
+        store.save_many([u] * per_user, (emb / np.linalg.norm(emb, axis=1, keepdims=True)).astype(np.float32), "reauth")
+    store.save(0, np.ones(dim, dtype=np.float32) / np.sqrt(dim), "centroid")
+    store.delete([1])
+    export_history(store.export_rows(batch_size=7), str(tmp_path / "export"), dim)
+    return load_export(str(tmp_path / "export"))
+
+
+def _brute_force(export, rows):
+    emb, users = np.asarray(export.embeddings[rows]), np.asarray(export.user_ids[rows])
+    scores = emb @ emb.T
+    i, j = np.triu_indices(len(rows), k=1)
+    same = users[i] == users[j]
+    genuine, impostor = np.zeros(HISTOGRAM_BINS, dtype=np.int64), np.zeros(HISTOGRAM_BINS, dtype=np.int64)
+    _accumulate(genuine, scores[i, j][same])
+    _accumulate(impostor, scores[i, j][~same])
+    return genuine, impostor
+
+
+def _assert_same_distribution(actual, expected):
+    # блочное умножение может разойтись с полным в последнем бите и сдвинуть пару в соседний бин
+    assert actual.sum() == expected.sum()
+    assert np.abs(np.cumsum(actual) - np.cumsum(expected)).max() <= 2
+
+
+def test_blocked_histograms_match_brute_force(tmp_path):
+    export = _export(tmp_path)
+    assert len(export.user_ids) == 40 * 5
+    assert export.source_names == ["reauth", "centroid"]
+
+    rows = np.flatnonzero(export.sources == 0)
+    genuine, impostor = _brute_force(export, rows)
+    # маленькие блоки и окна: пары пересекают границы блоков и пользователей
+    _assert_same_distribution(genuine_histogram(export, rows, block=16), genuine)
+    _assert_same_distribution(impostor_histogram(export, rows, block=16), impostor)
+    assert genuine.sum() == 40 * 5 * 4 // 2 - 4
+
+
+def test_evaluate_report(tmp_path):
+    export = _export(tmp_path)
+    report = evaluate(export, memory_mb=1, impostor_rows=10_000, exclude_sources=["centroid"], target_fars=[1e-2])
+    assert report["rows"] == 199 and report["users"] == 40
+    assert report["genuine_pairs"] + report["impostor_pairs"] == 199 * 198 // 2
+    (recommended,) = report["recommended"]
+    assert recommended["far"] <= 1e-2
+    # FAR не растёт, FRR не убывает с порогом
+    roc = report["roc"]
+    assert all(a["far"] >= b["far"] and a["frr"] <= b["frr"] for a, b in zip(roc, roc[1:]))
+    assert roc[0]["far"] == 1.0 and roc[0]["frr"] == 0.0
+
+
+def test_histograms_read_one_block_at_a_time(tmp_path):
+    export = _export(tmp_path)
+    reads = []
+
+    class TrackingRows:
+        def __getitem__(self, rows):
+            reads.append(len(rows))
+            return export.embeddings[rows]
+
+    tracked = export._replace(embeddings=TrackingRows())
+    rows = np.flatnonzero(export.sources == 0)
+    genuine_histogram(tracked, rows, block=16)
+    impostor_histogram(tracked, rows, block=16)
+    # из memmap за раз читается не больше блока, а не вся выборка
+    assert reads and max(reads) <= 16
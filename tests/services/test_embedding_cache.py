@@ -0,0 +1,77 @@
+import threading
+
+import numpy as np
+import pytest
+
+from app.services.embedding_cache import EmbeddingCache, cache_key
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_key_depends_on_content():
+    assert cache_key(b"abc") == cache_key(b"abc")
+    assert cache_key(b"abc") != cache_key(b"abd")
+
+
+def test_lru_eviction_and_counters():
+    cache = EmbeddingCache(max_entries=2, ttl_s=60)
+    cache.put("a", np.ones(4))
+    cache.put("b", np.zeros(4))
+    assert cache.get("a") is not None  # "a" становится самым свежим
+    cache.put("c", np.ones(4))
+
+    assert cache.get("b") is None
+    assert cache.get("c") is not None
+    stats = cache.stats()
+    assert stats["size"] == 2
+    assert stats["hits"] == 2 and stats["misses"] == 1
+
+
+def test_ttl_expiry():
+    clock = FakeClock()
+    cache = EmbeddingCache(max_entries=10, ttl_s=5, clock=clock)
+    cache.put("a", np.ones(4))
+    clock.now = 4
+    assert cache.get("a") is not None
+    clock.now = 6
+    assert cache.get("a") is None
+    assert cache.stats()["size"] == 0
+
+
+@pytest.mark.asyncio
+async def test_shared_backend_is_called_off_the_event_loop():
+    loop_thread = threading.get_ident()
+    calls = []
+
+    class FakeRedis:
+        def __init__(self):
+            self.data = {}
+
+        def get(self, key):
+            calls.append(("get", threading.get_ident()))
+            return self.data.get(key)
+
+        def set(self, key, value, ex):
+            calls.append(("set", threading.get_ident()))
+            self.data[key] = value
+
+    shared = FakeRedis()
+    writer = EmbeddingCache(max_entries=10, ttl_s=60)
+    writer._redis = shared
+    await writer.aput("a", np.ones(4))
+
+    reader = EmbeddingCache(max_entries=10, ttl_s=60)
+    reader._redis = shared
+    assert np.array_equal(await reader.aget("a"), np.ones(4))
+    assert await reader.aget("b") is None
+    # второй раз — из локального LRU, без Redis
+    assert await reader.aget("a") is not None
+    assert [name for name, _ in calls] == ["set", "get", "get"]
+    assert all(thread != loop_thread for _, thread in calls)
+    assert reader.stats()["shared_hits"] == 1 and reader.stats()["hits"] == 1
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+from insightface.utils.face_align import arcface_dst
+
+from app.services import face_analysis
+from app.services.face_analysis import FaceInput, InvalidFaceInput, check_landmarks, get_embeddings
+
+
+class _NoDetector:
+    def detect(self, img, max_num=0, metric="default"):
+        raise AssertionError("detector must not run for client-supplied faces")
+
+
+class _Recognizer:
+    input_size = (112, 112)
+
+    def get_feat(self, imgs):
+        return np.stack([np.asarray(img, dtype=np.float32).mean(axis=(0, 1)) + 1 for img in imgs])
+
+
+@pytest.fixture
+def no_detector(monkeypatch):
+    pipeline = face_analysis.FacePipeline({"detection": _NoDetector(), "recognition": _Recognizer()})
+    monkeypatch.setattr(face_analysis, "_face_analyzer", pipeline)
+
+
+def test_plausible_landmarks_pass():
+    # шаблон ArcFace, увеличенный и сдвинутый, с лёгким поворотом головы
+    points = arcface_dst * 3 + 100
+    points[2, 0] += 20
+    check_landmarks(points, (640, 640, 3))
+
+
+@pytest.mark.parametrize(
+    "points",
+    [
+        arcface_dst[[1, 0, 2, 4, 3]] * 3 + 100,  # перепутаны левая и правая стороны
+        np.random.default_rng(0).uniform(0, 400, (5, 2)),
+        arcface_dst * 0.2,  # слишком маленькое лицо
+        arcface_dst * 3 + 600,  # за пределами кадра
+    ],
+)
+def test_implausible_landmarks_rejected(points):
+    with pytest.raises(InvalidFaceInput):
+        check_landmarks(points, (640, 640, 3))
+
+
+def test_client_faces_skip_detector(no_detector):
+    frame = np.full((480, 480, 3), 128, dtype=np.uint8)
+    results = get_embeddings([
+        FaceInput(np.zeros((112, 112, 3), dtype=np.uint8)),
+        FaceInput(frame, arcface_dst * 3 + 50),
+        FaceInput(np.zeros((100, 100, 3), dtype=np.uint8)),
+    ])
+    assert results[0].shape == (3,)
+    assert results[1].shape == (3,)
+    assert isinstance(results[2], InvalidFaceInput)
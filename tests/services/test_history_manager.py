@@ -0,0 +1,142 @@
+import time
+
+import numpy as np
+import pytest
+
+from app.services import history_manager
+from app.services.history_manager import CENTROID_SOURCE, HistoryCompactor, plan_compaction, read_compaction_status
+from app.services.local_store import LocalVectorStore
+from app.services.vector_store import UserRecords
+
+DAY_MS = 86400 * 1000
+
+
+def _records(vectors, created_at, sources):
+    embeddings = np.asarray(vectors, dtype=np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return UserRecords(
+        ids=np.arange(len(vectors), dtype=np.int64),
+        embeddings=embeddings,
+        created_at=np.asarray(created_at, dtype=np.int64),
+        sources=list(sources),
+    )
+
+
+def test_expired_samples_dropped_and_centroid_written():
+    now = 100 * DAY_MS
+    records = _records(
+        [[1, 0, 0], [1, 0.1, 0], [0.9, 0, 0.1]],
+        [now - 50 * DAY_MS, now - DAY_MS, now],
+        ["signup", "reauth", "reauth"],
+    )
+    plan = plan_compaction(records, max_templates=5, max_age_ms=30 * DAY_MS, now_ms=now)
+    assert plan.delete_ids == [0]
+    assert plan.centroid is not None
+    assert np.isclose(np.linalg.norm(plan.centroid), 1.0)
+
+
+def test_keeps_newest_and_most_diverse_within_budget():
+    now = 10 * DAY_MS
+    vectors = [[1, 0.01 * i, 0] for i in range(6)] + [[0, 1, 0]]
+    records = _records(vectors, [now - i for i in range(7)], ["reauth"] * 7)
+    plan = plan_compaction(records, max_templates=3, max_age_ms=None, now_ms=now)
+    kept = set(range(7)) - set(plan.delete_ids)
+    # центроид + 2 образца: самый свежий и самый непохожий
+    assert kept == {0, 6}
+
+
+def test_up_to_date_history_untouched():
+    now = DAY_MS
+    records = _records(
+        [[1, 0, 0], [0, 1, 0], [1, 1, 0]],
+        [now - 2, now - 1, now],
+        ["signup", "reauth", CENTROID_SOURCE],
+    )
+    plan = plan_compaction(records, max_templates=5, max_age_ms=None, now_ms=now)
+    assert plan == ([], None)
+
+
+def test_local_store_delete_hides_rows(tmp_path):
+    store = LocalVectorStore(str(tmp_path), dim=3)
+    store.save(1, np.array([1, 0, 0], dtype=np.float32))
+    store.save(2, np.array([0.9, 0.1, 0], dtype=np.float32))
+    store.delete([0])
+
+    assert store.list_users() == {2}
+    assert [h.user_id for h in store.identify(np.array([1, 0, 0], dtype=np.float32), top_k=2)] == [2]
+    store.close()
+    assert LocalVectorStore(str(tmp_path), dim=3).list_users() == {2}
+
+
+class _RecordingStore:
+    def __init__(self, records, fail_insert=False):
+        self.records = records
+        self.fail_insert = fail_insert
+        self.calls = []
+
+    def fetch_user(self, user_id):
+        return self.records
+
+    def save(self, user_id, embedding, source="reauth"):
+        self.calls.append("save")
+
+    def save_many(self, user_ids, embeddings, source):
+        if self.fail_insert:
+            raise ConnectionError("insert timed out")
+        self.calls.append(("save_many", source))
+
+    def delete(self, ids):
+        self.calls.append(("delete", list(ids)))
+
+
+def test_compaction_deletes_only_after_centroid_insert(monkeypatch):
+    now = int(time.time() * 1000)
+    records = _records([[1, 0, 0], [1, 0.1, 0], [0.9, 0, 0.1]], [0, now - 1, now], ["signup", "reauth", "reauth"])
+    compactor = HistoryCompactor(interval_s=60, sweep_interval_s=3600, max_templates=5, max_age_ms=30 * DAY_MS)
+
+    store = _RecordingStore(records)
+    monkeypatch.setattr(history_manager, "get_vector_store", lambda: store)
+    compactor.compact_user(1)
+    assert store.calls == [("save_many", CENTROID_SOURCE), ("delete", [0])]
+
+    store = _RecordingStore(records, fail_insert=True)
+    monkeypatch.setattr(history_manager, "get_vector_store", lambda: store)
+    with pytest.raises(ConnectionError):
+        compactor.compact_user(1)
+    assert store.calls == []
+
+
+def test_compaction_pass_picks_users_with_recent_rows(tmp_path, monkeypatch):
+    store = LocalVectorStore(str(tmp_path), dim=3)
+    store.save(1, np.array([1, 0, 0], dtype=np.float32))
+    time.sleep(0.01)
+    since = int(time.time() * 1000)
+    store.save(2, np.array([0, 1, 0], dtype=np.float32))
+    store.save(2, np.array([0, 1, 0.2], dtype=np.float32))
+    assert store.users_since(since) == {2}
+
+    compacted = []
+    compactor = HistoryCompactor(interval_s=60, sweep_interval_s=3600, max_templates=5, max_age_ms=None)
+    monkeypatch.setattr(history_manager, "get_vector_store", lambda: store)
+    monkeypatch.setattr(compactor, "compact_user", compacted.append)
+    compactor.run_once(since_ms=since)
+    assert compacted == [2]
+    compactor.run_once(sweep=True)
+    assert sorted(compacted[1:]) == [1, 2]
+
+
+def test_compaction_pass_writes_status_file(tmp_path, monkeypatch):
+    status_path = str(tmp_path / "status" / "compaction.json")
+    assert read_compaction_status(status_path) is None
+    store = LocalVectorStore(str(tmp_path / "store"), dim=3)
+    store.save(1, np.array([1, 0, 0], dtype=np.float32))
+    compactor = HistoryCompactor(
+        interval_s=60, sweep_interval_s=3600, max_templates=5, max_age_ms=None, status_path=status_path
+    )
+    monkeypatch.setattr(history_manager, "get_vector_store", lambda: store)
+    monkeypatch.setattr(compactor, "compact_user", lambda user_id: None)
+
+    compactor.run_once(sweep=True)
+    status = read_compaction_status(status_path)
+    assert status["running"] is False and status["failures"] == 0
+    assert status["last_sweep_ms"] == status["last_pass_ms"] is not None
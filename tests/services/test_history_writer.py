@@ -0,0 +1,124 @@
+import os
+import threading
+
+import numpy as np
+
+from app.services.history_writer import HistoryRow, HistoryWriter
+
+
+def _row(user_id: int) -> HistoryRow:
+    return HistoryRow(user_id=user_id, embedding=np.full(4, user_id, dtype=np.float32), created_at=0, source="test")
+
+
+class FakeSink:
+    def __init__(self, fail: bool = False):
+        self.batches = []
+        self.fail = fail
+        self.event = threading.Event()
+
+    def __call__(self, rows):
+        if self.fail:
+            raise ConnectionError("milvus is down")
+        self.batches.append([r.user_id for r in rows])
+        self.event.set()
+
+
+def test_rows_are_inserted_in_batches():
+    sink = FakeSink()
+    writer = HistoryWriter(sink, batch_size=3, flush_interval_ms=10_000, max_buffer=100)
+    writer.start()
+    for i in range(3):
+        writer.put(_row(i))
+    assert sink.event.wait(2)
+    writer.stop()
+    assert sink.batches == [[0, 1, 2]]
+
+
+def test_interval_flush_and_drain_on_stop():
+    sink = FakeSink()
+    writer = HistoryWriter(sink, batch_size=100, flush_interval_ms=20, max_buffer=100)
+    writer.start()
+    writer.put(_row(1))
+    assert sink.event.wait(2)
+    writer.put(_row(2))
+    writer.stop()
+    assert sink.batches == [[1], [2]]
+
+
+def test_spool_survives_failed_inserts(tmp_path):
+    spool = str(tmp_path / "spool")
+    writer = HistoryWriter(FakeSink(fail=True), batch_size=10, flush_interval_ms=10, max_buffer=100, spool_dir=spool)
+    writer.start()
+    writer.put(_row(1))
+    writer.put(_row(2))
+    writer.stop()
+    assert os.listdir(spool)
+
+    sink = FakeSink()
+    writer = HistoryWriter(sink, batch_size=10, flush_interval_ms=10, max_buffer=100, spool_dir=spool)
+    writer.start()
+    assert sink.event.wait(2)
+    writer.stop()
+    assert sink.batches == [[1, 2]]
+    assert all(os.path.getsize(os.path.join(spool, f)) == 0 for f in os.listdir(spool))
+
+
+def test_replay_skips_rows_inserted_before_crash(tmp_path):
+    spool = str(tmp_path / "spool")
+    sink = FakeSink()
+    writer = HistoryWriter(
+        sink, batch_size=2, flush_interval_ms=10_000, max_buffer=100, spool_dir=spool, segment_rows=3
+    )
+    writer.start()
+    for i in range(4):
+        writer.put(_row(i))
+    while writer.stats()["inserted"] < 4:
+        assert sink.event.wait(2)
+        sink.event.clear()
+    # строка 4 попадает в журнал, но вставка падает: второй сегмент вставлен частично
+    sink.fail = True
+    writer.put(_row(4))
+    writer.stop()
+
+    sink = FakeSink()
+    writer = HistoryWriter(sink, batch_size=10, flush_interval_ms=10, max_buffer=100, spool_dir=spool)
+    writer.start()
+    assert sink.event.wait(2)
+    writer.stop()
+    assert sink.batches == [[4]]
+    assert all(os.path.getsize(os.path.join(spool, f)) == 0 for f in os.listdir(spool))
+
+
+def test_stop_timeout_during_insert_keeps_spool_consistent(tmp_path):
+    spool = str(tmp_path / "spool")
+    entered, release = threading.Event(), threading.Event()
+    errors = []
+
+    def slow_sink(rows):
+        entered.set()
+        release.wait(5)
+
+    writer = HistoryWriter(slow_sink, batch_size=1, flush_interval_ms=0, max_buffer=10, spool_dir=spool)
+    original_release = writer._release
+
+    def tracking_release(batch):
+        try:
+            original_release(batch)
+        except Exception as e:
+            errors.append(e)
+            raise
+
+    writer._release = tracking_release
+    writer.start()
+    writer.put(_row(1))
+    assert entered.wait(2)
+    # вставка висит дольше таймаута остановки
+    writer.stop(timeout=0.05)
+    thread = writer._thread
+    assert thread is not None and thread.is_alive()
+    release.set()
+    thread.join(2)
+    assert not thread.is_alive() and errors == []
+    # вставленная строка учтена в журнале: при следующем старте повторять нечего
+    assert writer._segment_file is None
+    assert os.path.getsize(os.path.join(spool, "segment-00000000.jsonl")) == 0
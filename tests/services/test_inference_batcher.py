@@ -0,0 +1,41 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from app.services.inference import EmbeddingBatcher
+
+
+@pytest.mark.asyncio
+async def test_concurrent_jobs_are_batched():
+    batches = []
+
+    def runner(imgs):
+        batches.append(len(imgs))
+        return [np.full(4, img.sum()) if img.sum() else LookupError("No face detected") for img in imgs]
+
+    batcher = EmbeddingBatcher(runner, max_batch_size=8, max_wait_ms=20)
+    imgs = [np.full((2, 2), i, dtype=np.float32) for i in range(1, 6)]
+    results = await asyncio.gather(*(batcher.submit(img) for img in imgs))
+    await batcher.shutdown()
+
+    assert batches == [5]
+    assert [float(r[0]) for r in results] == [4.0 * i for i in range(1, 6)]
+
+
+@pytest.mark.asyncio
+async def test_batch_size_limit_and_errors():
+    batches = []
+
+    def runner(imgs):
+        batches.append(len(imgs))
+        return [np.ones(4) if img.sum() else LookupError("No face detected") for img in imgs]
+
+    batcher = EmbeddingBatcher(runner, max_batch_size=2, max_wait_ms=20)
+    imgs = [np.ones((2, 2)), np.zeros((2, 2)), np.ones((2, 2))]
+    results = await asyncio.gather(*(batcher.submit(img) for img in imgs), return_exceptions=True)
+    await batcher.shutdown()
+
+    assert batches == [2, 1]
+    assert isinstance(results[1], LookupError)
+    assert not isinstance(results[0], Exception) and not isinstance(results[2], Exception)
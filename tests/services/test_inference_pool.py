@@ -0,0 +1,54 @@
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+
+from app.services import inference_pool
+from app.services.face_analysis import FaceInput
+from app.services.inference_pool import InferencePool
+
+
+def _stub_embeddings(items):
+    # сумма пикселей и сумма точек: по ним видно, какой вход пришёл на какое место
+    return [
+        np.array([float(item.image.sum()), float(item.landmarks.sum())])
+        if isinstance(item, FaceInput)
+        else np.array([float(item.sum()), -1.0])
+        for item in items
+    ]
+
+
+def _init_stub_worker():
+    # воркер без моделей: вместо детекции и ArcFace — заглушка
+    inference_pool.get_embeddings = _stub_embeddings
+
+
+def test_embed_batch_via_shared_memory(monkeypatch):
+    shared = []
+    original_share = inference_pool._share_array
+
+    def tracking_share(arr):
+        shm, spec = original_share(arr)
+        shared.append(spec[0])
+        return shm, spec
+
+    monkeypatch.setattr(inference_pool, "_share_array", tracking_share)
+    pool = InferencePool(1)
+    pool._executor.shutdown()
+    pool._executor = ProcessPoolExecutor(
+        max_workers=1, mp_context=mp.get_context("spawn"), initializer=_init_stub_worker
+    )
+    try:
+        frame = np.full((4, 4, 3), 2, dtype=np.uint8)
+        crop = FaceInput(np.ones((2, 2, 3), dtype=np.uint8), np.arange(10, dtype=np.float32).reshape(5, 2))
+        results = pool.embed_batch([frame, crop, frame[:2]])
+    finally:
+        pool.shutdown()
+
+    assert [r.tolist() for r in results] == [[96.0, -1.0], [12.0, 45.0], [48.0, -1.0]]
+    assert len(shared) == 3
+    for name in shared:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
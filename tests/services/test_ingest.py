@@ -0,0 +1,52 @@
+import io
+
+import numpy as np
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from app.main import app
+from app.services.ingest import decode_image
+
+
+def _jpeg(width, height):
+    buf = io.BytesIO()
+    Image.new("RGB", (width, height), (120, 90, 60)).save(buf, format="JPEG")
+    return buf.getvalue()
+
+
+def test_large_jpeg_decoded_at_reduced_scale():
+    img = decode_image(_jpeg(4000, 3000), max_side=960)
+    # draft 1/4: наименьший масштаб, у которого длинная сторона не меньше 960
+    assert img.shape == (750, 1000, 3)
+    assert img.dtype == np.uint8
+
+
+def test_small_and_non_jpeg_images():
+    assert decode_image(_jpeg(640, 480), max_side=960).shape == (480, 640, 3)
+    buf = io.BytesIO()
+    Image.new("L", (3000, 1000)).save(buf, format="PNG")
+    assert decode_image(buf.getvalue(), max_side=960).shape == (320, 960, 3)
+
+
+def test_oversized_request_rejected_before_parsing():
+    response = TestClient(app).post(
+        "/api/v1/verify-user/verify",
+        files={"selfie_image": ("selfie.jpg", b"x" * (13 * 1024 * 1024), "image/jpeg")},
+    )
+    assert response.status_code == 413
+
+
+def test_chunked_request_cut_off_at_limit():
+    def body():
+        # без Content-Length: тело идёт chunked и считается по мере получения
+        yield b'--b\r\nContent-Disposition: form-data; name="passport_image"; filename="p.jpg"\r\n\r\n'
+        for _ in range(20):
+            yield b"x" * (1024 * 1024)
+
+    response = TestClient(app).post(
+        "/api/v1/verify-identity/verify_identity",
+        content=body(),
+        headers={"Content-Type": "multipart/form-data; boundary=b"},
+    )
+    assert response.status_code == 413
+    assert response.json() == {"detail": "Request body too large"}
@@ -0,0 +1,84 @@
+import numpy as np
+
+from app.services.local_store import LocalVectorStore
+from app.services.vector_store import HistorySummary, UserRecords, score_records, summarize_history
+
+
+def _unit(vec):
+    vec = np.asarray(vec, dtype=np.float32)
+    return vec / np.linalg.norm(vec)
+
+
+def test_search_user_scores_only_that_user(tmp_path):
+    store = LocalVectorStore(str(tmp_path), dim=3, initial_capacity=2)
+    store.save(1, _unit([1, 0, 0]), source="signup")
+    store.save(1, _unit([1, 1, 0]), source="reauth")
+    store.save(2, _unit([1, 0, 0]), source="signup")
+
+    hits = store.search_user(_unit([1, 0, 0]), user_id=1, top_k=3)
+    assert [h.user_id for h in hits] == [1, 1]
+    assert hits[0].score == np.float32(1.0)
+    assert hits[0].source == "signup"
+    assert store.search_user(_unit([1, 0, 0]), user_id=3) == []
+
+
+def test_identify_groups_by_user(tmp_path):
+    store = LocalVectorStore(str(tmp_path), dim=3)
+    for _ in range(5):
+        store.save(1, _unit([1, 0.01, 0]))
+    store.save(2, _unit([1, 0.2, 0]))
+    store.save(3, _unit([0, 0, 1]))
+
+    hits = store.identify(_unit([1, 0, 0]), top_k=2)
+    assert [h.user_id for h in hits] == [1, 2]
+
+
+def test_reopen_restores_rows_and_stats(tmp_path):
+    store = LocalVectorStore(str(tmp_path), dim=3, initial_capacity=1)
+    store.save(7, _unit([0, 1, 0]), source="signup")
+    store.save(7, _unit([0, 1, 1]), source="reauth")
+    store.close()
+
+    reopened = LocalVectorStore(str(tmp_path), dim=3)
+    stats = reopened.history_stats(7)
+    assert stats["total"] == 2
+    assert stats["by_source"] == {"signup": 1, "reauth": 1}
+    assert reopened.search_user(_unit([0, 1, 0]), user_id=7, top_k=1)[0].source == "signup"
+
+
+def test_score_records_is_exact_over_user_rows():
+    records = UserRecords(
+        ids=np.array([10, 11, 12], dtype=np.int64),
+        embeddings=np.stack([_unit([1, 0, 0]), _unit([0, 1, 0]), _unit([1, 1, 0])]),
+        created_at=np.array([1, 2, 3], dtype=np.int64),
+        sources=["signup", "reauth", "reauth"],
+    )
+    hits = score_records(records, 5, np.array([2, 0, 0], dtype=np.float32), top_k=2)
+    assert [h.id for h in hits] == [10, 12]
+    assert hits[0].score == np.float32(1.0)
+    assert all(h.user_id == 5 for h in hits)
+
+
+def test_history_summary_by_pages_matches_full_scan():
+    rng = np.random.default_rng(0)
+    created = rng.integers(0, 50, size=37).tolist()
+    sources = [["signup", "reauth", "centroid"][i % 3] for i in range(37)]
+    summary = HistorySummary()
+    for start in range(0, 37, 5):
+        summary.add(created[start:start + 5], sources[start:start + 5])
+    assert summary.result() == summarize_history(created, sources)
+
+
+def test_history_records_cursor_pages(tmp_path):
+    store = LocalVectorStore(str(tmp_path), dim=3)
+    for i in range(7):
+        store.save(1 if i != 3 else 2, _unit([1, i, 0]), source="reauth")
+    store.delete([4])
+
+    page, cursor = store.history_records(1, None, limit=2)
+    ids = [r["id"] for r in page]
+    while cursor is not None:
+        page, cursor = store.history_records(1, cursor, limit=2)
+        ids += [r["id"] for r in page]
+    assert ids == [0, 1, 2, 5, 6]
+    assert store.history_records(9, None, limit=2) == ([], None)
@@ -0,0 +1,89 @@
+import threading
+
+import pytest
+from pymilvus.exceptions import MilvusUnavailableException
+
+from app.services.milvus_pool import MilvusPool
+
+
+def _pool(size=2, max_retries=2):
+    connected = []
+    pool = MilvusPool(size=size, connect=connected.append, max_retries=max_retries, backoff_ms=0)
+    # без реального Milvus: вместо Collection отдаём alias, на котором выполняется вызов
+    pool.collection = lambda alias, name: alias
+    return pool, connected
+
+
+def test_reconnects_and_retries_on_unavailable():
+    pool, connected = _pool()
+    calls = []
+
+    def flaky(alias):
+        calls.append(alias)
+        if len(calls) == 1:
+            raise MilvusUnavailableException(message="connection reset")
+        return "ok"
+
+    assert pool.run("history", flaky) == "ok"
+    stats = pool.stats()
+    assert stats["errors"] == 1 and stats["reconnects"] == 1
+    assert stats["in_use"] == 0 and stats["idle"] == 2
+    assert len(connected) == 2
+
+
+def test_gives_up_after_max_retries():
+    pool, _ = _pool(max_retries=1)
+
+    def down(alias):
+        raise MilvusUnavailableException(message="down")
+
+    with pytest.raises(MilvusUnavailableException):
+        pool.run("history", down)
+    assert pool.stats()["errors"] == 2
+
+
+def test_connection_is_exclusive():
+    pool, _ = _pool(size=1)
+    entered = threading.Event()
+    release = threading.Event()
+
+    def slow(alias):
+        entered.set()
+        release.wait(2)
+        return alias
+
+    worker = threading.Thread(target=pool.run, args=("history", slow))
+    worker.start()
+    assert entered.wait(2)
+    assert pool.stats()["idle"] == 0
+    release.set()
+    worker.join()
+    assert pool.run("history", lambda alias: alias) == "face_auth_0"
+    assert pool.stats()["idle"] == 1
+
+
+def test_non_idempotent_call_is_not_resent():
+    pool, _ = _pool()
+    calls = []
+
+    def insert(alias):
+        calls.append(alias)
+        raise MilvusUnavailableException(message="deadline exceeded")
+
+    with pytest.raises(MilvusUnavailableException):
+        pool.run("history", insert, idempotent=False)
+    assert len(calls) == 1
+
+
+def test_non_idempotent_call_retries_failed_connect():
+    attempts = []
+
+    def connect(alias):
+        attempts.append(alias)
+        if len(attempts) == 1:
+            raise ConnectionError("refused")
+
+    pool = MilvusPool(size=1, connect=connect, max_retries=2, backoff_ms=0)
+    pool.collection = lambda alias, name: alias
+    assert pool.run("history", lambda alias: "inserted", idempotent=False) == "inserted"
+    assert len(attempts) == 2
@@ -0,0 +1,93 @@
+import os
+
+import onnx
+import onnxruntime as ort
+import pytest
+from onnx import TensorProto, helper
+
+from app.services import face_analysis
+
+
+def _save_model(path, input_size, outputs=1, output_dim=512):
+    # граф-заглушка: Identity со входа на каждый выход, важны только формы
+    inp = helper.make_tensor_value_info("input", TensorProto.FLOAT, [1, 3, input_size, input_size])
+    outs = [helper.make_tensor_value_info(f"out{i}", TensorProto.FLOAT, [1, output_dim]) for i in range(outputs)]
+    nodes = [helper.make_node("Identity", ["input"], [f"out{i}"]) for i in range(outputs)]
+    graph = helper.make_graph(nodes, "stub", [inp], outs)
+    # IR и opset, которые понимает любой поддерживаемый onnxruntime
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 7
+    onnx.save(model, str(path))
+
+
+@pytest.fixture
+def model_pack(tmp_path):
+    _save_model(tmp_path / "det_10g.onnx", 640, outputs=9)
+    _save_model(tmp_path / "w600k_r50.onnx", 112)
+    _save_model(tmp_path / "1k3d68.onnx", 192, output_dim=3309)
+    _save_model(tmp_path / "2d106det.onnx", 192, output_dim=212)
+    _save_model(tmp_path / "genderage.onnx", 96, output_dim=3)
+    return tmp_path
+
+
+class _StubModel:
+    def __init__(self, taskname):
+        self.taskname = taskname
+
+
+def _stub_router(sessions):
+    class StubRouter:
+        def __init__(self, onnx_file):
+            self.onnx_file = onnx_file
+
+        def get_model(self, **kwargs):
+            sessions.append(os.path.basename(self.onnx_file))
+            return _StubModel(face_analysis._model_task(self.onnx_file))
+
+    return StubRouter
+
+
+def test_model_task_matches_model_router_rules(model_pack):
+    tasks = {name: face_analysis._model_task(str(model_pack / name)) for name in sorted(os.listdir(model_pack))}
+    assert tasks == {
+        "1k3d68.onnx": "landmark_3d_68",
+        "2d106det.onnx": "landmark_2d_106",
+        "det_10g.onnx": "detection",
+        "genderage.onnx": "genderage",
+        "w600k_r50.onnx": "recognition",
+    }
+
+
+def test_only_allowed_modules_get_sessions(model_pack, tmp_path_factory, monkeypatch):
+    sessions = []
+    monkeypatch.setattr("insightface.model_zoo.model_zoo.ModelRouter", _stub_router(sessions))
+    monkeypatch.setattr("insightface.utils.ensure_available", lambda *args, **kwargs: str(model_pack))
+    monkeypatch.setattr(face_analysis.settings, "FACE_ALLOWED_MODULES", ["detection", "recognition"])
+    monkeypatch.setattr(face_analysis.settings, "ONNX_OPTIMIZED_MODEL_DIR", None)
+
+    models = face_analysis._load_models()
+    assert sorted(models) == ["detection", "recognition"]
+    assert sorted(sessions) == ["det_10g.onnx", "w600k_r50.onnx"]
+
+    # оптимизируются и пишутся на диск тоже только нужные модули
+    cache_root = tmp_path_factory.mktemp("optimized")
+    monkeypatch.setattr(face_analysis.settings, "ONNX_OPTIMIZED_MODEL_DIR", str(cache_root))
+    sessions.clear()
+    face_analysis._load_models()
+    (cache_dir,) = os.listdir(cache_root)
+    assert sorted(os.listdir(cache_root / cache_dir)) == ["det_10g.onnx", "w600k_r50.onnx"]
+    assert sorted(sessions) == ["det_10g.onnx", "w600k_r50.onnx"]
+
+
+def test_pipeline_requires_detection_and_recognition():
+    with pytest.raises(RuntimeError, match="recognition"):
+        face_analysis.FacePipeline({"detection": _StubModel("detection")})
+
+
+def test_session_options(monkeypatch):
+    monkeypatch.setattr(face_analysis.settings, "ONNX_INTRA_OP_THREADS", 2)
+    monkeypatch.setattr(face_analysis.settings, "ONNX_INTER_OP_THREADS", 0)
+    options = face_analysis._session_options("basic")
+    assert options.intra_op_num_threads == 2
+    assert options.inter_op_num_threads == 0
+    assert options.graph_optimization_level == ort.GraphOptimizationLevel.ORT_ENABLE_BASIC
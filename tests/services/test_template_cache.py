@@ -0,0 +1,73 @@
+import numpy as np
+
+from app.services.template_cache import PENDING_ID, TemplateCache
+from app.services.vector_store import UserRecords, score_records
+
+
+def _records(ids, dim=4):
+    ids = np.asarray(ids, dtype=np.int64)
+    embeddings = np.eye(dim, dtype=np.float32)[: len(ids)]
+    return UserRecords(ids, embeddings, np.arange(len(ids), dtype=np.int64), ["signup"] * len(ids))
+
+
+def test_read_through_and_write_updates():
+    cache = TemplateCache(max_bytes=1 << 20, ttl_s=60)
+    assert cache.get(1) is None
+    cache.put(1, _records([10, 11]), cache.version())
+    assert cache.get(1).ids.tolist() == [10, 11]
+
+    # новая строка видна сразу, до вставки в хранилище
+    cache.append(1, np.array([0, 0, 1, 0], dtype=np.float32), "reauth", 5)
+    records = cache.get(1)
+    assert records.ids.tolist() == [10, 11, PENDING_ID]
+    assert score_records(records, 1, np.array([0, 0, 1, 0]), 1)[0].source == "reauth"
+
+    # удаление при строке, ещё не вернувшейся из хранилища, сбрасывает пользователя
+    cache.remove_ids([10])
+    assert cache.get(1) is None
+
+    cache.put(2, _records([20, 21]))
+    cache.remove_ids([20])
+    assert cache.get(2).ids.tolist() == [21]
+    assert cache.stats()["hits"] == 3
+
+
+def test_stale_read_not_cached():
+    cache = TemplateCache(max_bytes=1 << 20, ttl_s=60)
+    version = cache.version()
+    # пока шло чтение из хранилища, пользователю записали строку
+    cache.append(1, np.ones(4, dtype=np.float32), "reauth", 1)
+    cache.put(1, _records([10]), version)
+    assert cache.get(1) is None
+
+
+def test_bounded_by_bytes_and_ttl():
+    now = [0.0]
+    size = TemplateCache(1 << 20, 60)
+    size.put(0, _records([1]))
+    one = size.stats()["bytes"]
+
+    cache = TemplateCache(max_bytes=one * 2, ttl_s=10, clock=lambda: now[0])
+    for user_id in range(3):
+        cache.put(user_id, _records([user_id]))
+    assert cache.get(0) is None
+    assert cache.stats()["bytes"] <= one * 2
+
+    now[0] = 11
+    assert cache.get(2) is None
+
+
+def test_write_tracking_is_bounded():
+    cache = TemplateCache(max_bytes=1 << 20, ttl_s=60, max_tracked_writes=8)
+    version = cache.version()
+    for user_id in range(100):
+        cache.invalidate(user_id)
+    assert len(cache._written) <= 8
+    # чтение началось до сброса учёта записей — результат не кладётся
+    cache.put(1, _records([10]), version)
+    assert cache.get(1) is None
+    # запись в другого пользователя свежему чтению не мешает
+    version = cache.version()
+    cache.invalidate(2)
+    cache.put(1, _records([10]), version)
+    assert cache.get(1).ids.tolist() == [10]
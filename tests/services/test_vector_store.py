@@ -0,0 +1,104 @@
+import numpy as np
+
+from app.core.config import settings
+from app.services.vector_store import Hit, MilvusVectorStore, UserRecords, rerank
+
+
+def _records(n: int) -> UserRecords:
+    return UserRecords(
+        ids=np.arange(n, dtype=np.int64),
+        embeddings=np.eye(n, dtype=np.float32),
+        # строки в произвольном порядке, как их отдаёт query
+        created_at=np.array([(i * 7) % n for i in range(n)], dtype=np.int64),
+        sources=[f"s{i}" for i in range(n)],
+    )
+
+
+def test_exact_mode_scores_newest_rows_when_over_limit(monkeypatch):
+    store = MilvusVectorStore()
+    monkeypatch.setattr(store, "fetch_user", lambda user_id: _records(10))
+    monkeypatch.setattr(settings, "HISTORY_EXACT_MAX_ROWS", 4)
+
+    records = store._exact_records(1)
+    assert sorted(records.created_at.tolist()) == [6, 7, 8, 9]
+    assert all(records.sources[i] == f"s{records.ids[i]}" for i in range(4))
+    assert np.array_equal(records.embeddings, np.eye(10, dtype=np.float32)[records.ids])
+
+
+def test_milvus_identify_widens_candidates_until_top_k_users(monkeypatch):
+    # у пользователя 1 много почти одинаковых шаблонов, остальные — дальше
+    gallery = [Hit(id=i, user_id=1, score=0.9 - i * 1e-3) for i in range(30)]
+    gallery += [Hit(id=100 + u, user_id=u, score=0.5 - u * 1e-2) for u in (2, 3)]
+    limits = []
+
+    def fake_search(embedding, top_k, user_id=None):
+        limits.append(top_k)
+        return gallery[:top_k]
+
+    store = MilvusVectorStore()
+    monkeypatch.setattr(store, "_search", fake_search)
+    monkeypatch.setattr(settings, "IDENTIFY_OVERSAMPLE", 4)
+
+    hits = store.identify(np.ones(3, dtype=np.float32), top_k=3)
+    assert [h.user_id for h in hits] == [1, 2, 3]
+    assert limits == [12, 24, 48]
+    # кандидатов меньше, чем просили: коллекция исчерпана, расширять дальше нечего
+    assert [h.user_id for h in store.identify(np.ones(3, dtype=np.float32), top_k=5)] == [1, 2, 3]
+
+
+def test_hnsw_ef_raised_to_search_limit(monkeypatch):
+    from app.services import milvus
+
+    searches = []
+
+    class FakeCollection:
+        def search(self, data, anns_field, param, limit, **kwargs):
+            searches.append((limit, param["params"]))
+            return [[]]
+
+    class FakePool:
+        def run(self, name, fn, idempotent=True):
+            return fn(FakeCollection())
+
+    monkeypatch.setattr(milvus, "get_milvus_pool", lambda: FakePool())
+    monkeypatch.setattr(settings, "MILVUS_INDEX_TYPE", "HNSW")
+    monkeypatch.setattr(settings, "MILVUS_SEARCH_PARAMS", {"ef": 64})
+    monkeypatch.setattr(settings, "MILVUS_RERANK_FACTOR", 0)
+
+    store = MilvusVectorStore()
+    store._search(np.ones(3, dtype=np.float32), 10)
+    store._search(np.ones(3, dtype=np.float32), 200)
+    assert searches == [(10, {"ef": 64}), (200, {"ef": 200})]
+    assert settings.MILVUS_SEARCH_PARAMS == {"ef": 64}
+
+
+def test_milvus_history_stats_stops_at_max_rows(monkeypatch):
+    from app.services import milvus
+
+    pages_read, closed = [], []
+
+    def fake_pages(user_id, output_fields, batch_size):
+        try:
+            for start in range(0, 30, 3):
+                pages_read.append(start)
+                yield [{"created_at": start + i, "source": "reauth"} for i in range(3)]
+        finally:
+            closed.append(True)
+
+    monkeypatch.setattr(milvus, "iter_user_history", fake_pages)
+    monkeypatch.setattr(settings, "HISTORY_STATS_MAX_ROWS", 5)
+    stats = MilvusVectorStore().history_stats(1)
+    assert stats["total"] == 5 and stats["truncated"] is True
+    # остальные страницы не читаются, итератор (и соединение) освобождается сразу
+    assert pages_read == [0, 3] and closed == [True]
+
+    monkeypatch.setattr(settings, "HISTORY_STATS_MAX_ROWS", 100)
+    assert MilvusVectorStore().history_stats(1)["truncated"] is False
+
+
+def test_rerank_rescores_candidates_exactly():
+    # приближённые score из квантованного индекса перепутали порядок
+    hits = [Hit(id=1, user_id=10, score=0.9), Hit(id=2, user_id=20, score=0.8), Hit(id=3, user_id=30, score=0.7)]
+    vectors = {1: np.array([0.6, 0.8], dtype=np.float32), 2: np.array([1.0, 0.0], dtype=np.float32)}
+    result = rerank(hits, np.array([2.0, 0.0]), vectors)
+    assert [(h.id, round(h.score, 3)) for h in result] == [(2, 1.0), (1, 0.6)]
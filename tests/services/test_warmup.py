@@ -0,0 +1,24 @@
+import pytest
+
+from app.core.config import settings
+from app.services import warmup
+
+
+@pytest.mark.asyncio
+async def test_failed_step_is_retried_until_ready(monkeypatch):
+    attempts = []
+
+    def flaky_store():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ConnectionError("milvus is not up yet")
+
+    monkeypatch.setattr(settings, "WARMUP_ON_STARTUP", True)
+    monkeypatch.setattr(settings, "WARMUP_RETRY_INITIAL_S", 0.001)
+    monkeypatch.setattr(warmup, "_warmup_vector_store", flaky_store)
+    monkeypatch.setattr(warmup, "start_inference", lambda: None)
+    monkeypatch.setattr(warmup, "_components", {"vector_store": False, "model": False})
+
+    await warmup.run_warmup()
+    assert len(attempts) == 3
+    assert warmup.is_ready()